@@ -0,0 +1,305 @@
+######## Goal:
+######## Fit the whole model grid of 5_1 / 6_1 (interaction and stratified models, 2y and 6m horizons, train and full
+######## samples) in one parallel run, then evaluate it the way 5_2 / 5_3 / 6_2 / 6_3 do
+########
+######## - every horizon x outcome contrast x formula x sample is one fit of scripts/fit_model_worker.R, run as its own
+########   Rscript process, --workers of them at a time, reading data/new_{h}/preprocessed_{full,train,test}.parquet
+########   (written by 4_preprocessing_{h}.R)
+######## - fits are cached in results/model_cache/<key>, key = sha256 of the data files, the formula, the contrast and
+########   the worker script; a rerun only refits what changed (--refit ignores the cache)
+######## - AUC (test set, train model), VIF (check_collinearity, from the fixed-effect vcov) and Nakagawa's R² (full
+########   model) are computed afterwards for all models at once
+######## Output: results/new_{h}/model_grid/{key_metrics,coefficients_all,vif,model_fit_stats}.csv
+########
+######## Run from src/analysis:
+########   python scripts/model_grid.py --workers 6
+########   python scripts/model_grid.py --horizons 6m --studies stratified --list
+
+import argparse
+import hashlib
+import json
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ANALYSIS_DIR = Path(__file__).resolve().parent.parent
+WORKER = ANALYSIS_DIR / "scripts" / "fit_model_worker.R"
+CACHE_DIR = ANALYSIS_DIR / "results" / "model_cache"
+
+HORIZONS = ["2y", "6m"]
+SAMPLES = ["train", "full"]
+
+PREDICTORS = [
+    "h_duration_log_std", "hackathon_size_std", "is_offline_event",
+    "avg_outside_repos_within_std", "avg_outside_repos_hackathon_mean_std",
+    "team_contributor_size_std", "common_event_num_std",
+]
+FORMULA_MAIN = "outcome_binary ~ " + " + ".join(PREDICTORS) + " + (1 | hackathon_id)"
+FORMULA_INTERACTION = ("outcome_binary ~ precolab + " + " + ".join(PREDICTORS) + " + "
+                       + " + ".join(f"precolab:{p}" for p in PREDICTORS) + " + (1 | hackathon_id)")
+
+# study -> contrasts (model name, positive outcomes, negative outcomes), as in 6_1_stratified_* and 5_1_interaction_*
+STUDIES = {
+    "stratified": {
+        "formula": FORMULA_MAIN,
+        "interaction": False,
+        "contrasts": [
+            ("Model1_Triggered_vs_Temporary", ["triggered"], ["temporary"]),
+            ("Model2_Sustained_vs_Terminated", ["sustained"], ["terminated"]),
+        ],
+    },
+    "interaction": {
+        "formula": FORMULA_INTERACTION,
+        "interaction": True,
+        "contrasts": [
+            ("Interaction_Model", ["triggered", "sustained"], ["temporary", "terminated"]),
+        ],
+    },
+}
+
+# logit link: distribution-specific variance of Nakagawa's R² (performance::r2_nakagawa)
+LOGIT_VARIANCE = np.pi ** 2 / 3
+
+
+# ────── Grid ─────────────────────────────────────────────────────────
+def data_path(horizon, sample):
+    return ANALYSIS_DIR / "data" / f"new_{horizon}" / f"preprocessed_{sample}.parquet"
+
+
+def build_grid(horizons, studies):
+    """One spec per fit; train fits carry the test set they are evaluated on"""
+    grid = []
+    for horizon in horizons:
+        for study in studies:
+            definition = STUDIES[study]
+            for model_name, positive, negative in definition["contrasts"]:
+                for sample in SAMPLES:
+                    grid.append({
+                        "horizon": horizon,
+                        "study": study,
+                        "model_name": model_name,
+                        "sample": sample,
+                        "formula": definition["formula"],
+                        "interaction": definition["interaction"],
+                        "positive": positive,
+                        "negative": negative,
+                        "data": str(data_path(horizon, sample)),
+                        "test": str(data_path(horizon, "test")) if sample == "train" else None,
+                    })
+    return grid
+
+
+# ────── Cache ────────────────────────────────────────────────────────
+@lru_cache(maxsize=None)
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(spec):
+    """Hash of everything the fit depends on; the formula is compared without whitespace"""
+    key = {
+        "data": file_hash(spec["data"]),
+        "test": file_hash(spec["test"]) if spec["test"] else None,
+        "formula": "".join(spec["formula"].split()),
+        "interaction": spec["interaction"],
+        "positive": sorted(spec["positive"]),
+        "negative": sorted(spec["negative"]),
+        "worker": file_hash(str(WORKER)),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:20]
+
+
+def is_cached(spec):
+    out_dir = Path(spec["out_dir"])
+    return (out_dir / "fit_stats.csv").exists() and (not spec["test"] or (out_dir / "predictions.csv").exists())
+
+
+# ────── Fitting ──────────────────────────────────────────────────────
+def fit(spec):
+    """Run one Rscript worker; its log goes next to its outputs"""
+    out_dir = Path(spec["out_dir"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    spec_file = out_dir / "spec.json"
+    spec_file.write_text(json.dumps(spec, indent=2), encoding="utf-8")
+    t_start = time.time()
+    with open(out_dir / "worker.log", "w", encoding="utf-8") as log:
+        result = subprocess.run(["Rscript", str(WORKER), str(spec_file)], cwd=ANALYSIS_DIR,
+                                stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"worker exited with {result.returncode}, see {out_dir / 'worker.log'}")
+    return time.time() - t_start
+
+
+def label(spec):
+    return f"{spec['horizon']} {spec['study']} {spec['model_name']} ({spec['sample']})"
+
+
+def run_grid(grid, workers):
+    todo = [spec for spec in grid if not is_cached(spec)]
+    print(f"{len(grid)} models, {len(grid) - len(todo)} cached, {len(todo)} to fit on {workers} workers")
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fit, spec): spec for spec in todo}
+        for n, future in enumerate(as_completed(futures), 1):
+            spec = futures[future]
+            try:
+                seconds = future.result()
+                print(f"  [{n}/{len(todo)}] {label(spec)}: {seconds / 60:.2f} min")
+            except Exception as e:
+                failures.append(spec)
+                print(f"  [{n}/{len(todo)}] {label(spec)}: FAILED - {e}")
+    return failures
+
+
+# ────── Batch evaluation ─────────────────────────────────────────────
+def read_all(grid, name, **kwargs):
+    """One file of every fit, stacked, with the grid columns in front"""
+    frames = []
+    for i, spec in enumerate(grid):
+        path = Path(spec["out_dir"]) / name
+        if path.exists():
+            frame = pd.read_csv(path, **kwargs)
+            frame.insert(0, "fit", i)
+            frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["fit"])
+
+
+def grid_columns(grid):
+    return pd.DataFrame([{k: spec[k] for k in ("horizon", "study", "model_name", "sample")} for spec in grid]) \
+        .rename_axis("fit").reset_index()
+
+
+def batch_auc(predictions):
+    """
+    AUC of every fit at once: Mann-Whitney U from average ranks within each fit. Oriented like pROC's
+    direction="auto" (the default in the R scripts): when the controls' median prediction is above the
+    cases', the curve is flipped and 1 - AUC is reported, so the value matches pROC::auc(roc(...)).
+    """
+    ranks = predictions.groupby("fit")["pred_prob"].rank(method="average")
+    positive = predictions["outcome_binary"] == 1
+    per_fit = pd.DataFrame({
+        "fit": predictions["fit"],
+        "pos_rank": ranks.where(positive, 0.0),
+        "n_pos": positive.astype(int),
+        "n": 1,
+    }).groupby("fit").sum()
+    n_neg = per_fit["n"] - per_fit["n_pos"]
+    u = per_fit["pos_rank"] - per_fit["n_pos"] * (per_fit["n_pos"] + 1) / 2
+    auc = u / (per_fit["n_pos"] * n_neg)
+    medians = predictions.groupby(["fit", positive])["pred_prob"].median().unstack().reindex(columns=[False, True])
+    flipped = (medians[False] > medians[True]).reindex(auc.index, fill_value=False)
+    auc = auc.where(~flipped, 1 - auc)
+    return pd.DataFrame({"auc_test": auc, "n_test": per_fit["n"]}).reset_index()
+
+
+def batch_vif(grid):
+    """VIF of every fit: diag(inv(cor(vcov))) without the intercept, inverted as one stacked batch per term count"""
+    blocks = {}
+    for i, spec in enumerate(grid):
+        path = Path(spec["out_dir"]) / "vcov.csv"
+        if path.exists():
+            vcov = pd.read_csv(path, index_col=0).drop(index="(Intercept)", columns="(Intercept)")
+            blocks.setdefault(len(vcov), []).append((i, vcov))
+    rows = []
+    for members in blocks.values():
+        v = np.stack([vcov.to_numpy() for _, vcov in members])
+        sd = np.sqrt(np.diagonal(v, axis1=1, axis2=2))
+        corr = v / (sd[:, :, None] * sd[:, None, :])
+        vif = np.diagonal(np.linalg.inv(corr), axis1=1, axis2=2)
+        for (i, vcov), values in zip(members, vif):
+            rows += [{"fit": i, "Term": term, "VIF": value} for term, value in zip(vcov.index, values)]
+    return pd.DataFrame(rows, columns=["fit", "Term", "VIF"])
+
+
+def batch_r2(fit_stats):
+    """Nakagawa's marginal / conditional R² for a random-intercept logit model, for every fit"""
+    total = fit_stats["fixed_var"] + fit_stats["hackathon_var"] + LOGIT_VARIANCE
+    return pd.DataFrame({
+        "fit": fit_stats["fit"],
+        "marginal_r2": fit_stats["fixed_var"] / total,
+        "conditional_r2": (fit_stats["fixed_var"] + fit_stats["hackathon_var"]) / total,
+        "n_full": fit_stats["n_obs"],
+    })
+
+
+def key_metrics(grid, fit_stats, auc):
+    """One row per contrast as in key_metrics.csv of 5_3 / 6_3: R² from the full fit, AUC from the train fit"""
+    fits = grid_columns(grid)
+    full = fits[fits["sample"] == "full"].merge(batch_r2(fit_stats), on="fit")
+    train = fits[fits["sample"] == "train"].merge(auc, on="fit")
+    keys = ["horizon", "study", "model_name"]
+    metrics = full[keys + ["marginal_r2", "conditional_r2", "n_full"]].merge(
+        train[keys + ["auc_test", "n_test"]], on=keys, how="outer")
+    positives = {(s["study"], s["model_name"]): (s["positive"], s["negative"]) for s in grid}
+    metrics.insert(3, "comparison", [" vs ".join("+".join(side) for side in positives[(st, m)])
+                                     for st, m in zip(metrics["study"], metrics["model_name"])])
+    return metrics
+
+
+def evaluate(grid):
+    fits = grid_columns(grid)
+    fit_stats = read_all(grid, "fit_stats.csv").drop(columns="model", errors="ignore")
+    coefficients = read_all(grid, "coefficients.csv")
+    predictions = read_all(grid, "predictions.csv")
+    auc = batch_auc(predictions) if len(predictions) else pd.DataFrame(columns=["fit", "auc_test", "n_test"])
+    vif = batch_vif(grid)
+    metrics = key_metrics(grid, fit_stats, auc)
+
+    outputs = {
+        "key_metrics.csv": metrics,
+        "coefficients_all.csv": fits.merge(coefficients, on="fit"),
+        "vif.csv": fits.merge(vif, on="fit"),
+        "model_fit_stats.csv": fits.merge(fit_stats, on="fit"),
+    }
+    for horizon in sorted({spec["horizon"] for spec in grid}):
+        out_dir = ANALYSIS_DIR / "results" / f"new_{horizon}" / "model_grid"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for name, frame in outputs.items():
+            frame[frame["horizon"] == horizon].drop(columns="fit", errors="ignore") \
+                .round(4).to_csv(out_dir / name, index=False)
+        print(f"Saved: {out_dir.relative_to(ANALYSIS_DIR)}/{{{','.join(outputs)}}}")
+    print(metrics.round(4).to_string(index=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit and evaluate the interaction / stratified model grid in parallel")
+    parser.add_argument("--horizons", nargs="+", choices=HORIZONS, default=HORIZONS)
+    parser.add_argument("--studies", nargs="+", choices=list(STUDIES), default=list(STUDIES))
+    parser.add_argument("--workers", type=int, default=4, help="concurrent Rscript processes")
+    parser.add_argument("--refit", action="store_true", help="ignore cached fits")
+    parser.add_argument("--list", action="store_true", help="print the grid and cache state, fit nothing")
+    args = parser.parse_args()
+
+    grid = build_grid(args.horizons, args.studies)
+    missing = sorted({p for spec in grid for p in (spec["data"], spec["test"]) if p and not Path(p).exists()})
+    if missing:
+        sys.exit("Missing datasets (run 4_preprocessing_{2y,6m}.R first):\n  " + "\n  ".join(missing))
+    for spec in grid:
+        spec["out_dir"] = str(CACHE_DIR / cache_key(spec))
+
+    if args.list:
+        for spec in grid:
+            print(f"{label(spec):70} {'cached' if is_cached(spec) else 'to fit'}  {Path(spec['out_dir']).name}")
+        return
+    if args.refit:
+        for spec in grid:
+            (Path(spec["out_dir"]) / "fit_stats.csv").unlink(missing_ok=True)
+
+    failures = run_grid(grid, args.workers)
+    evaluate(grid)
+    if failures:
+        sys.exit(f"{len(failures)} fits failed")
+
+
+if __name__ == "__main__":
+    main()
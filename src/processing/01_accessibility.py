@@ -1,24 +1,33 @@
-import requests
+import os
 import time
 import threading
-import pandas as pd
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from queue import Queue
 from datetime import datetime
 import pytz
+from collector_metrics import metrics, start_metrics, token_label
+from devpost_io import read_devpost
+from github_tokens import ConcurrencyGate, estimate_graphql_cost, parse_reset_at, with_rate_limit
+from repo_registry import parse_github_url
+from response_archive import ARCHIVE
 
 TOKENS = [
 ]
-MAX_WORKERS = 10  # Number of concurrent threads
+if os.getenv("TOKENS"):
+    TOKENS = [t.strip() for t in os.getenv("TOKENS").split(",") if t.strip()]
+TOKENS = ARCHIVE.tokens(TOKENS)
+GITHUB_API = os.getenv("GITHUB_API", "https://api.github.com")
+MAX_WORKERS = 32  # Max concurrent threads; GATE adapts how many requests actually run at once
 BATCH_SIZE = 100   # DataFrame batch size
 GRAPHQL_BATCH = 100 # Max repos per GraphQL request
+GATE = ConcurrencyGate(initial=10, maximum=MAX_WORKERS)
 
 class TokenManager:
     """Token load balancing manager"""
     def __init__(self, tokens):
         self.tokens = tokens
-        self.token_info = {token: {"remaining": 0, "resetAt": 0} for token in tokens}
+        self.token_info = {token: {"remaining": 0, "resetAt": 0, "blockedUntil": 0} for token in tokens}
         self.lock = threading.Lock()
 
     def update_token_info(self, token, remaining, reset_time):
@@ -26,24 +35,37 @@ class TokenManager:
         with self.lock:
             self.token_info[token]["remaining"] = remaining
             self.token_info[token]["resetAt"] = reset_time
+        metrics.set("github_token_remaining", remaining, token=token_label(token), family="graphql")
+
+    def charge(self, token, cost):
+        """Reserve the forecast cost of a query on the token before it is sent"""
+        with self.lock:
+            self.token_info[token]["remaining"] -= cost
+
+    def block(self, token, seconds):
+        """Hold a throttled token back for exactly the wait GitHub asked for"""
+        with self.lock:
+            info = self.token_info[token]
+            info["blockedUntil"] = max(info["blockedUntil"], time.time() + seconds)
 
     def get_best_token(self):
         """Choose the best available token"""
         with self.lock:
-            # Prefer tokens with remaining > 0
+            now = time.time()
+            # Prefer tokens with remaining > 0 that are not throttled
             available_tokens = [
-                (token, info) for token, info in self.token_info.items() if info["remaining"] > 0
+                (token, info) for token, info in self.token_info.items()
+                if info["remaining"] > 0 and info["blockedUntil"] <= now
             ]
             if available_tokens:
                 # Choose the one with most remaining
                 best_token = max(available_tokens, key=lambda x: x[1]["remaining"])[0]
                 return best_token
 
-            # If all tokens are exhausted, choose the one resetting soonest
-            exhausted_tokens = [
-                (token, info) for token, info in self.token_info.items()
-            ]
-            best_token = min(exhausted_tokens, key=lambda x: x[1]["resetAt"])[0]
+            # If all tokens are exhausted or throttled, choose the one usable soonest
+            def usable_at(info):
+                return max(info["blockedUntil"], info["resetAt"] if info["remaining"] <= 0 else 0)
+            best_token = min(self.token_info.items(), key=lambda x: usable_at(x[1]))[0]
             return best_token
 
 class GraphQLRateLimiter:
@@ -56,8 +78,8 @@ class GraphQLRateLimiter:
         """Update rate limit info for a token"""
         headers = {'Authorization': f'token {token}'}
         query = '{ rateLimit { remaining resetAt } }'
-        response = requests.post('https://api.github.com/graphql', 
-                                 json={'query': query}, headers=headers)
+        response = ARCHIVE.request("POST", f'{GITHUB_API}/graphql',
+                                   json={'query': query}, headers=headers)
         if response.status_code == 200:
             data = response.json()
             rate_limit = data.get("data", {}).get("rateLimit", {})
@@ -73,39 +95,50 @@ class GraphQLRateLimiter:
         else:
             raise Exception(f"Failed to fetch rate limit info for token {token}")
 
-    def wait_for_token(self):
+    def wait_for_token(self, cost=1):
+        """
+        Return a token with at least `cost` points left and charge the cost to it.
+        The rateLimit query is only sent when a token's budget is unknown or its reset time has passed;
+        otherwise the budget reported by the previous response is used.
+        """
         while True:
-            self.current_token = self.token_manager.get_best_token()
+            token = self.token_manager.get_best_token()
+            self.current_token = token
+            info = self.token_manager.token_info[token]
+
+            blocked = info["blockedUntil"] - time.time()
+            if blocked > 0:
+                print(f"All tokens throttled, sleeping {blocked:.1f}s (Retry-After)")
+                metrics.inc("github_backoff_sleep_seconds_total", blocked, reason="secondary_limit")
+                time.sleep(blocked)
+                continue
 
             try:
-                remaining, reset_time = self._update_limits(self.current_token)
+                if info["resetAt"] == 0 or (info["remaining"] < cost and time.time() >= info["resetAt"]):
+                    remaining, reset_time = self._update_limits(token)
+                else:
+                    remaining, reset_time = info["remaining"], info["resetAt"]
 
-                if remaining > 0:
-                    return
+                if remaining >= cost:
+                    self.token_manager.charge(token, cost)
+                    return token
                 else:
                     sleep_time = reset_time - time.time()
                     if sleep_time > 0:
                         print(f"Token exhausted, sleeping {sleep_time:.1f}s")
+                        metrics.inc("github_backoff_sleep_seconds_total", sleep_time + 5, reason="quota_exhausted")
                         time.sleep(sleep_time + 5)
             except Exception as e:
                 print(f"Error updating token limits: {e}")
+                metrics.inc("github_backoff_sleep_seconds_total", 10, reason="rate_limit_check_failed")
                 time.sleep(10)
 
-def parse_github_url(url):
-    """Parse GitHub URL to return (owner, repo)"""
-    parts = url.rstrip('/').split('/')
-    if len(parts) >= 5 and parts[2] == 'github.com':
-        return parts[3], parts[4]
-    return None, None
-
 def batch_check(urls, limiter):
     """Batch check a list of URLs for accessibility"""
-    limiter.wait_for_token()
-    
     query_parts = []
     valid_urls = []
     for idx, url in enumerate(urls):
-        owner, repo = parse_github_url(url)
+        owner, repo = parse_github_url(url, strict=True)
         if owner and repo: # only when the url is a valid github repo url, this url will have an aliases repo_{idx}
             query_parts.append(f'repo_{idx}: repository(owner: "{owner}", name: "{repo}") {{ id }}')
             valid_urls.append(url)
@@ -113,19 +146,48 @@ def batch_check(urls, limiter):
     if not query_parts:
         return {url: False for url in urls}
     
-    query = 'query {' + '\n'.join(query_parts) + '}'
-    
-    headers = {'Authorization': f'token {limiter.current_token}'}
-    response = requests.post(
-        'https://api.github.com/graphql',
-        json={'query': query},
-        headers=headers,
-        timeout=15
-    )
+    query = with_rate_limit('query {' + '\n'.join(query_parts) + '}')
+    cost = estimate_graphql_cost(query)
+
+    while True:
+        token = limiter.wait_for_token(cost)
+
+        headers = {'Authorization': f'token {token}'}
+        label = token_label(token)
+        metrics.add("github_token_in_flight", 1, token=label)
+        with GATE.slot() as started:
+            try:
+                response = ARCHIVE.request(
+                    "POST", f'{GITHUB_API}/graphql',
+                    json={'query': query},
+                    headers=headers,
+                    timeout=15
+                )
+            except Exception:
+                GATE.record(started)
+                raise
+            finally:
+                elapsed = time.time() - started
+                metrics.add("github_token_in_flight", -1, token=label)
+                metrics.inc("github_token_busy_seconds_total", elapsed, token=label)
+        metrics.observe("github_request_duration_seconds", elapsed, endpoint="graphql", status=response.status_code)
+
+        throttled, wait = GATE.record(started, response.status_code, response.headers,
+                                      response.text if response.status_code in (200, 403, 429) else "", elapsed)
+        if not throttled:
+            break
+        # secondary limit / exhausted budget: park this token and retry the batch on another one
+        limiter.token_manager.block(token, wait)
+        metrics.inc("github_retries_total", endpoint="graphql", reason=throttled)
     
     results = {}
     if response.status_code == 200:
-        data = response.json().get('data', {})
+        data = response.json().get('data') or {}
+        rate_limit = data.get('rateLimit')
+        if rate_limit:
+            # settle the reserved forecast with the points GitHub actually charged
+            cost = rate_limit.get('cost', cost)
+            limiter.token_manager.update_token_info(token, rate_limit['remaining'], parse_reset_at(rate_limit['resetAt']))
         for idx, url in enumerate(urls):
             if idx < len(valid_urls): 
             # if url in valid_urls:
@@ -137,13 +199,7 @@ def batch_check(urls, limiter):
         print(f"GraphQL request failed: {response.status_code}")
         results = {url: False for url in urls}
     
-    remaining = limiter.token_manager.token_info[limiter.current_token]["remaining"]
-    limiter.token_manager.update_token_info(
-        limiter.current_token,
-        remaining - 1,
-        limiter.token_manager.token_info[limiter.current_token]["resetAt"]
-    )
-    
+    metrics.inc("github_token_quota_used_total", cost, token=label, family="graphql")
     return results
 
 def process_row(urls_str, limiter):
@@ -180,7 +236,9 @@ def process_dataframe(df):
             )
             futures[future] = idx
         
+        metrics.set("collector_queue_depth", len(futures), queue="rows")
         for future in tqdm(as_completed(futures), total=len(futures)):
+            metrics.add("collector_queue_depth", -1, queue="rows")
             idx = futures[future]
             try:
                 df.at[idx, 'accessibility'] = future.result()
@@ -191,7 +249,8 @@ def process_dataframe(df):
     return df
 
 if __name__ == "__main__":
-    project = pd.read_csv('../data/projects.csv')
+    start_metrics("01_accessibility")
+    project = read_devpost('projects', '../data', columns=['submitted_to_link', 'project_URL', 'github_links'])
 
     project_filtered = project[['submitted_to_link', 'project_URL', 'github_links']]
     project_filtered = project_filtered.dropna(subset=['submitted_to_link', 'project_URL', 'github_links'])
@@ -1,8 +1,8 @@
 import os
 import sys
+import json
 import time
 import asyncio
-import requests
 import psycopg2
 import pytz
 
@@ -10,6 +10,11 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 from tqdm import tqdm
+from collector_metrics import metrics, start_metrics, loop_monitor
+from commit_author_cache import CommitAuthorCache
+from github_tokens import TokenManager, with_rate_limit
+from repo_registry import canonical_repo_names
+from response_archive import ARCHIVE
 
 
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
@@ -23,64 +28,22 @@ DB_DSN = (
 )
 
 TOKENS = [t.strip() for t in os.getenv("TOKENS", "").split(",") if t.strip()]
+TOKENS = ARCHIVE.tokens(TOKENS)
 if not TOKENS:
     sys.exit("Set TOKENS=ghp_xxx,... in .env")
 
-GITHUB_API = "https://api.github.com"
+GITHUB_API = os.getenv("GITHUB_API", "https://api.github.com")
 PER_PAGE = 100
+FAMILY = "core"
 MAX_RETRIES = 3
+# rest: GET /repos/{repo}/commits, one repo per request, full commit objects
+# graphql: defaultBranchRef history selecting only author.user.login, GRAPHQL_REPOS_PER_QUERY repos aliased per request
+COMMIT_BACKEND = os.getenv("COMMIT_BACKEND", "rest")
+GRAPHQL_REPOS_PER_QUERY = int(os.getenv("GRAPHQL_REPOS_PER_QUERY", "25"))
+# answer project windows from the repo x day author cache (commit_author_cache.py), fetching only uncovered days
+COMMIT_CACHE = os.getenv("COMMIT_CACHE", "1") != "0"
 
-class TokenState:
-    __slots__ = ("token", "remaining", "reset", "in_use")
-    def __init__(self, token):
-        self.token = token
-        self.remaining = 5000
-        self.reset = 0
-        self.in_use = False
-
-
-class TokenManager:
-    def __init__(self, tokens, per_token_concurrency=5):
-        self.tokens = [TokenState(t) for t in tokens]
-        self.permit = asyncio.Semaphore(len(tokens) * per_token_concurrency)
-        self.lock = asyncio.Lock()
-
-    async def acquire(self):
-        await self.permit.acquire()
-        while True:
-            async with self.lock:
-                now = time.time()
-                for t in self.tokens:
-                    if t.remaining == 0 and now >= t.reset:
-                        t.remaining = 5000
-                    if t.remaining > 0 and not t.in_use:
-                        t.in_use = True
-                        t.remaining -= 1
-                        return t
-
-                active = [t for t in self.tokens if t.remaining > 0]
-                sleep_sec = 5 if active else max(min(t.reset for t in self.tokens) - now + 5, 5)
-                print(f"⏳ Waiting {sleep_sec:.1f}s for available token...")
-            await asyncio.sleep(sleep_sec)
-
-    async def release(self, t: TokenState, headers):
-        async with self.lock:
-            t.in_use = False
-            if "X-RateLimit-Remaining" in headers:
-                t.remaining = int(headers["X-RateLimit-Remaining"])
-
-        if "X-RateLimit-Reset" in headers:
-            try:
-                t.reset = float(headers["X-RateLimit-Reset"])
-            except:
-                t.reset = time.time() + 300
-        else:
-            t.reset = time.time() + 300
-
-        self.permit.release()
-
-
-tm = TokenManager(TOKENS)
+tm = TokenManager(TOKENS, family=FAMILY)
 
 
 def inclusive_since(start_date):
@@ -92,11 +55,37 @@ def inclusive_until(end_date):
     return until_dt.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ') 
 
 
-async def fetch_repo_contributors(repo, since_iso, until_iso):
-    contributors = set()
+# ────── Repo histories ───────────────────────────────────────────────
+class RepoHistory:
+    """Fetch state of one repo's default-branch history between two instants"""
+
+    def __init__(self, repo, since_iso, until_iso, dated=False):
+        self.repo = repo
+        self.since_iso = since_iso
+        self.until_iso = until_iso
+        self.dated = dated          # keep (committed_at, login) pairs for the cache
+        self.cursor = None
+        self.contributors = set()
+        self.commits = []
+        self.retry = 0
+        self.error = None
+        self.complete = False
+
+    def add(self, login, committed_at):
+        self.contributors.add(login)
+        if self.dated:
+            self.commits.append((committed_at, login))
+
+    def result(self):
+        # a repo counts as fetched when at least one author was found in the window
+        return len(self.contributors) > 0, self.contributors, self.error
+
+
+# ────── REST backend ─────────────────────────────────────────────────
+async def fetch_repo_contributors(h):
+    """Page through GET /repos/{repo}/commits for one RepoHistory"""
     page = 1
     retry = 0
-    last_error = None
 
     while True:
         token_state = await tm.acquire()
@@ -106,46 +95,48 @@ async def fetch_repo_contributors(repo, since_iso, until_iso):
         }
 
         try:
-            resp = requests.get(
-                f"{GITHUB_API}/repos/{repo}/commits",
+            t0 = time.time()
+            resp = await ARCHIVE.arequest(
+                "GET", f"{GITHUB_API}/repos/{h.repo}/commits",
                 headers=headers,
                 params={
-                    "since": since_iso,
-                    "until": until_iso,
+                    "since": h.since_iso,
+                    "until": h.until_iso,
                     "per_page": PER_PAGE,
                     "page": page,
                 },
                 timeout=30,
             )
-
-            if resp.status_code == 403:
-                retry += 1
-                last_error = "403 rate limited"
-                await tm.release(token_state, resp.headers)
-                if retry > MAX_RETRIES:
-                    break
-                await asyncio.sleep(5)
+            elapsed = time.time() - t0
+            metrics.observe("github_request_duration_seconds", elapsed,
+                            endpoint="/repos/{r}/commits", status=resp.status_code)
+
+            throttled = await tm.release_response(token_state, resp, elapsed)
+            if throttled:
+                # the token is held back for exactly Retry-After (or until reset); retry without counting a failure
+                metrics.inc("github_retries_total", endpoint="/repos/{r}/commits", reason=throttled)
                 continue
 
             if resp.status_code != 200:
                 retry += 1
-                last_error = f"HTTP {resp.status_code}"
-                await tm.release(token_state, resp.headers)
+                h.error = f"HTTP {resp.status_code}"
                 if retry > MAX_RETRIES:
                     break
+                metrics.inc("github_retries_total", endpoint="/repos/{r}/commits", reason=f"http_{resp.status_code}")
+                metrics.inc("github_backoff_sleep_seconds_total", 2 ** retry, reason="retry")
                 await asyncio.sleep(2 ** retry)
                 continue
 
             data = resp.json()
-            await tm.release(token_state, resp.headers)
 
             if not data:
+                h.complete = True
                 break
 
             for c in data:
                 author = c.get("author")
                 if author and author.get("login"):
-                    contributors.add(author["login"])
+                    h.add(author["login"], (c["commit"].get("committer") or c["commit"]["author"])["date"])
 
             page += 1
             retry = 0
@@ -153,90 +144,282 @@ async def fetch_repo_contributors(repo, since_iso, until_iso):
         except Exception as e:
             await tm.release(token_state, {})
             retry += 1
-            last_error = str(e)
+            h.error = str(e)
             if retry > MAX_RETRIES:
                 break
+            metrics.inc("github_retries_total", endpoint="/repos/{r}/commits", reason=type(e).__name__)
+            metrics.inc("github_backoff_sleep_seconds_total", 2 ** retry, reason="retry")
             await asyncio.sleep(2 ** retry)
 
-    success = len(contributors) > 0
-    return success, contributors, last_error
 
+async def fetch_repo_histories(histories):
+    for h in histories:
+        await fetch_repo_contributors(h)
 
-async def main():
-    conn = psycopg2.connect(DB_DSN)
-    conn.autocommit = True
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT project_id, github_repos, start_date, end_date
-        FROM public.projects_clean
-        WHERE github_repos IS NOT NULL
-          AND start_date IS NOT NULL
-          AND end_date IS NOT NULL
-          AND (
-                contributors_during_status IS NULL
-             OR contributors_during_status = 'partial'
-          )
-        ORDER BY project_id
-    """)
-
-    rows = cur.fetchall()
-    print(f"Projects to process: {len(rows)}")
-
-    stats = {"done": 0, "partial": 0, "failed": 0}
-
-    with tqdm(total=len(rows), desc="Processing projects") as pbar:
-        for project_id, github_repos, start_date, end_date in rows:
-            since_iso = inclusive_since(start_date)
-            until_iso = inclusive_until(end_date)
-
-            all_contributors = set()
-            success_repos = 0
-            failed_repos = 0
-            errors = []
-
-            for repo in github_repos:
-                ok, users, err = await fetch_repo_contributors(repo, since_iso, until_iso)
-                if ok:
-                    success_repos += 1
-                    all_contributors.update(users)
-                else:
-                    failed_repos += 1
-                    if err:
-                        errors.append(f"{repo}: {err}")
-
-            if success_repos > 0 and failed_repos == 0:
-                status = "done"
-            elif success_repos > 0:
-                status = "partial"
-            else:
-                status = "failed"
-
-            cur.execute(
-                """
-                UPDATE public.projects_clean
-                SET contributors_during = %s,
-                    contributors_during_status = %s,
-                    contributors_during_error = %s
-                WHERE project_id = %s
-                """,
-                (
-                    list(all_contributors),
-                    status,
-                    "; ".join(errors)[:1000] if errors else None,
-                    project_id,
-                ),
-            )
 
-            stats[status] += 1
-            pbar.update(1)
-            pbar.set_postfix(stats)
+# ────── GraphQL backend ──────────────────────────────────────────────
+HISTORY_FIELDS = "pageInfo {{ hasNextPage endCursor }} nodes {{ {}author {{ user {{ login }} }} }}"
+
 
-    cur.close()
-    conn.close()
+def history_selection(h, alias):
+    owner, name = h.repo.split("/", 1)
+    after = f", after: {json.dumps(h.cursor)}" if h.cursor else ""
+    fields = HISTORY_FIELDS.format("committedDate " if h.dated else "")
+    return (
+        f"{alias}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+        f"{{ defaultBranchRef {{ target {{ ... on Commit {{ "
+        f"history(since: {json.dumps(h.since_iso)}, until: {json.dumps(h.until_iso)}, first: {PER_PAGE}{after}) "
+        f"{{ {fields} }} }} }} }} }}"
+    )
 
-    print("Finished.")
-    print(stats)
+
+async def fetch_histories(histories):
+    """
+    Page through the commit history of many repos at once: every request aliases up to
+    GRAPHQL_REPOS_PER_QUERY repos, each advancing by one page; a repo keeps its slot until its
+    last page and finished repos are replaced by waiting ones.
+    """
+    waiting = [h for h in reversed(histories) if h.repo.count("/") == 1]
+    for h in histories:
+        if h.repo.count("/") != 1:
+            h.error = "invalid repo name"
+    active = []
+
+    while waiting or active:
+        while waiting and len(active) < GRAPHQL_REPOS_PER_QUERY:
+            active.append(waiting.pop())
+        aliases = {f"r{i}": h for i, h in enumerate(active)}
+        query = with_rate_limit("query {\n" + "\n".join(history_selection(h, a) for a, h in aliases.items()) + "\n}")
+
+        lease = await tm.acquire(query=query, family="graphql")
+        try:
+            t0 = time.time()
+            resp = await ARCHIVE.arequest(
+                "POST", f"{GITHUB_API}/graphql",
+                headers={"Authorization": f"Bearer {lease.token}"},
+                json={"query": query},
+                timeout=60,
+            )
+            elapsed = time.time() - t0
+            metrics.observe("github_request_duration_seconds", elapsed, endpoint="graphql", status=resp.status_code)
+            throttled = await tm.release_response(lease, resp, elapsed)
+            body = resp.json() if resp.status_code == 200 else {}
+        except Exception as e:
+            await tm.release(lease, {})
+            throttled, resp, body = None, None, {}
+            failure = type(e).__name__
+            error = str(e)
+        else:
+            failure = f"http_{resp.status_code}"
+            error = f"HTTP {resp.status_code}"
+
+        if throttled:
+            metrics.inc("github_retries_total", endpoint="graphql", reason=throttled)
+            continue
+
+        data = body.get("data")
+        if data is None:
+            # the whole request failed: every repo in it counts a retry
+            if body.get("errors"):
+                failure, error = "graphql_error", str(body["errors"])[:300]
+            for h in active:
+                h.retry += 1
+                h.error = error
+            active = [h for h in active if h.retry <= MAX_RETRIES]
+            backoff = 2 ** max((h.retry for h in active), default=1)
+            metrics.inc("github_retries_total", endpoint="graphql", reason=failure)
+            metrics.inc("github_backoff_sleep_seconds_total", backoff, reason="retry")
+            await asyncio.sleep(backoff)
+            continue
+
+        alias_errors = {e["path"][0]: e.get("message") for e in body.get("errors", []) if e.get("path")}
+        active = []
+        for alias, h in aliases.items():
+            node = data.get(alias)
+            if node is None:
+                h.error = alias_errors.get(alias, "repository not found")
+                continue
+            branch = node.get("defaultBranchRef")
+            if branch is None:
+                h.error = "empty repository"
+                continue
+            history = branch["target"]["history"]
+            for commit in history["nodes"]:
+                user = (commit.get("author") or {}).get("user")
+                if user and user.get("login"):
+                    h.add(user["login"], commit.get("committedDate"))
+            h.retry = 0
+            h.error = None
+            if history["pageInfo"]["hasNextPage"]:
+                h.cursor = history["pageInfo"]["endCursor"]
+                active.append(h)
+            else:
+                h.complete = True
+
+
+# ────── Projects ─────────────────────────────────────────────────────
+def project_status(results, repos):
+    """done / partial / failed, the contributors found and the per-repo errors of one project"""
+    all_contributors = set()
+    errors = []
+    success_repos = failed_repos = 0
+    for repo, (ok, users, err) in zip(repos, results):
+        if ok:
+            success_repos += 1
+            all_contributors.update(users)
+        else:
+            failed_repos += 1
+            if err:
+                errors.append(f"{repo}: {err}")
+
+    if success_repos > 0 and failed_repos == 0:
+        status = "done"
+    elif success_repos > 0:
+        status = "partial"
+    else:
+        status = "failed"
+    return status, all_contributors, errors
+
+
+def merge_ranges(ranges):
+    """Union of [lo, hi) ranges; adjacent ranges are joined"""
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return [tuple(r) for r in merged]
+
+
+async def project_results(rows, fetch, per_round):
+    """(project_id, project_status) of every row, fetching the repo windows of per_round projects at once"""
+    for i in range(0, len(rows), per_round):
+        chunk = rows[i:i + per_round]
+        histories = [
+            [RepoHistory(repo, inclusive_since(start_date), inclusive_until(end_date)) for repo in github_repos]
+            for _, github_repos, start_date, end_date in chunk
+        ]
+        await fetch([h for project in histories for h in project])
+        for (project_id, github_repos, _, _), project in zip(chunk, histories):
+            yield project_id, project_status([h.result() for h in project], github_repos)
+
+
+async def cached_project_results(rows, fetch, per_round, cache):
+    """
+    project_results answered from the repo x day cache: per repo, the days of the chunk's windows not
+    covered yet are merged into ranges and fetched once, stored, and every window is then read back
+    from the cache. Ranges whose fetch did not complete are not stored; their commits still count
+    for the windows of this run.
+    """
+    for i in range(0, len(rows), per_round):
+        chunk = rows[i:i + per_round]
+        windows = [[(repo, *cache.window_days(start_date, end_date)) for repo in github_repos]
+                   for _, github_repos, start_date, end_date in chunk]
+
+        missing = {}
+        for repo, first, end in (w for project in windows for w in project):
+            missing.setdefault(repo, []).extend(cache.uncovered(repo, first, end))
+        fetched = {
+            repo: [(lo, hi, RepoHistory(repo, cache.day_iso(lo), cache.day_iso(hi), dated=True))
+                   for lo, hi in merge_ranges(ranges)]
+            for repo, ranges in missing.items()
+        }
+        await fetch([h for ranges in fetched.values() for _, _, h in ranges])
+
+        t_db = time.time()
+        for repo, ranges in fetched.items():
+            for lo, hi, h in ranges:
+                if h.complete:
+                    cache.store(repo, lo, hi, h.commits)
+        metrics.observe("db_write_seconds", time.time() - t_db, table="repo_commit_author_days")
+
+        for (project_id, github_repos, _, _), project in zip(chunk, windows):
+            results = []
+            for repo, first, end in project:
+                contributors = cache.authors(repo, first, end)
+                error = None
+                for lo, hi, h in fetched.get(repo, []):
+                    if h.complete or hi <= first or lo >= end:
+                        continue
+                    contributors.update(login for committed_at, login in h.commits
+                                        if first <= cache.day_of(committed_at) < end)
+                    error = error or h.error
+                results.append((len(contributors) > 0, contributors, error))
+            yield project_id, project_status(results, github_repos)
+
+
+async def main():
+    start_metrics("02_get_contributors_commitAPI")
+    async with loop_monitor():
+        conn = psycopg2.connect(DB_DSN)
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        cur.execute("""
+            SELECT project_id, github_repos, start_date, end_date
+            FROM public.projects_clean
+            WHERE github_repos IS NOT NULL
+              AND start_date IS NOT NULL
+              AND end_date IS NOT NULL
+              AND (
+                    contributors_during_status IS NULL
+                 OR contributors_during_status = 'partial'
+              )
+            ORDER BY project_id
+        """)
+
+        rows = cur.fetchall()
+        print(f"Projects to process: {len(rows)}")
+
+        # names the repo registry resolved collapse onto the repo's current name, so a renamed repo is fetched once
+        canonical = canonical_repo_names(cur, {repo for _, github_repos, _, _ in rows for repo in github_repos})
+        rows = [(project_id, list(dict.fromkeys(canonical.get(repo, repo) for repo in github_repos)), start_date, end_date)
+                for project_id, github_repos, start_date, end_date in rows]
+
+        stats = {"done": 0, "partial": 0, "failed": 0}
+
+        if COMMIT_BACKEND == "graphql":
+            # enough projects per round that the aliased requests stay full while long histories page on
+            fetch, per_round = fetch_histories, max(GRAPHQL_REPOS_PER_QUERY, 1) * 4
+        else:
+            fetch, per_round = fetch_repo_histories, 1
+        cache = CommitAuthorCache(DB_DSN) if COMMIT_CACHE else None
+        results = cached_project_results(rows, fetch, per_round, cache) if cache else project_results(rows, fetch, per_round)
+        print(f"Commit backend: {COMMIT_BACKEND}, cache: {'on' if cache else 'off'}")
+
+        with tqdm(total=len(rows), desc="Processing projects") as pbar:
+            async for project_id, (status, all_contributors, errors) in results:
+                t_db = time.time()
+                cur.execute(
+                    """
+                    UPDATE public.projects_clean
+                    SET contributors_during = %s,
+                        contributors_during_status = %s,
+                        contributors_during_error = %s
+                    WHERE project_id = %s
+                    """,
+                    (
+                        list(all_contributors),
+                        status,
+                        "; ".join(errors)[:1000] if errors else None,
+                        project_id,
+                    ),
+                )
+
+                metrics.observe("db_write_seconds", time.time() - t_db, table="projects_clean")
+                metrics.inc("collector_items_total", outcome=status)
+                stats[status] += 1
+                pbar.update(1)
+                pbar.set_postfix(stats)
+
+        cur.close()
+        conn.close()
+        if cache:
+            cache.close()
+
+        print("Finished.")
+        print(stats)
 
 
 if __name__ == "__main__":
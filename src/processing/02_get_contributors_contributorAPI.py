@@ -1,8 +1,6 @@
 import pandas as pd
-import requests
 import time
 import random
-from urllib.parse import urlparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from collections import deque
 import threading
@@ -10,24 +8,34 @@ import os
 from tqdm import tqdm
 from datetime import datetime
 import pytz
+from collector_metrics import metrics, start_metrics, token_label
+from devpost_io import read_devpost
+from github_tokens import ConcurrencyGate
+from repo_registry import parse_github_url
+from response_archive import ARCHIVE
 
 
 TOKENS = [
     
 ]  
+if os.getenv("TOKENS"):
+    TOKENS = [t.strip() for t in os.getenv("TOKENS").split(",") if t.strip()]
+TOKENS = ARCHIVE.tokens(TOKENS)
+GITHUB_API = os.getenv("GITHUB_API", "https://api.github.com")
 
-INPUT_CSV = '../data/hackathon_project.csv'
+DATA_DIR = '../data'  # reads hackathon_project through devpost_io
 OUTPUT_CSV = 'hackathon_project_contributor.csv'
-THREADS = 10               # Number of total threads
+THREADS = 32               # Max number of threads; GATE adapts how many requests actually run at once
 REQUEST_DELAY = (0.1, 0.3) # Random delay range (seconds)
 MAX_RETRIES = 3            # Max retry times per request
+GATE = ConcurrencyGate(initial=10, maximum=THREADS)
 
 
 class TokenManager:
     """Multi-token load balancing manager"""
     def __init__(self, tokens):
         self.tokens = tokens
-        self.token_info = {token: {"remaining": 0, "resetAt": 0} for token in tokens}
+        self.token_info = {token: {"remaining": 0, "resetAt": 0, "blockedUntil": 0} for token in tokens}
         self.lock = threading.Lock()
 
     def update_token_info(self, token, remaining, reset_time):
@@ -35,23 +43,31 @@ class TokenManager:
         with self.lock:
             self.token_info[token]["remaining"] = remaining
             self.token_info[token]["resetAt"] = reset_time
+        metrics.set("github_token_remaining", remaining, token=token_label(token))
+
+    def block(self, token, seconds):
+        """Hold a throttled token back for exactly the wait GitHub asked for"""
+        with self.lock:
+            info = self.token_info[token]
+            info["blockedUntil"] = max(info["blockedUntil"], time.time() + seconds)
 
     def get_best_token(self):
         """Select the best token"""
         with self.lock:
-            # Prefer tokens with remaining > 0
+            now = time.time()
+            # Prefer tokens with remaining > 0 that are not throttled
             available_tokens = [
-                (token, info) for token, info in self.token_info.items() if info["remaining"] > 0
+                (token, info) for token, info in self.token_info.items()
+                if info["remaining"] > 0 and info["blockedUntil"] <= now
             ]
             if available_tokens:
                 best_token = max(available_tokens, key=lambda x: x[1]["remaining"])[0]
                 return best_token
 
-            # All tokens exhausted, choose the one that resets earliest
-            exhausted_tokens = [
-                (token, info) for token, info in self.token_info.items()
-            ]
-            best_token = min(exhausted_tokens, key=lambda x: x[1]["resetAt"])[0]
+            # All tokens exhausted or throttled, choose the one usable soonest
+            def usable_at(info):
+                return max(info["blockedUntil"], info["resetAt"] if info["remaining"] <= 0 else 0)
+            best_token = min(self.token_info.items(), key=lambda x: usable_at(x[1]))[0]
             return best_token
 
 # GraphQL and REST API have different rate limits!
@@ -65,7 +81,7 @@ class RateLimiter:
         """Update rate limit info using REST API (main change)"""
         headers = {'Authorization': f'token {token}'}
         try:
-            response = requests.get('https://api.github.com/rate_limit', headers=headers, timeout=10)
+            response = ARCHIVE.request("GET", f'{GITHUB_API}/rate_limit', headers=headers, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -86,11 +102,20 @@ class RateLimiter:
         """When all tokens are exhausted, wait for the earliest reset"""
         while True:
             try:
-                self.current_token = self.token_manager.get_best_token()
-                remaining, reset_time = self._update_limits(self.current_token)
+                token = self.token_manager.get_best_token()
+                self.current_token = token
+
+                blocked = self.token_manager.token_info[token]["blockedUntil"] - time.time()
+                if blocked > 0:
+                    print(f"All tokens throttled, waiting {blocked:.1f}s (Retry-After)")
+                    metrics.inc("github_backoff_sleep_seconds_total", blocked, reason="secondary_limit")
+                    time.sleep(blocked)
+                    continue
+
+                remaining, reset_time = self._update_limits(token)
                 
                 if remaining > 0:
-                    return
+                    return token
                 else:
                     all_reset_times = [
                         info["resetAt"] 
@@ -101,35 +126,25 @@ class RateLimiter:
                     sleep_time = earliest_reset - time.time()
                     if sleep_time > 0:
                         print(f"All tokens exhausted, waiting for reset: {sleep_time:.1f}s")
+                        metrics.inc("github_backoff_sleep_seconds_total", sleep_time + 5, reason="quota_exhausted")
                         time.sleep(sleep_time + 5)
                     else:
+                        metrics.inc("github_backoff_sleep_seconds_total", 5, reason="quota_exhausted")
                         time.sleep(5)
                         
             except Exception as e:
                 print(f"Exception while waiting for token: {e}")
+                metrics.inc("github_backoff_sleep_seconds_total", 10, reason="rate_limit_check_failed")
                 time.sleep(10)
 
-def parse_github_url(url):
-    """Parse GitHub repository URL"""
-    try:
-        parsed = urlparse(url.strip())
-        if parsed.netloc != 'github.com':
-            return None, None
-        path = parsed.path.strip('/').split('/')
-        if len(path) < 2:
-            return None, None
-        return path[0], path[1]
-    except:
-        return None, None
-
 # REST API version
 def fetch_contributors(owner, repo, limiter):
     """Fetch contributors of a repository using REST API (with pagination and retry)"""
-    limiter.wait_for_token()
+    token = limiter.wait_for_token()
     
     contributors = []
-    url = f'https://api.github.com/repos/{owner}/{repo}/contributors'
-    headers = {'Authorization': f'token {limiter.current_token}'}
+    url = f'{GITHUB_API}/repos/{owner}/{repo}/contributors'
+    headers = {'Authorization': f'token {token}'}
     
     MAX_RETRIES_PER_PAGE = 3
     
@@ -139,17 +154,44 @@ def fetch_contributors(owner, repo, limiter):
         
         while retry_count < MAX_RETRIES_PER_PAGE:
             try:
-                response = requests.get(url, headers=headers, params={'per_page': 100}, timeout=20)
-                
+                label = token_label(token)
+                metrics.add("github_token_in_flight", 1, token=label)
+                metrics.inc("github_token_quota_used_total", token=label, family="core")
+                with GATE.slot() as started:
+                    try:
+                        response = ARCHIVE.request("GET", url, headers=headers, params={'per_page': 100}, timeout=20)
+                    except Exception:
+                        GATE.record(started)
+                        raise
+                    finally:
+                        elapsed = time.time() - started
+                        metrics.add("github_token_in_flight", -1, token=label)
+                        metrics.inc("github_token_busy_seconds_total", elapsed, token=label)
+                metrics.observe("github_request_duration_seconds", elapsed,
+                                endpoint="/repos/{r}/contributors", status=response.status_code)
+
+                throttled, wait = GATE.record(started, response.status_code, response.headers,
+                                              response.text if response.status_code in (403, 429) else "", elapsed)
+                if throttled:
+                    # park this token for exactly Retry-After / until reset; does not count as a failed try
+                    metrics.inc("github_retries_total", endpoint="/repos/{r}/contributors", reason=throttled)
+                    limiter.token_manager.block(token, wait)
+                    token = limiter.wait_for_token()
+                    headers = {'Authorization': f'token {token}'}
+                    continue
+
                 if response.status_code == 403:
-                    limiter.wait_for_token()
-                    headers = {'Authorization': f'token {limiter.current_token}'}
+                    metrics.inc("github_retries_total", endpoint="/repos/{r}/contributors", reason="403")
+                    token = limiter.wait_for_token()
+                    headers = {'Authorization': f'token {token}'}
                     retry_count += 1
                     continue
                 
                 if response.status_code != 200:
                     print(f"Temporary error: {response.status_code}, retrying...")
                     retry_count += 1
+                    metrics.inc("github_retries_total", endpoint="/repos/{r}/contributors", reason=f"http_{response.status_code}")
+                    metrics.inc("github_backoff_sleep_seconds_total", 2 ** retry_count, reason="retry")
                     time.sleep(2 ** retry_count)
                     continue
                 
@@ -159,6 +201,8 @@ def fetch_contributors(owner, repo, limiter):
             except Exception as e:
                 print(f"Request exception: {str(e)}, retrying...")
                 retry_count += 1
+                metrics.inc("github_retries_total", endpoint="/repos/{r}/contributors", reason=type(e).__name__)
+                metrics.inc("github_backoff_sleep_seconds_total", 2 ** retry_count, reason="retry")
                 time.sleep(2 ** retry_count)
         
         if not page_data:
@@ -174,7 +218,7 @@ def fetch_contributors(owner, repo, limiter):
 
         remaining = int(response.headers.get('X-RateLimit-Remaining', 1))
         reset_time = int(response.headers.get('X-RateLimit-Reset', time.time() + 60))
-        limiter.token_manager.update_token_info(limiter.current_token, remaining, reset_time)
+        limiter.token_manager.update_token_info(token, remaining, reset_time)
 
     return contributors
 
@@ -193,7 +237,7 @@ def process_row(row, limiter):
                 continue
             seen.add(link)
             
-            owner, repo = parse_github_url(link)
+            owner, repo = parse_github_url(link, strict=True)
             if not owner or not repo:
                 continue
             fetched = fetch_contributors(owner, repo, limiter)
@@ -227,7 +271,9 @@ def process_dataframe(df):
             )
             futures[future] = idx
     
+        metrics.set("collector_queue_depth", len(futures), queue="rows")
         for future in tqdm(as_completed(futures), total=len(futures)):
+            metrics.add("collector_queue_depth", -1, queue="rows")
             idx = futures[future]
             try:
                 df.at[idx, 'contributors'] = future.result()
@@ -238,7 +284,8 @@ def process_dataframe(df):
     df.to_csv(OUTPUT_CSV, index=False)
 
 if __name__ == "__main__":
+    start_metrics("02_get_contributors_contributorAPI")
     start_time = time.time()
-    df = pd.read_csv(INPUT_CSV)
+    df = read_devpost('hackathon_project', DATA_DIR)
     process_dataframe(df)
     print(f"Time cost: {time.time()-start_time:.2f} seconds")
@@ -1,9 +1,20 @@
+######## Goal:
+######## Classify GitHub logins as Bot/Human/Unknown with RABBIT, one process per token.
+######## Results are kept in the ClassificationStore (bot_classification.py): only logins that are not in the
+######## store yet are sent to RABBIT, and rabbit_output_parallel.csv is exported from the store afterwards.
+########
+######## Usage:
+########   python 04_1_run_rabbit_parallel.py                    # new logins only
+########   python 04_1_run_rabbit_parallel.py --max-age-days 180  # also re-check logins classified > 180 days ago
+
+import argparse
 import os
-import csv
 import subprocess
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from bot_classification import ClassificationStore, STORE_PATH
+
 # Configuration
 input_file = "logins.txt"
 output_file = "rabbit_output_parallel.csv"
@@ -18,17 +29,32 @@ tokens = [
 
 ]
 
-# Step 1: Split the input file by lines
-def split_file(input_file, num_parts):
-    os.makedirs(split_dir, exist_ok=True)
-    with open(input_file, 'r') as f:
-        lines = f.readlines()
+# Step 0: Read the logins and store what an earlier run left behind
+def read_logins(input_file):
+    with open(input_file, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
 
-    chunk_size = len(lines) // num_parts + (len(lines) % num_parts > 0)
+def ingest_outputs(store, output_dir):
+    """Store the chunk outputs of a (possibly interrupted) run and remove them"""
+    stored = 0
+    for file in sorted(Path(output_dir).glob("out_*.csv")):
+        stored += store.ingest_csv(file)
+        file.unlink()
+    return stored
+
+# Step 1: Split the logins, one chunk per token
+def split_file(logins, num_parts):
+    """Returns the indexes of the chunks that received logins"""
+    os.makedirs(split_dir, exist_ok=True)
+    chunk_size = len(logins) // num_parts + (len(logins) % num_parts > 0)
+    written = []
     for i in range(num_parts):
-        chunk = lines[i * chunk_size : (i + 1) * chunk_size]
-        with open(f"{split_dir}/chunk_{i}.txt", "w") as f_out:
-            f_out.writelines(chunk)
+        chunk = logins[i * chunk_size : (i + 1) * chunk_size]
+        with open(f"{split_dir}/chunk_{i}.txt", "w", encoding='utf-8') as f_out:
+            f_out.writelines(f"{login}\n" for login in chunk)
+        if chunk:
+            written.append(i)
+    return written
 
 # Step 2: Run the rabbit command (each thread uses a different token)
 def run_rabbit(chunk_path, index, token):
@@ -50,40 +76,47 @@ def run_rabbit(chunk_path, index, token):
     except subprocess.CalledProcessError as e:
         print(f"[Thread {index}]  Failed with error: {e}")
 
-# Step 3: Merge multiple CSV files
-def merge_csv(output_dir, final_output):
-    csv_files = sorted(Path(output_dir).glob("out_*.csv"))
-    with open(final_output, "w", newline='') as fout:
-        writer = None
-        for file in csv_files:
-            with open(file, "r", newline='') as fin:
-                reader = csv.reader(fin)
-                headers = next(reader)
-                if writer is None:
-                    writer = csv.writer(fout)
-                    writer.writerow(headers)
-                for row in reader:
-                    writer.writerow(row)
+# Step 3: Store the chunk outputs and export the classification of all input logins
+def merge_csv(store, logins, final_output):
+    stored = ingest_outputs(store, output_dir)
+    exported = store.export_csv(final_output, logins)
+    print(f" Stored {stored} new classifications, exported {exported} of {len(logins)} logins")
 
 # Step 4: Main logic
 def main():
-    print(" Splitting input file...")
-    split_file(input_file, num_threads)
-
-    print(" Running rabbit on each chunk with separate tokens...")
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = []
-        for i in range(num_threads):
-            chunk_path = f"{split_dir}/chunk_{i}.txt"
-            token = tokens[i]
-            futures.append(executor.submit(run_rabbit, chunk_path, i, token))
-
-        # Wait for all threads to complete
-        for future in futures:
-            future.result()
-
-    print(" Merging CSV files...")
-    merge_csv(output_dir, output_file)
+    parser = argparse.ArgumentParser(description="Run RABBIT on the logins the classification store does not know")
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--max-age-days", type=float, default=None,
+                        help="also re-classify logins checked longer ago than this")
+    args = parser.parse_args()
+
+    with ClassificationStore(args.store) as store:
+        leftover = ingest_outputs(store, output_dir)
+        if leftover:
+            print(f" Stored {leftover} classifications left by an interrupted run")
+
+        logins = read_logins(input_file)
+        todo = store.missing(logins, args.max_age_days)
+        print(f" {len(logins)} logins, {len(logins) - len(todo)} already classified, {len(todo)} to run")
+
+        if todo:
+            print(" Splitting new logins...")
+            chunks = split_file(todo, num_threads)
+
+            print(" Running rabbit on each chunk with separate tokens...")
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                futures = []
+                for i in chunks:
+                    chunk_path = f"{split_dir}/chunk_{i}.txt"
+                    token = tokens[i]
+                    futures.append(executor.submit(run_rabbit, chunk_path, i, token))
+
+                # Wait for all threads to complete
+                for future in futures:
+                    future.result()
+
+        print(" Merging CSV files...")
+        merge_csv(store, logins, output_file)
 
     print(f" Done! Final output saved to: {output_file}")
 
@@ -0,0 +1,322 @@
+######## Goal:
+######## Load users, projects and user_projects (05_1_map_user_project.ipynb) with constant memory
+########
+######## Rows are streamed from the source CSVs through generators straight into COPY ... FROM STDIN
+######## (binary format by default, text with --format text), in chunks of --chunk-rows rows.
+######## Every table is first copied into a temporary staging table and then merged:
+########   users          upsert on user_id (hash updated)
+########   projects       upsert on project_url (first row per url wins, project_id stays stable)
+########   user_projects  pairs not yet present, for users and projects that exist
+######## so the loader can be rerun on a fuller export without TRUNCATE and without duplicating rows.
+########
+######## Usage:
+########   python 05_1_load_user_project.py
+########   python 05_1_load_user_project.py --tables projects user_projects --format text
+
+import argparse
+import csv
+import io
+import os
+import struct
+import sys
+import time
+from ast import literal_eval
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+DB_DSN = f"dbname={os.getenv('DB_NAME')} user={os.getenv('DB_USER')} " \
+         f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST','localhost')} " \
+         f"port={os.getenv('DB_PORT','5432')}"
+
+# values pandas.read_csv treats as NaN; the notebook's dropna() relied on them
+NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+DDL = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    hash TEXT
+);
+CREATE TABLE IF NOT EXISTS projects (
+    project_id SERIAL PRIMARY KEY,
+    project_url TEXT UNIQUE,
+    repo_links TEXT[],
+    start_date TIMESTAMPTZ,
+    end_date TIMESTAMPTZ
+);
+CREATE TABLE IF NOT EXISTS user_projects (
+    user_project_id SERIAL PRIMARY KEY,
+    user_id TEXT REFERENCES users(user_id),
+    project_id INT REFERENCES projects(project_id)
+);
+CREATE INDEX IF NOT EXISTS user_projects_user_project_idx ON user_projects (user_id, project_id);
+"""
+
+
+# ────── Sources (generators, one row at a time) ──────────────────────
+def read_csv_rows(path):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def is_na(value):
+    return value is None or value in NA_VALUES
+
+
+def parse_repo_links(value):
+    """Same array as the notebook: a "[...]" list literal or a comma-separated string, elements stripped"""
+    items = literal_eval(value) if value.startswith("[") else [value]
+    return [s.strip() for item in items for s in str(item).split(",") if s.strip()]
+
+
+def user_rows(path):
+    """(seq, user_id, hash); names containing 'bot' are excluded as in the notebook"""
+    for seq, row in enumerate(read_csv_rows(path)):
+        name = row.get("name")
+        if is_na(name) or "bot" in name.lower():
+            continue
+        yield seq, name, None if is_na(row.get("hash")) else row["hash"]
+
+
+def project_rows(path):
+    """(seq, project_url, repo_links, start_date, end_date); rows missing any field are dropped"""
+    fields = ("project_URL", "github_links", "start_date_format", "end_date_format")
+    for seq, row in enumerate(read_csv_rows(path)):
+        if any(is_na(row.get(f)) for f in fields):
+            continue
+        yield (seq, row["project_URL"], parse_repo_links(row["github_links"]),
+               datetime.fromisoformat(row["start_date_format"]), datetime.fromisoformat(row["end_date_format"]))
+
+
+def user_project_rows(path):
+    """(user_id, project_url) for every contributor of every project row"""
+    for row in read_csv_rows(path):
+        contributors = row.get("contributor_github_username")
+        if is_na(contributors) or is_na(row.get("project_URL")):
+            continue
+        for user in contributors.split(","):
+            user = user.strip()
+            if user:
+                yield user, row["project_URL"]
+
+
+# ────── COPY encoders ────────────────────────────────────────────────
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+BINARY_TRAILER = struct.pack("!h", -1)
+TEXT_OID = 25
+
+
+class BinaryEncoder:
+    """PostgreSQL binary COPY format for the column types used here: int8, text, text[] and timestamptz"""
+    def __init__(self, types, tz):
+        self.types, self.tz = types, tz
+
+    header, trailer = BINARY_HEADER, BINARY_TRAILER
+
+    def _field(self, kind, value):
+        if value is None:
+            return struct.pack("!i", -1)
+        if kind == "int8":
+            return struct.pack("!iq", 8, value)
+        if kind == "text":
+            b = value.encode()
+            return struct.pack("!i", len(b)) + b
+        if kind == "text[]":
+            if not value:
+                body = struct.pack("!iii", 0, 0, TEXT_OID)
+            else:
+                parts = [struct.pack("!iiiii", 1, 0, TEXT_OID, len(value), 1)]
+                for v in value:
+                    b = v.encode()
+                    parts.append(struct.pack("!i", len(b)) + b)
+                body = b"".join(parts)
+            return struct.pack("!i", len(body)) + body
+        if kind == "timestamptz":
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=self.tz)  # like text input: naive values are in the session TimeZone
+            return struct.pack("!iq", 8, (value - PG_EPOCH) // MICROSECOND)
+        raise ValueError(f"Unsupported binary COPY type {kind}")
+
+    def row(self, values):
+        return struct.pack("!h", len(values)) + b"".join(self._field(k, v) for k, v in zip(self.types, values))
+
+
+class TextEncoder:
+    """PostgreSQL text COPY format (tab separated, \\N for NULL)"""
+    header, trailer = b"", b""
+
+    def __init__(self, types, tz=None):
+        self.types = types
+
+    @staticmethod
+    def _escape(s):
+        return s.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def _field(self, kind, value):
+        if value is None:
+            return "\\N"
+        if kind == "text[]":
+            quoted = ('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in value)
+            return self._escape("{" + ",".join(quoted) + "}")
+        if kind == "timestamptz":
+            return value.isoformat()
+        return self._escape(str(value))
+
+    def row(self, values):
+        return ("\t".join(self._field(k, v) for k, v in zip(self.types, values)) + "\n").encode()
+
+
+class StreamFile(io.RawIOBase):
+    """Read-only file object over a generator of byte chunks, as consumed by cursor.copy_expert"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buf = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buf:
+            try:
+                self.buf = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        self.buf = self.buf[n:]
+        return n
+
+
+def encode_chunks(rows, encoder, chunk_rows, counter):
+    """Encode rows in chunks of chunk_rows; counter[0] holds the number of rows streamed"""
+    yield encoder.header
+    chunk = []
+    for row in rows:
+        chunk.append(encoder.row(row))
+        counter[0] += 1
+        if len(chunk) >= chunk_rows:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+    yield encoder.trailer
+
+
+def copy_rows(cur, table, columns, types, rows, fmt, chunk_rows, tz):
+    encoder = (BinaryEncoder if fmt == "binary" else TextEncoder)(types, tz)
+    counter = [0]
+    stream = io.BufferedReader(StreamFile(encode_chunks(rows, encoder, chunk_rows, counter)), buffer_size=1 << 16)
+    options = "FORMAT binary" if fmt == "binary" else "FORMAT text"
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH ({options})", stream, size=1 << 16)
+    return counter[0]
+
+
+# ────── Loaders (staging + merge) ────────────────────────────────────
+def load_users(cur, args, tz):
+    cur.execute("CREATE TEMP TABLE stage_users (seq BIGINT, user_id TEXT, hash TEXT) ON COMMIT DROP")
+    n = copy_rows(cur, "stage_users", ("seq", "user_id", "hash"), ("int8", "text", "text"),
+                  user_rows(args.users_csv), args.format, args.chunk_rows, tz)
+    cur.execute("""
+        INSERT INTO users (user_id, hash)
+        SELECT DISTINCT ON (user_id) user_id, hash
+        FROM stage_users
+        ORDER BY user_id, seq
+        ON CONFLICT (user_id) DO UPDATE SET hash = EXCLUDED.hash
+        WHERE users.hash IS DISTINCT FROM EXCLUDED.hash
+    """)
+    return n, cur.rowcount
+
+
+def load_projects(cur, args, tz):
+    cur.execute("""
+        CREATE TEMP TABLE stage_projects (
+            seq BIGINT, project_url TEXT, repo_links TEXT[], start_date TIMESTAMPTZ, end_date TIMESTAMPTZ
+        ) ON COMMIT DROP
+    """)
+    n = copy_rows(cur, "stage_projects", ("seq", "project_url", "repo_links", "start_date", "end_date"),
+                  ("int8", "text", "text[]", "timestamptz", "timestamptz"),
+                  project_rows(args.projects_csv), args.format, args.chunk_rows, tz)
+    cur.execute("""
+        INSERT INTO projects (project_url, repo_links, start_date, end_date)
+        SELECT DISTINCT ON (project_url) project_url, repo_links, start_date, end_date
+        FROM stage_projects
+        ORDER BY project_url, seq
+        ON CONFLICT (project_url) DO UPDATE SET
+            repo_links = EXCLUDED.repo_links,
+            start_date = EXCLUDED.start_date,
+            end_date = EXCLUDED.end_date
+        WHERE (projects.repo_links, projects.start_date, projects.end_date)
+              IS DISTINCT FROM (EXCLUDED.repo_links, EXCLUDED.start_date, EXCLUDED.end_date)
+    """)
+    return n, cur.rowcount
+
+
+def load_user_projects(cur, args, tz):
+    cur.execute("CREATE TEMP TABLE stage_user_projects (user_id TEXT, project_url TEXT) ON COMMIT DROP")
+    n = copy_rows(cur, "stage_user_projects", ("user_id", "project_url"), ("text", "text"),
+                  user_project_rows(args.projects_csv), args.format, args.chunk_rows, tz)
+    cur.execute("""
+        SELECT count(*) FILTER (WHERE p.project_id IS NULL),
+               count(*) FILTER (WHERE p.project_id IS NOT NULL AND u.user_id IS NULL)
+        FROM stage_user_projects s
+        LEFT JOIN projects p ON p.project_url = s.project_url
+        LEFT JOIN users u ON u.user_id = s.user_id
+    """)
+    no_project, no_user = cur.fetchone()
+    if no_project or no_user:
+        print(f"  user_projects: skipped {no_project} rows without a project and {no_user} rows without a user")
+    cur.execute("""
+        INSERT INTO user_projects (user_id, project_id)
+        SELECT DISTINCT s.user_id, p.project_id
+        FROM stage_user_projects s
+        JOIN projects p ON p.project_url = s.project_url
+        JOIN users u ON u.user_id = s.user_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_projects up WHERE up.user_id = s.user_id AND up.project_id = p.project_id
+        )
+    """)
+    return n, cur.rowcount
+
+
+LOADERS = {"users": load_users, "projects": load_projects, "user_projects": load_user_projects}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream users / projects / user_projects into Postgres")
+    parser.add_argument("--users-csv", default="../data/humans_hash_complete.csv")
+    parser.add_argument("--projects-csv", default="../data/proj_hack_human_complete.csv")
+    parser.add_argument("--tables", nargs="+", default=list(LOADERS), choices=list(LOADERS))
+    parser.add_argument("--format", choices=["binary", "text"], default="binary")
+    parser.add_argument("--chunk-rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DB_DSN)
+    cur = conn.cursor()
+    cur.execute(DDL)
+    conn.commit()
+    cur.execute("SHOW TimeZone")
+    tz = ZoneInfo(cur.fetchone()[0])
+
+    # in dependency order, one transaction per table
+    for name in [t for t in LOADERS if t in args.tables]:
+        t0 = time.time()
+        streamed, merged = LOADERS[name](cur, args, tz)
+        conn.commit()
+        print(f"{name}: streamed {streamed} rows, inserted/updated {merged} in {time.time() - t0:.1f}s")
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
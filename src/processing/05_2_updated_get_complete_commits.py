@@ -40,7 +40,7 @@ CREATE TABLE IF NOT EXISTS processed_users (
 """
 
 import os, sys, time, json, argparse, asyncio, math, random
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime, timedelta, timezone
 from io import StringIO
 from pathlib import Path
@@ -50,10 +50,17 @@ from tqdm.asyncio import tqdm_asyncio
 from dotenv import load_dotenv
 import time
 import pytz
+from collector_metrics import metrics, start_metrics, loop_monitor
+from contribution_coverage import ContributionCoverage, merge_intervals, plan_window, year_chunks
+from github_tokens import TokenManager, with_rate_limit
+from response_archive import ARCHIVE
 
 # ────── CLI ──────────────────────────────────────────────────────────
 parser = argparse.ArgumentParser()
 parser.add_argument("--limit-users", type=int, default=0)
+parser.add_argument("--whitelist", type=str, default="")
+parser.add_argument("--delta", action="store_true",
+                    help="also revisit processed users; only spans missing from the coverage index are fetched")
 args = parser.parse_args()
 
 # ────── Environment variables ──────────────────────────────────────────────────────
@@ -62,81 +69,91 @@ DB_DSN = f"dbname={os.getenv('DB_NAME')} user={os.getenv('DB_USER')} " \
          f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST','localhost')} " \
          f"port={os.getenv('DB_PORT','5432')}"
 TOKENS = [t.strip() for t in os.getenv("TOKENS","").split(",") if t.strip()]
+TOKENS = ARCHIVE.tokens(TOKENS)
 if not TOKENS:
     sys.exit("Set TOKENS=ghp_xxx,... in .env")
+GITHUB_API = os.getenv("GITHUB_API", "https://api.github.com")
+FAMILY = "graphql"
+# answer windows from the per-user coverage index (contribution_coverage.py), fetching only uncovered spans
+CONTRIB_COVERAGE = os.getenv("CONTRIB_COVERAGE", "1") != "0"
 
 # ────── Token Manager ────────────────────────────────────────────────
-class TokenState:
-    __slots__ = ("token", "remaining", "reset", "in_use")
-    def __init__(self, token): self.token, self.remaining, self.reset, self.in_use = token, 5000, 0, False
+tm = TokenManager(TOKENS, family=FAMILY)
 
-class TokenManager:
-    def __init__(self, tokens, per_token_concurrency=5):
-        self.tokens = [TokenState(t) for t in tokens]
-        self.permit = asyncio.Semaphore(len(tokens)*per_token_concurrency)
-        self.lock   = asyncio.Lock()
-
-    async def acquire(self):
-        await self.permit.acquire()
+# Users whose windows are queued at the same time; the scheduler interleaves their requests, so this only
+# needs to keep the request workers busy (and bounds the results held in memory)
+ACTIVE_USERS = int(os.getenv("ACTIVE_USERS", "0")) or 2 * tm.aimd.maximum
 
+# ────── Fair scheduler ───────────────────────────────────────────────
+class FairScheduler:
+    """
+    Runs the requests of many users on a fixed pool of workers, one worker per request in flight.
+    Workers take the queued requests of the users in turn (round robin), so a user with dozens of windows
+    neither waits for its own requests one by one nor holds the workers while the other users wait.
+        async with FairScheduler(n) as sched:
+            repos = await sched.submit(login, call_github, login, start, end, client)
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.queues = {}        # user -> deque of (coroutine function, args, future)
+        self.turns = deque()    # users with queued requests, in turn order
+        self.cond = asyncio.Condition()
+        self.tasks = []
+
+    async def __aenter__(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return self
+
+    async def __aexit__(self, *exc):
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def submit(self, user, fn, *args):
+        fut = asyncio.get_running_loop().create_future()
+        async with self.cond:
+            if user not in self.queues:
+                self.queues[user] = deque()
+                self.turns.append(user)
+            self.queues[user].append((fn, args, fut))
+            metrics.add("collector_queue_depth", 1, queue="requests")
+            self.cond.notify()
+        return await fut
+
+    async def _next(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.turns)
+            user = self.turns.popleft()
+            queue = self.queues[user]
+            job = queue.popleft()
+            if queue:
+                self.turns.append(user)  # back of the line behind the other users
+            else:
+                del self.queues[user]
+            metrics.add("collector_queue_depth", -1, queue="requests")
+            return job
+
+    async def _worker(self):
         while True:
-            async with self.lock:
-                now = time.time()
-
-            
-                for i, t in enumerate(self.tokens):
-                    if t.remaining == 0 and now >= t.reset:
-                        t.remaining = 5000  # auto recover 
-                    if t.remaining > 0 and not t.in_use:
-                        t.in_use = True
-                        t.remaining -= 1
-                        return t
-
-                active_tokens = [t for t in self.tokens if t.remaining > 0]
-
-                if active_tokens:
-                    sleep_sec = 5 
-                    print("All tokens are busy but still have quota. Waiting shortly for any to free...")
-                else:
-                    next_reset = min(t.reset for t in self.tokens)
-                    sleep_sec = max(next_reset - now + 5, 5)
-                    local_tz = pytz.timezone('Europe/Amsterdam')
-                    # print("No tokens with remaining quota.")
-                    # print("Now:", datetime.fromtimestamp(now, local_tz))
-                    # print("Reset time:", datetime.fromtimestamp(next_reset, local_tz))
-                    print(f"No tokens with remaining quota. Sleeping for {sleep_sec:.1f}s to wait for rate limit reset.")
-
-            await asyncio.sleep(sleep_sec)
-
-
-    async def release(self, t: TokenState, hdr):
-        async with self.lock:
-            t.in_use = False
-            # print(f"Releasing token: {t.token[:6]}...")
-
-            if 'X-RateLimit-Remaining' in hdr:
-                t.remaining = int(hdr['X-RateLimit-Remaining'])
-                # print(f"Updated remaining = {t.remaining}")
-
-        if 'X-RateLimit-Reset' in hdr:
+            fn, args, fut = await self._next()
+            if fut.cancelled():
+                continue
             try:
-                reset_ts = float(hdr['X-RateLimit-Reset'])
-                now = time.time()
-                if reset_ts < now:  
-                    reset_ts = now + 300 # wait 300 seconds
-                t.reset = reset_ts
-            except:
-                t.reset = time.time() + 300  # fallback
-        else:
-            t.reset = time.time() + 300  # fallback if reset header missing
-
-        self.permit.release()
-
-tm = TokenManager(TOKENS)
+                result = await fn(*args)
+            except asyncio.CancelledError:
+                fut.cancel()
+                raise
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+            else:
+                if not fut.done():
+                    fut.set_result(result)
 
 # ────── GraphQL helpers ──────────────────────────────────────────────
 # Only keep commits, ignore pr and issues
-GQL = """
+# rateLimit is requested with every query so the token budget is settled with the points actually charged
+GQL = with_rate_limit("""
 query($login:String!,$from:DateTime!,$to:DateTime!){
   user(login:$login){
     contributionsCollection(from:$from,to:$to){
@@ -145,32 +162,21 @@ query($login:String!,$from:DateTime!,$to:DateTime!){
       }
     }
   }
-}"""
+}""")
 
 async def call_github(login: str, start: datetime, end: datetime, client: httpx.AsyncClient, retries=3):
     delay = 1
     for attempt in range(1, retries + 1):
-        token_state = await tm.acquire()
-        headers = {"Authorization": f"Bearer {token_state.token}"}
+        variables = {
+            "login": login,
+            "from": start.isoformat(),
+            "to": end.isoformat()
+        }
 
         try:
-            t0 = time.time()
-            resp = await client.post(
-                "https://api.github.com/graphql",
-                json={
-                    "query": GQL,
-                    "variables": {
-                        "login": login,
-                        "from": start.isoformat(),
-                        "to": end.isoformat()
-                    }
-                },
-                headers=headers,
-                timeout=120
-            )
-            elapsed = time.time() - t0
-
-            await tm.release(token_state, resp.headers)
+            # throttled responses are retried inside tm.request after the wait GitHub asks for
+            resp = await tm.request(client, "POST", f"{GITHUB_API}/graphql",
+                                    query=GQL, variables=variables, timeout=120)
 
             resp.raise_for_status()
             data = resp.json()
@@ -187,93 +193,93 @@ async def call_github(login: str, start: datetime, end: datetime, client: httpx.
 
         except Exception as e:
             print(f" Error for {login} [{start.date()} → {end.date()}] on try {attempt}: {e}")
-            await tm.release(token_state, resp.headers if 'resp' in locals() else {})
 
             if attempt == retries:
                 raise RuntimeError(f"GraphQL failed permanently for {login} {start}-{end}")
 
-            await asyncio.sleep(delay + random.random())
+            backoff = delay + random.random()
+            metrics.inc("github_retries_total", endpoint="graphql", reason=type(e).__name__)
+            metrics.inc("github_backoff_sleep_seconds_total", backoff, reason="retry")
+            await asyncio.sleep(backoff)
             delay *= 2
 
 # ────── DB helpers ───────────────────────────────────────────────────
-def merge_intervals(intervals):
-    """Merge overlapping intervals"""
-    intervals.sort(key=lambda x: x[0]) # sorted by start date
-    merged = []
-    for s, e in intervals:
-        if not merged or s > merged[-1][1]: # do NOT need to be merged
-            merged.append([s, e]) # add the new interval
-        else: # need to be merged. 
-            # Since s>=merged[-1][0], pick merged[-1][0] as the start date of merged interval
-            merged[-1][1] = max(merged[-1][1], e) # pick the max end date for merged interval
-    return merged
-
-async def fetch_repos_for_window(login: str, window_start: datetime, window_end: datetime, client: httpx.AsyncClient):
-    """Fetch repositories for a given time window, splitting into 1-year chunks if needed"""
-    # print(f"processing user {login} contribution during {window_start} and {window_end}")
-    repos = set()
-    ptr = window_start
-    
-    while ptr < window_end:
-        nxt = min(ptr.replace(year=ptr.year + 1), window_end)
-        try:
-            chunk_repos = await call_github(login, ptr, nxt, client)
-            repos |= chunk_repos
-        except Exception as e:
-            print(f"Exception processing user {login} contribution during {window_start} and {window_end}: {str(e)}")
-            return set()  
-        ptr = nxt
-
-    return repos
-
-async def process_user(db_dsn, client, login, projects):
+async def fetch_repos_for_window(sched: FairScheduler, coverage, spans, login: str, window_start: datetime, window_end: datetime, client: httpx.AsyncClient):
+    """
+    Fetch repositories for a given time window. Spans recorded in the coverage index are reused; the 1-year
+    chunks of the gaps are submitted to the scheduler together and recorded as they succeed.
+    """
+    if coverage is not None:
+        repos, gaps = plan_window(spans, window_start, window_end)
+    else:
+        repos, gaps = set(), [(window_start, window_end)]
+    chunks = [c for lo, hi in gaps for c in year_chunks(lo, hi)]
+    results = await asyncio.gather(*[
+        sched.submit(login, call_github, login, lo, hi, client)
+        for lo, hi in chunks
+    ], return_exceptions=True)
+
+    failed = False
+    for (lo, hi), r in zip(chunks, results):
+        if isinstance(r, BaseException):
+            print(f"Exception processing user {login} contribution during {lo} and {hi}: {str(r)}")
+            failed = True
+            continue
+        repos |= r
+        if coverage is not None and (span := await coverage.astore(login, lo, hi, r)):
+            spans.append(span)
+    # None: the window is not written and the user stays unprocessed; the failed chunk stays uncovered, so the
+    # next run fetches only that chunk again
+    return None if failed else repos
+
+async def process_user(db_dsn, sched, coverage, client, login, projects):
     """
     Process a user's projects and store repo contributions for each project's before/after windows
     projects: list of (user_project_id, project_id, start_date, end_date)
+    All windows of the user are fetched concurrently through the scheduler, then written in one transaction.
     """
-    t0 = time.time()
+    td2y = timedelta(days=730)  # 2 years
+
+    # Group projects by (project_id, window_type) for potential merging
+    window_groups = defaultdict(list)  # {(project_id, window_type): [(start, end), ...]}
+
+    for up_id, proj_id, start_date, end_date in projects:
+        before_window = (start_date - td2y, start_date)
+        after_window = (end_date, end_date + td2y)
+
+        window_groups[(proj_id, 'before')].append(before_window)
+        window_groups[(proj_id, 'after')].append(after_window)
+
+    print(f"  Processing user: {login} with {len(projects)} projects")
+
+    # Merge overlapping windows for the same project and window_type
+    merged = {key: merge_intervals(windows) for key, windows in window_groups.items()}
+    spans = await coverage.aspans(login) if coverage is not None else []
+    fetched = await asyncio.gather(*[
+        fetch_repos_for_window(sched, coverage, spans, login, window_start, window_end, client)
+        for key in merged for window_start, window_end in merged[key]
+    ])
+
     conn = psycopg2.connect(db_dsn)
     cur = conn.cursor()
-    
     try:
-        td2y = timedelta(days=730)  # 2 years
-        
-        # Group projects by (project_id, window_type) for potential merging
-        window_groups = defaultdict(list)  # {(project_id, window_type): [(start, end), ...]}
-        
-        for up_id, proj_id, start_date, end_date in projects:
-            before_window = (start_date - td2y, start_date)
-            after_window = (end_date, end_date + td2y)
-            
-            window_groups[(proj_id, 'before')].append(before_window)
-            window_groups[(proj_id, 'after')].append(after_window)
-        
-        print(f"  Processing user: {login} with {len(projects)} projects")
-        
-        # Process each (project_id, window_type) group
-        for (proj_id, window_type), windows in window_groups.items():
-            # Merge overlapping windows for the same project and window_type
-            merged_windows = merge_intervals(windows)
-            
-            # print(f"    Processing project {proj_id} ({window_type}): {len(windows)} windows merged into {len(merged_windows)}")
-            
-            # For each merged window, collect all repos
-            all_repos = set()
-            final_start = None
-            final_end = None
-            
-            for window_start, window_end in merged_windows:
-                if final_start is None or window_start < final_start:
-                    final_start = window_start
-                if final_end is None or window_end > final_end:
-                    final_end = window_end
-                    
-                repos = await fetch_repos_for_window(login, window_start, window_end, client)
-                all_repos |= repos
-                # print(f"      Window {window_start.date()} → {window_end.date()}: {len(repos)} repos")
-            
+        fetched = iter(fetched)
+        incomplete = 0
+        for (proj_id, window_type), merged_windows in merged.items():
+            # Collect all repos of the merged windows
+            parts = [next(fetched) for _ in merged_windows]
+            if any(p is None for p in parts):
+                # keep the existing row rather than overwrite it with a partial repo set
+                print(f"      Skipping project {proj_id} ({window_type}): a chunk failed")
+                incomplete += 1
+                continue
+            all_repos = set().union(*parts)
+            final_start = min(s for s, _ in merged_windows)
+            final_end = max(e for _, e in merged_windows)
+
             # Insert into user_proj_repo table
             print(f"      Inserting {len(all_repos)} repos for project {proj_id} ({window_type})")
+            t_db = time.time()
             cur.execute("""
                 INSERT INTO user_proj_repo (user_id, project_id, window_type, window_start_time, window_end_time, repos)
                 VALUES (%s, %s, %s, %s, %s, %s)
@@ -283,15 +289,25 @@ async def process_user(db_dsn, client, login, projects):
                     window_end_time = EXCLUDED.window_end_time,
                     repos = EXCLUDED.repos
             """, (login, proj_id, window_type, final_start, final_end, json.dumps(sorted(all_repos))))
+            metrics.observe("db_write_seconds", time.time() - t_db, table="user_proj_repo")
         
-        # Mark this user as processed
-        cur.execute("INSERT INTO processed_users(user_id) VALUES (%s) ON CONFLICT DO NOTHING", (login,))
+        # Mark this user as processed, unless a window is still missing
+        if not incomplete:
+            cur.execute("INSERT INTO processed_users(user_id) VALUES (%s) ON CONFLICT DO NOTHING", (login,))
         
+        t_db = time.time()
         conn.commit()
-        print(f"Successfully processed user {login}")
+        metrics.observe("db_write_seconds", time.time() - t_db, table="commit")
+        if incomplete:
+            metrics.inc("collector_items_total", outcome="partial")
+            print(f"User {login}: {incomplete} window(s) failed, left unprocessed")
+        else:
+            metrics.inc("collector_items_total", outcome="done")
+            print(f"Successfully processed user {login}")
 
     except Exception as e:
         conn.rollback()
+        metrics.inc("collector_items_total", outcome="failed")
         print(f"Error while processing user {login}: {e}")
     finally:
         cur.close()
@@ -300,57 +316,71 @@ async def process_user(db_dsn, client, login, projects):
     
 
 async def main():
-    # ── DB connect & fetch data ──
-    conn = psycopg2.connect(DB_DSN)
-    cur = conn.cursor()
+    start_metrics("05_2_updated_get_complete_commits")
+    async with loop_monitor():
+        # ── DB connect & fetch data ──
+        conn = psycopg2.connect(DB_DSN)
+        cur = conn.cursor()
+
+        where = []
+        if args.limit_users:
+            where.append(f"up.user_id IN (SELECT user_id FROM user_projects LIMIT {args.limit_users})")
+        if args.whitelist:
+            users = "','".join([u.strip() for u in args.whitelist.split(",")])
+            where.append(f"up.user_id IN ('{users}')")
+
+        # where_sql = "WHERE " + " AND ".join(where) if where else ""
+    
+        # Fetch unprocessed users (all users with --delta) and their projects
+        if not args.delta:
+            where.insert(0, "pu.user_id IS NULL")
+        cur.execute(f"""
+            SELECT up.user_id, up.user_project_id, up.project_id, p.start_date, p.end_date
+            FROM user_projects up
+            JOIN projects p ON p.project_id = up.project_id
+            LEFT JOIN processed_users pu ON pu.user_id = up.user_id
+            {('WHERE ' + ' AND '.join(where)) if where else ''};
+        """)
+        rows = cur.fetchall()
+
+        # Group by user_id
+        user_projects = defaultdict(list)
+        for uid, upid, proj_id, start_date, end_date in rows:
+            user_projects[uid].append((upid, proj_id, start_date, end_date))
 
-    where = []
-    if args.limit_users:
-        where.append(f"up.user_id IN (SELECT user_id FROM user_projects LIMIT {args.limit_users})")
-    if args.whitelist:
-        users = "','".join([u.strip() for u in args.whitelist.split(",")])
-        where.append(f"up.user_id IN ('{users}')")
+        cur.close()
+        conn.close()
 
-    # where_sql = "WHERE " + " AND ".join(where) if where else ""
-    
-    # Fetch unprocessed users and their projects
-    cur.execute(f"""
-        SELECT up.user_id, up.user_project_id, up.project_id, p.start_date, p.end_date
-        FROM user_projects up
-        JOIN projects p ON p.project_id = up.project_id
-        LEFT JOIN processed_users pu ON pu.user_id = up.user_id
-        WHERE pu.user_id IS NULL
-        {('AND ' + ' AND '.join(where)) if where else ''};
-    """)
-    rows = cur.fetchall()
-
-    # Group by user_id
-    user_projects = defaultdict(list)
-    for uid, upid, proj_id, start_date, end_date in rows:
-        user_projects[uid].append((upid, proj_id, start_date, end_date))
-
-    cur.close()
-    conn.close()
-
-    print(f"Loaded {len(user_projects)} unique users to process\n")
-
-    # ── Control per-user concurrency ──
-    sem = asyncio.Semaphore(10)  # Limit concurrent users
-
-    async def sem_task(uid, projects):
-        async with sem:
-            await process_user(DB_DSN, client, uid, projects)
-
-    # ── Start all tasks ──
-    async with httpx.AsyncClient(http2=True, timeout=40) as client:
-        tasks = [
-            sem_task(uid, projects)
-            for uid, projects in user_projects.items()
-        ]
-        for f in tqdm_asyncio.as_completed(tasks, total=len(tasks), desc="Users"):
-            await f
-
-    print("All done.")
+        print(f"Loaded {len(user_projects)} unique users to process\n")
+
+        # ── Control concurrency ──
+        # One scheduler worker per request the token manager can have in flight; its adaptive limit decides
+        # the actual request concurrency. The user semaphore only bounds how many users are queued at once.
+        sem = asyncio.Semaphore(ACTIVE_USERS)
+
+        async def sem_task(uid, projects):
+            metrics.add("collector_queue_depth", 1, queue="users")
+            async with sem:
+                metrics.add("collector_queue_depth", -1, queue="users")
+                await process_user(DB_DSN, sched, coverage, client, uid, projects)
+
+        coverage = ContributionCoverage(DB_DSN) if CONTRIB_COVERAGE else None
+        if coverage is not None and args.delta:
+            print(f"Coverage index: {await coverage.abackfill()} spans seeded from existing windows")
+
+        # ── Start all tasks ──
+        async with httpx.AsyncClient(http2=True, timeout=40) as client, tm, FairScheduler(tm.aimd.maximum) as sched:
+            tasks = [
+                sem_task(uid, projects)
+                for uid, projects in user_projects.items()
+            ]
+            for f in tqdm_asyncio.as_completed(tasks, total=len(tasks), desc="Users"):
+                await f
+
+        if coverage is not None:
+            coverage.close()
+
+        print("All done.")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
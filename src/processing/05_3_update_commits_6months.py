@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import asyncpg
 import httpx
@@ -13,6 +14,10 @@ from typing import List
 import pytz
 import json
 import socket
+from collector_metrics import metrics, start_metrics, loop_monitor
+from contribution_coverage import ContributionCoverage, plan_window, year_chunks
+from github_tokens import TokenManager, with_rate_limit
+from response_archive import ARCHIVE
 
 """
 CREATE TABLE IF NOT EXISTS user_proj_repo_after_6mon (
@@ -37,6 +42,11 @@ CREATE TABLE IF NOT EXISTS processed_keys (
 class RetryableNetworkError(Exception):
     pass
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--delta", action="store_true",
+                    help="also revisit processed keys; only spans missing from the coverage index are fetched")
+args = parser.parse_args()
+
 # Load environment
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 
@@ -44,80 +54,20 @@ DB_DSN = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.ge
 
 
 TOKENS = [t.strip() for t in os.getenv("TOKENS", "").split(",") if t.strip()]
+TOKENS = ARCHIVE.tokens(TOKENS)
 if not TOKENS:
     sys.exit("Set TOKENS=ghp_xxx,... in .env")
 
-# ────── Token Manager ────────────────────────────────────────────────
-class TokenState:
-    __slots__ = ("token", "remaining", "reset", "in_use")
-    def __init__(self, token): self.token, self.remaining, self.reset, self.in_use = token, 5000, 0, False
-
-class TokenManager:
-    def __init__(self, tokens, per_token_concurrency=5):
-        self.tokens = [TokenState(t) for t in tokens]
-        self.permit = asyncio.Semaphore(len(tokens)*per_token_concurrency)
-        self.lock   = asyncio.Lock()
-
-
-    async def acquire(self):
-        await self.permit.acquire()
-
-        while True:
-            async with self.lock:
-                now = time.time()
-
-                for i, t in enumerate(self.tokens):
-                    if t.remaining == 0 and now >= t.reset:
-                        t.remaining = 5000  
-                    if t.remaining > 0 and not t.in_use:
-                        t.in_use = True
-                        t.remaining -= 1
-                        return t
-
-                active_tokens = [t for t in self.tokens if t.remaining > 0]
+GITHUB_API = os.getenv("GITHUB_API", "https://api.github.com")
+FAMILY = "graphql"
+# answer windows from the per-user coverage index (contribution_coverage.py), fetching only uncovered spans
+CONTRIB_COVERAGE = os.getenv("CONTRIB_COVERAGE", "1") != "0"
 
-                if active_tokens:
-                    sleep_sec = 5  
-                    print("All tokens are busy but still have quota. Waiting shortly for any to free...")
-                else:
-                    next_reset = min(t.reset for t in self.tokens)
-                    sleep_sec = max(next_reset - now + 5, 5)
-                    local_tz = pytz.timezone('Europe/Amsterdam')
-                    # print("No tokens with remaining quota.")
-                    # print("Now:", datetime.fromtimestamp(now, local_tz))
-                    # print("Reset time:", datetime.fromtimestamp(next_reset, local_tz))
-                    print(f"No tokens with remaining quota. Sleeping for {sleep_sec:.1f}s to wait for rate limit reset.")
-
-            await asyncio.sleep(sleep_sec)
-
-
-    async def release(self, t: TokenState, hdr):
-        async with self.lock:
-            t.in_use = False
-            # print(f"Releasing token: {t.token[:6]}...")
-
-            if 'X-RateLimit-Remaining' in hdr:
-                t.remaining = int(hdr['X-RateLimit-Remaining'])
-                # print(f"Updated remaining = {t.remaining}")
-
-        if 'X-RateLimit-Reset' in hdr:
-            try:
-                reset_ts = float(hdr['X-RateLimit-Reset'])
-                now = time.time()
-                if reset_ts < now:  
-                    reset_ts = now + 300 # wait 300 seconds
-                t.reset = reset_ts
-            except:
-                t.reset = time.time() + 300  # fallback
-        else:
-            t.reset = time.time() + 300  # fallback if reset header missing
-
-        self.permit.release()
-
-tm = TokenManager(TOKENS)
+# ────── Token Manager ────────────────────────────────────────────────
+tm = TokenManager(TOKENS, family=FAMILY)
 
 # ────── GraphQL ─────────────────────────────────────────────────────
-GQL = """
+GQL = with_rate_limit("""
 query($login:String!,$from:DateTime!,$to:DateTime!){
   user(login:$login){
     contributionsCollection(from:$from,to:$to){
@@ -127,30 +77,23 @@ query($login:String!,$from:DateTime!,$to:DateTime!){
     }
   }
 }
-"""
+""")
 
 
 async def call_github(login: str, start: datetime, end: datetime, client: httpx.AsyncClient, retries=3):
+    """Repos of the span, or None when the request failed (the span then stays uncovered)"""
     delay = 1
     for attempt in range(1, retries + 1):
-        token_state = await tm.acquire()
-        headers = {"Authorization": f"Bearer {token_state.token}"}
+        variables = {
+            "login": login,
+            "from": start.isoformat(),
+            "to": end.isoformat()
+        }
 
         try:
-            resp = await client.post(
-                "https://api.github.com/graphql",
-                json={
-                    "query": GQL,
-                    "variables": {
-                        "login": login,
-                        "from": start.isoformat(),
-                        "to": end.isoformat()
-                    }
-                },
-                headers=headers,
-                timeout=120
-            )
-            await tm.release(token_state, resp.headers)
+            # throttled responses are retried inside tm.request after the wait GitHub asks for
+            resp = await tm.request(client, "POST", f"{GITHUB_API}/graphql",
+                                    query=GQL, variables=variables, timeout=120)
             
             if resp.status_code in {502, 503, 504}:  
                 raise RetryableNetworkError(f"Server error {resp.status_code} for {login}")
@@ -168,24 +111,24 @@ async def call_github(login: str, start: datetime, end: datetime, client: httpx.
             return repos
 
         except (httpx.ConnectTimeout, httpx.ReadTimeout, httpx.ConnectError, httpx.RemoteProtocolError) as e:  
-            await tm.release(token_state, resp.headers if 'resp' in locals() else {})
             raise RetryableNetworkError(f"Network timeout or protocol error: {e}") from e
 
         except socket.gaierror as e:  
-            await tm.release(token_state, resp.headers if 'resp' in locals() else {})
             raise RetryableNetworkError(f"DNS resolution failed: {e}") from e
 
         except RetryableNetworkError as e:  
             print(f"⏳ Retryable error for {login} [{start.date()} → {end.date()}] try {attempt}: {e}")
             if attempt == retries:
-                return [] 
-            await asyncio.sleep(delay + random.random())
+                return None
+            backoff = delay + random.random()
+            metrics.inc("github_retries_total", endpoint="graphql", reason="retryable_network")
+            metrics.inc("github_backoff_sleep_seconds_total", backoff, reason="retry")
+            await asyncio.sleep(backoff)
             delay *= 2
 
         except Exception as e:  
             print(f"Fatal error for {login} [{start.date()} → {end.date()}] try {attempt}: {e}")
-            await tm.release(token_state, resp.headers if 'resp' in locals() else {})
-            return []
+            return None
 
 
 # ────── Database Operations ─────────────────────────────────────────
@@ -223,83 +166,125 @@ async def copy_before_rows(conn):
         ON CONFLICT DO NOTHING;
     """)
 
-async def fetch_unprocessed_rows(conn):
-    return await conn.fetch("""
+async def fetch_unprocessed_rows(conn, delta=False):
+    """'after' rows not processed yet; with delta all of them"""
+    return await conn.fetch(f"""
         SELECT upr.user_id, upr.project_id, upr.window_start_time
         FROM user_proj_repo upr
         LEFT JOIN processed_keys pk
         ON upr.user_id = pk.user_id AND upr.project_id = pk.project_id
-        WHERE upr.window_type = 'after' AND pk.user_id IS NULL
+        WHERE upr.window_type = 'after' {'' if delta else 'AND pk.user_id IS NULL'}
     """)
 
-async def process_row(row, client, pool, sem) -> bool:
+async def fetch_window(user_id, start, end, client, coverage):
+    """Repos of [start, end): recorded spans from the coverage index plus requests for the gaps; None if one failed"""
+    if coverage is not None:
+        repos, gaps = plan_window(await coverage.aspans(user_id), start, end)
+    else:
+        repos, gaps = set(), [(start, end)]
+
+    failed = False
+    for lo, hi in gaps:
+        for a, b in year_chunks(lo, hi):
+            chunk = await call_github(user_id, a, b, client)
+            if chunk is None:
+                failed = True
+                continue
+            repos |= chunk
+            if coverage is not None:
+                await coverage.astore(user_id, a, b, chunk)
+    return None if failed else repos
+
+async def process_row(row, client, pool, sem, coverage) -> bool:
+    metrics.add("collector_queue_depth", 1, queue="rows")
     async with sem:
+        metrics.add("collector_queue_depth", -1, queue="rows")
         user_id = row["user_id"]
         project_id = row["project_id"]
         start = row["window_start_time"]
         end = start + timedelta(days=183)
 
         try:
-            repos = await call_github(user_id, start, end, client)
+            repos = await fetch_window(user_id, start, end, client, coverage)
         except RetryableNetworkError as e:
             print(f"Skipping {user_id}, {project_id} due to retryable network error: {e}")
             return False  
         except Exception as e:
-            print(f"call_github failed for {user_id}, using empty repos: {e}")
-            repos = []
+            print(f"call_github failed for {user_id}: {e}")
+            repos = None
+        if repos is None:
+            # neither written nor marked processed: an existing row is kept and the next run retries the key
+            print(f"Skipping {user_id}, {project_id}: window incomplete")
+            metrics.inc("collector_items_total", outcome="failed")
+            return False
 
         repos_to_save = json.dumps(list(repos))
 
         try:
+            t_db = time.time()
             async with pool.acquire() as conn:
                 async with conn.transaction():
                     await conn.execute("""
                         INSERT INTO user_proj_repo_after_6mon (
                             user_id, project_id, window_type, window_start_time, window_end_time, repos
                         ) VALUES ($1, $2, 'after', $3, $4, $5)
-                        ON CONFLICT DO UPDATE
+                        ON CONFLICT (user_id, project_id, window_type) DO UPDATE SET
+                            window_start_time = EXCLUDED.window_start_time,
+                            window_end_time = EXCLUDED.window_end_time,
+                            repos = EXCLUDED.repos
                     """, user_id, project_id, start, end, repos_to_save)
 
                     await conn.execute("""
                         INSERT INTO processed_keys (user_id, project_id)
                         VALUES ($1, $2)
-                        ON CONFLICT DO UPDATE
+                        ON CONFLICT (user_id, project_id) DO UPDATE SET processed_at = now()
                     """, user_id, project_id)
+            metrics.observe("db_write_seconds", time.time() - t_db, table="user_proj_repo_after_6mon")
         except Exception as e:
             print(f"Transaction failed (rolled back) at {user_id}, {project_id}: {e}")
+            metrics.inc("collector_items_total", outcome="failed")
             return False
 
+        metrics.inc("collector_items_total", outcome="done")
         return True
 
 
 # ────── Main ────────────────────────────────────────────────────────
 
 async def main():
-    pool = await asyncpg.create_pool(dsn=DB_DSN, max_size=20)
-
-    async with pool.acquire() as conn:
-        await create_tables(conn)
-        await copy_before_rows(conn)
-        rows = await fetch_unprocessed_rows(conn)
-
-    print(f"Rows to process: {len(rows)}")
-    sem = asyncio.Semaphore(10)
-    progress = tqdm(total=len(rows), desc="Processing", unit="row")
-
-    async with httpx.AsyncClient() as client:
-        async def wrapped_process_row(row):
-            success = await process_row(row, client, pool, sem)
-            if success:
-                progress.update(1)
-            else:
-                print(f"Skipped progress update for {row['user_id']}, {row['project_id']} due to insert failure")
-
-        tasks = [wrapped_process_row(row) for row in rows]
-        await asyncio.gather(*tasks)
-
-    await pool.close()
-    progress.close()
-    print("All done!")
+    start_metrics("05_3_update_commits_6months")
+    async with loop_monitor():
+        pool = await asyncpg.create_pool(dsn=DB_DSN, max_size=20)
+
+        async with pool.acquire() as conn:
+            await create_tables(conn)
+            await copy_before_rows(conn)
+            rows = await fetch_unprocessed_rows(conn, args.delta)
+
+        print(f"Rows to process: {len(rows)}")
+        # Enough rows to saturate the token manager; its adaptive limit decides the actual request concurrency
+        sem = asyncio.Semaphore(tm.aimd.maximum)
+        progress = tqdm(total=len(rows), desc="Processing", unit="row")
+        coverage = ContributionCoverage(DB_DSN) if CONTRIB_COVERAGE else None
+        if coverage is not None and args.delta:
+            print(f"Coverage index: {await coverage.abackfill()} spans seeded from existing windows")
+
+        async with httpx.AsyncClient(http2=True) as client, tm:
+            async def wrapped_process_row(row):
+                success = await process_row(row, client, pool, sem, coverage)
+                if success:
+                    progress.update(1)
+                else:
+                    print(f"Skipped progress update for {row['user_id']}, {row['project_id']} (not written)")
+
+            tasks = [wrapped_process_row(row) for row in rows]
+            await asyncio.gather(*tasks)
+
+        await pool.close()
+        if coverage is not None:
+            coverage.close()
+        progress.close()
+        print("All done!")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,243 @@
+-- ============================================
+-- Partitioned, index-tuned layout for the window and pair tables
+-- Run once after 05_5 (repos_outside) and 06_2 (colab pair tables), before 06_3
+-- ============================================
+--
+-- Window tables
+--   user_proj_repo (2y) and user_proj_repo_after_6mon (6m) are merged into user_proj_repo_windows,
+--   LIST-partitioned by horizon and sub-partitioned by window_type:
+--       user_proj_repo_windows
+--       ├── user_proj_repo_windows_2y   ├── _2y_before  └── _2y_after
+--       └── user_proj_repo_windows_6m   ├── _6m_before  └── _6m_after
+--   A "window_type = 'before'" join (06_3, 08_2) only touches one leaf. Each horizon has a unique index
+--   (user_id, project_id, window_type) INCLUDE (repos_num, repos_outside_num), so the repo counts 08_2 needs
+--   come from index-only scans instead of detoasting the JSONB lists.
+--   The old names stay usable: user_proj_repo / user_proj_repo_after_6mon become simple (auto-updatable)
+--   views on the horizon partitions, so the collectors' INSERT ... ON CONFLICT (user_id, project_id,
+--   window_type) and all SELECTs keep working unchanged.
+--
+-- Pair tables
+--   colab_project_participation, colab_pairs_single_proj, colab_pairs_multi_proj are HASH-partitioned on
+--   (user1_id, user2_id) into 8 partitions. 07_1 creates its category tables with the same partitioning,
+--   so pair-to-pair joins (07_1, 08_3) run partition by partition with enable_partitionwise_join.
+--
+-- The unpartitioned originals (and their indexes) are kept as *_unpartitioned until the row counts below have
+-- been checked.
+
+SET client_min_messages TO NOTICE;
+SET maintenance_work_mem = '256MB';
+
+-- ============================================
+-- Step 1: Window table
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS user_proj_repo_windows (
+    user_id TEXT NOT NULL REFERENCES users(user_id),
+    project_id INT NOT NULL REFERENCES projects(project_id),
+    horizon TEXT NOT NULL CHECK (horizon IN ('2y', '6m')),
+    window_type TEXT NOT NULL CHECK (window_type IN ('before', 'after')),
+    window_start_time TIMESTAMPTZ NOT NULL,
+    window_end_time TIMESTAMPTZ NOT NULL,
+    repos JSONB,
+    repos_outside JSONB,
+    repos_num INT GENERATED ALWAYS AS (
+        CASE WHEN jsonb_typeof(repos) = 'array' THEN jsonb_array_length(repos) END
+    ) STORED,
+    repos_outside_num INT GENERATED ALWAYS AS (
+        CASE WHEN jsonb_typeof(repos_outside) = 'array' THEN jsonb_array_length(repos_outside) END
+    ) STORED
+) PARTITION BY LIST (horizon);
+
+CREATE TABLE IF NOT EXISTS user_proj_repo_windows_2y
+    PARTITION OF user_proj_repo_windows FOR VALUES IN ('2y') PARTITION BY LIST (window_type);
+CREATE TABLE IF NOT EXISTS user_proj_repo_windows_6m
+    PARTITION OF user_proj_repo_windows FOR VALUES IN ('6m') PARTITION BY LIST (window_type);
+
+CREATE TABLE IF NOT EXISTS user_proj_repo_windows_2y_before
+    PARTITION OF user_proj_repo_windows_2y FOR VALUES IN ('before');
+CREATE TABLE IF NOT EXISTS user_proj_repo_windows_2y_after
+    PARTITION OF user_proj_repo_windows_2y FOR VALUES IN ('after');
+CREATE TABLE IF NOT EXISTS user_proj_repo_windows_6m_before
+    PARTITION OF user_proj_repo_windows_6m FOR VALUES IN ('before');
+CREATE TABLE IF NOT EXISTS user_proj_repo_windows_6m_after
+    PARTITION OF user_proj_repo_windows_6m FOR VALUES IN ('after');
+
+-- rows inserted through the views get their horizon from the partition they are written to
+ALTER TABLE user_proj_repo_windows_2y ALTER COLUMN horizon SET DEFAULT '2y';
+ALTER TABLE user_proj_repo_windows_6m ALTER COLUMN horizon SET DEFAULT '6m';
+
+-- conflict target of the collectors + covering index for the 06_3 / 08_2 joins
+CREATE UNIQUE INDEX IF NOT EXISTS user_proj_repo_windows_2y_key
+    ON user_proj_repo_windows_2y (user_id, project_id, window_type) INCLUDE (repos_num, repos_outside_num);
+CREATE UNIQUE INDEX IF NOT EXISTS user_proj_repo_windows_6m_key
+    ON user_proj_repo_windows_6m (user_id, project_id, window_type) INCLUDE (repos_num, repos_outside_num);
+
+-- project-side lookups (05_4 / 05_5 per-project updates)
+CREATE INDEX IF NOT EXISTS user_proj_repo_windows_project_idx
+    ON user_proj_repo_windows (project_id, window_type);
+
+-- Copy the two old tables in and rename them out of the way
+DO $$
+DECLARE
+    src RECORD;
+    has_outside BOOLEAN;
+    rows_copied BIGINT;
+BEGIN
+    FOR src IN SELECT * FROM (VALUES ('user_proj_repo', '2y'), ('user_proj_repo_after_6mon', '6m')) AS s(tbl, horizon)
+    LOOP
+        IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(src.tbl)) IS DISTINCT FROM 'r' THEN
+            RAISE NOTICE '%: not a plain table (already migrated?), skipping', src.tbl;
+            CONTINUE;
+        END IF;
+
+        has_outside := EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = src.tbl AND column_name = 'repos_outside'
+        );
+
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', src.tbl, src.tbl || '_unpartitioned');
+        EXECUTE format(
+            'INSERT INTO user_proj_repo_windows
+                 (user_id, project_id, horizon, window_type, window_start_time, window_end_time, repos, repos_outside)
+             SELECT user_id, project_id, %L, window_type, window_start_time, window_end_time, repos, %s
+             FROM %I',
+            src.horizon, CASE WHEN has_outside THEN 'repos_outside' ELSE 'NULL::jsonb' END, src.tbl || '_unpartitioned'
+        );
+        GET DIAGNOSTICS rows_copied = ROW_COUNT;
+        RAISE NOTICE '%: % rows -> user_proj_repo_windows_%', src.tbl, rows_copied, src.horizon;
+    END LOOP;
+END $$;
+
+-- The old names, as views on the horizon partitions
+CREATE OR REPLACE VIEW user_proj_repo AS
+SELECT user_id, project_id, window_type, window_start_time, window_end_time,
+       repos, repos_outside, repos_num, repos_outside_num
+FROM user_proj_repo_windows_2y;
+
+CREATE OR REPLACE VIEW user_proj_repo_after_6mon AS
+SELECT user_id, project_id, window_type, window_start_time, window_end_time,
+       repos, repos_outside, repos_num, repos_outside_num
+FROM user_proj_repo_windows_6m;
+
+-- ============================================
+-- Step 2: Hash-partitioned pair tables
+-- ============================================
+
+-- Partitions <tbl>_p0 .. <tbl>_p<partition_count - 1> of a table declared PARTITION BY HASH (user1_id, user2_id)
+CREATE OR REPLACE FUNCTION create_pair_partitions(tbl TEXT, partition_count INT DEFAULT 8)
+RETURNS VOID AS $$
+BEGIN
+    FOR i IN 0 .. partition_count - 1 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+            tbl || '_p' || i, tbl, partition_count, i
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Give the secondary indexes of <tbl>_unpartitioned the suffix too, so the names are free for the indexes created
+-- on the partitioned table below (CREATE INDEX IF NOT EXISTS would otherwise only find the old ones)
+CREATE OR REPLACE FUNCTION rename_unpartitioned_indexes(old_tbl TEXT)
+RETURNS VOID AS $$
+DECLARE
+    idx TEXT;
+BEGIN
+    FOR idx IN
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(old_tbl) AND NOT i.indisprimary AND c.relname NOT LIKE '%\_unpartitioned'
+    LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', idx, left(idx, 49) || '_unpartitioned');
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rebuild an existing pair table as a hash-partitioned table with the same columns, defaults and primary key
+CREATE OR REPLACE FUNCTION partition_pair_table(tbl TEXT, partition_count INT DEFAULT 8)
+RETURNS VOID AS $$
+DECLARE
+    old_tbl TEXT := tbl || '_unpartitioned';
+    pkey_name TEXT;
+    pkey_def TEXT;
+    rows_copied BIGINT;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(tbl)) THEN
+        RAISE NOTICE '%: already partitioned, skipping', tbl;
+        -- a table migrated before the indexes were renamed still holds the names
+        PERFORM rename_unpartitioned_indexes(old_tbl);
+        RETURN;
+    END IF;
+
+    SELECT conname, pg_get_constraintdef(oid) INTO pkey_name, pkey_def
+    FROM pg_constraint WHERE conrelid = to_regclass(tbl) AND contype = 'p';
+
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', tbl, old_tbl);
+    EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I', old_tbl, pkey_name, old_tbl || '_pkey');
+    PERFORM rename_unpartitioned_indexes(old_tbl);
+
+    -- secondary indexes are not copied: the ones the pipeline needs are created below on the partitioned table
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE %I INCLUDING ALL EXCLUDING INDEXES) PARTITION BY HASH (user1_id, user2_id)',
+        tbl, old_tbl
+    );
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I %s', tbl, tbl || '_pkey', pkey_def);
+    PERFORM create_pair_partitions(tbl, partition_count);
+
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', tbl, old_tbl);
+    GET DIAGNOSTICS rows_copied = ROW_COUNT;
+    RAISE NOTICE '%: % rows -> % hash partitions', tbl, rows_copied, partition_count;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT partition_pair_table('colab_project_participation');
+SELECT partition_pair_table('colab_pairs_single_proj');
+SELECT partition_pair_table('colab_pairs_multi_proj');
+
+-- 06_2 lookups by project (GIN) and the pair -> project lookups of 08_3 (index-only)
+CREATE INDEX IF NOT EXISTS idx_colab_pairs_multi_proj_project_ids
+    ON colab_pairs_multi_proj USING GIN (project_ids);
+CREATE INDEX IF NOT EXISTS idx_colab_pairs_single_proj_pair_cover
+    ON colab_pairs_single_proj (user1_id, user2_id) INCLUDE (project_id, first_proj_start, first_proj_end);
+CREATE INDEX IF NOT EXISTS idx_colab_pairs_multi_proj_pair_cover
+    ON colab_pairs_multi_proj (user1_id, user2_id) INCLUDE (first_proj, last_proj, first_proj_start, last_proj_end);
+CREATE INDEX IF NOT EXISTS idx_colab_project_participation_project
+    ON colab_project_participation (project_id);
+
+-- visibility map + statistics, so the covering indexes are used for index-only scans right away
+VACUUM (ANALYZE) user_proj_repo_windows;
+VACUUM (ANALYZE) colab_project_participation;
+VACUUM (ANALYZE) colab_pairs_single_proj;
+VACUUM (ANALYZE) colab_pairs_multi_proj;
+
+-- ============================================
+-- Step 3: Verify
+-- ============================================
+
+SELECT 'user_proj_repo' AS table_name,
+       (SELECT COUNT(*) FROM user_proj_repo) AS partitioned,
+       (SELECT COUNT(*) FROM user_proj_repo_unpartitioned) AS original
+UNION ALL
+SELECT 'user_proj_repo_after_6mon',
+       (SELECT COUNT(*) FROM user_proj_repo_after_6mon),
+       (SELECT COUNT(*) FROM user_proj_repo_after_6mon_unpartitioned)
+UNION ALL
+SELECT 'colab_project_participation',
+       (SELECT COUNT(*) FROM colab_project_participation),
+       (SELECT COUNT(*) FROM colab_project_participation_unpartitioned)
+UNION ALL
+SELECT 'colab_pairs_single_proj',
+       (SELECT COUNT(*) FROM colab_pairs_single_proj),
+       (SELECT COUNT(*) FROM colab_pairs_single_proj_unpartitioned)
+UNION ALL
+SELECT 'colab_pairs_multi_proj',
+       (SELECT COUNT(*) FROM colab_pairs_multi_proj),
+       (SELECT COUNT(*) FROM colab_pairs_multi_proj_unpartitioned);
+
+-- Rows per partition
+-- SELECT tableoid::regclass AS partition, COUNT(*) FROM user_proj_repo_windows GROUP BY 1 ORDER BY 1;
+-- SELECT tableoid::regclass AS partition, COUNT(*) FROM colab_pairs_single_proj GROUP BY 1 ORDER BY 1;
+
+-- Once the counts match:
+-- DROP TABLE user_proj_repo_unpartitioned, user_proj_repo_after_6mon_unpartitioned;
+-- DROP TABLE colab_project_participation_unpartitioned, colab_pairs_single_proj_unpartitioned,
+--            colab_pairs_multi_proj_unpartitioned;
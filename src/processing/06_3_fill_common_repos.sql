@@ -4,6 +4,8 @@
 -- FIXED VERSION: Use NULL for unprocessed rows instead of empty arrays
 -- ============================================
 
+-- The batch updates below can also be run with keyset batches, a self-tuning batch size and
+-- work_mem sized to the server, without editing this file: python sql_batch_driver.py 06_3
 -- Set working memory (adjust based on your laptop)
 SET work_mem = '256MB';
 SET maintenance_work_mem = '512MB';
@@ -48,6 +50,31 @@ ADD COLUMN common_repos_after_2y_continuation_inc text[],
 ADD COLUMN common_repos_after_6m text[],
 ADD COLUMN common_repos_after_6m_continuation_inc text[];
 
+-- Partial indexes over the rows each step still has to fill: the "WHERE common_repos_X IS NULL LIMIT batch_size"
+-- batches become index scans instead of re-reading the already processed rows on every iteration.
+-- Filled rows drop out of the index; the indexes are dropped again after the last step.
+CREATE INDEX IF NOT EXISTS idx_single_todo_before ON colab_pairs_single_proj (user1_id, user2_id)
+    INCLUDE (project_id) WHERE common_repos_before IS NULL;
+CREATE INDEX IF NOT EXISTS idx_single_todo_after_2y ON colab_pairs_single_proj (user1_id, user2_id)
+    INCLUDE (project_id) WHERE common_repos_after_2y IS NULL;
+CREATE INDEX IF NOT EXISTS idx_single_todo_after_2y_inc ON colab_pairs_single_proj (user1_id, user2_id)
+    INCLUDE (project_id) WHERE common_repos_after_2y_continuation_inc IS NULL;
+CREATE INDEX IF NOT EXISTS idx_single_todo_after_6m ON colab_pairs_single_proj (user1_id, user2_id)
+    INCLUDE (project_id) WHERE common_repos_after_6m IS NULL;
+CREATE INDEX IF NOT EXISTS idx_single_todo_after_6m_inc ON colab_pairs_single_proj (user1_id, user2_id)
+    INCLUDE (project_id) WHERE common_repos_after_6m_continuation_inc IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_multi_todo_before ON colab_pairs_multi_proj (user1_id, user2_id)
+    INCLUDE (first_proj, last_proj) WHERE common_repos_before IS NULL;
+CREATE INDEX IF NOT EXISTS idx_multi_todo_after_2y ON colab_pairs_multi_proj (user1_id, user2_id)
+    INCLUDE (first_proj, last_proj) WHERE common_repos_after_2y IS NULL;
+CREATE INDEX IF NOT EXISTS idx_multi_todo_after_2y_inc ON colab_pairs_multi_proj (user1_id, user2_id)
+    INCLUDE (first_proj, last_proj) WHERE common_repos_after_2y_continuation_inc IS NULL;
+CREATE INDEX IF NOT EXISTS idx_multi_todo_after_6m ON colab_pairs_multi_proj (user1_id, user2_id)
+    INCLUDE (first_proj, last_proj) WHERE common_repos_after_6m IS NULL;
+CREATE INDEX IF NOT EXISTS idx_multi_todo_after_6m_inc ON colab_pairs_multi_proj (user1_id, user2_id)
+    INCLUDE (first_proj, last_proj) WHERE common_repos_after_6m_continuation_inc IS NULL;
+
 COMMIT;
 
 -- ============================================
@@ -898,6 +925,12 @@ BEGIN
     RAISE NOTICE 'common_repos_after_6m_continuation_inc update completed, total time: %', clock_timestamp() - start_time;
 END $$;
 
+-- All steps done: the work-queue indexes are empty
+DROP INDEX IF EXISTS idx_single_todo_before, idx_single_todo_after_2y, idx_single_todo_after_2y_inc,
+    idx_single_todo_after_6m, idx_single_todo_after_6m_inc;
+DROP INDEX IF EXISTS idx_multi_todo_before, idx_multi_todo_after_2y, idx_multi_todo_after_2y_inc,
+    idx_multi_todo_after_6m, idx_multi_todo_after_6m_inc;
+
 -- ============================================
 -- Verify Results
 -- ============================================
@@ -333,7 +333,7 @@ UNION ALL
 SELECT 
     'multi table' as table_name,
     COUNT(*) as total_rows,
-    COUNT(DISTINCT unnest(hack_ids)) as unique_hackathons,
+    (SELECT COUNT(DISTINCT h) FROM colab_pairs_multi_proj, unnest(hack_ids) AS h) as unique_hackathons,
     ROUND(AVG(array_length(project_ids, 1)), 2) as avg_projects_per_pair,
     ROUND(AVG(array_length(hack_ids, 1)), 2) as avg_hackathons_per_pair
 FROM colab_pairs_multi_proj
@@ -1,4 +1,16 @@
 -- Create 8 new tables with correct primary key structure
+-- Hash-partitioned like the colab pair tables (06_2_partition_window_and_pair_tables.sql), so the joins
+-- between them run partition by partition
+SET enable_partitionwise_join = on;
+SET enable_partitionwise_aggregate = on;
+
+DO $$
+BEGIN
+    IF to_regprocedure('create_pair_partitions(text, integer)') IS NULL THEN
+        RAISE EXCEPTION 'create_pair_partitions() not found: run 06_2_partition_window_and_pair_tables.sql first';
+    END IF;
+END $$;
+
 CREATE TABLE triggered_6m (
     user1_id TEXT NOT NULL,
     user2_id TEXT NOT NULL,
@@ -7,7 +19,7 @@ CREATE TABLE triggered_6m (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
 
 CREATE TABLE triggered_2y (
     user1_id TEXT NOT NULL,
@@ -17,7 +29,7 @@ CREATE TABLE triggered_2y (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
 
 CREATE TABLE terminated_6m (
     user1_id TEXT NOT NULL,
@@ -27,7 +39,7 @@ CREATE TABLE terminated_6m (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
 
 CREATE TABLE terminated_2y (
     user1_id TEXT NOT NULL,
@@ -37,7 +49,7 @@ CREATE TABLE terminated_2y (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
 
 CREATE TABLE sustained_6m (
     user1_id TEXT NOT NULL,
@@ -47,7 +59,7 @@ CREATE TABLE sustained_6m (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
 
 CREATE TABLE sustained_2y (
     user1_id TEXT NOT NULL,
@@ -57,7 +69,7 @@ CREATE TABLE sustained_2y (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
 
 CREATE TABLE temporary_6m (
     user1_id TEXT NOT NULL,
@@ -67,7 +79,7 @@ CREATE TABLE temporary_6m (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
 
 CREATE TABLE temporary_2y (
     user1_id TEXT NOT NULL,
@@ -77,7 +89,16 @@ CREATE TABLE temporary_2y (
     after_repos_6m_num INTEGER NOT NULL,
     after_repos_2y_num INTEGER NOT NULL,
     PRIMARY KEY (user1_id, user2_id)
-);
+) PARTITION BY HASH (user1_id, user2_id);
+
+SELECT create_pair_partitions('triggered_6m');
+SELECT create_pair_partitions('triggered_2y');
+SELECT create_pair_partitions('terminated_6m');
+SELECT create_pair_partitions('terminated_2y');
+SELECT create_pair_partitions('sustained_6m');
+SELECT create_pair_partitions('sustained_2y');
+SELECT create_pair_partitions('temporary_6m');
+SELECT create_pair_partitions('temporary_2y');
 
 -- Table 1: triggered_6m (no collaboration before, collaborated within 6 months after)
 INSERT INTO triggered_6m
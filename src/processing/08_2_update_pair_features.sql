@@ -8,6 +8,20 @@
 -- ============================================
 SET client_min_messages TO NOTICE;
 
+-- repos_outside_num comes from the window tables of 06_2_partition_window_and_pair_tables.sql
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name IN ('user_proj_repo', 'user_proj_repo_after_6mon') AND column_name = 'repos_outside_num'
+        HAVING COUNT(*) = 2
+    ) THEN
+        RAISE EXCEPTION 'user_proj_repo(_after_6mon).repos_outside_num not found: run 06_2_partition_window_and_pair_tables.sql first';
+    END IF;
+END $$;
+
+-- The batch updates below can also be run with keyset batches, a self-tuning batch size and
+-- work_mem sized to the server, without editing this file: python sql_batch_driver.py 08_2
 -- Memory allocation (Conservative)
 SET work_mem = '128MB';
 SET maintenance_work_mem = '256MB';
@@ -214,8 +228,8 @@ BEGIN
         UPDATE triggered_6m t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
         FROM user_proj_repo_after_6mon u1, user_proj_repo_after_6mon u2
         WHERE t.user1_id = u1.user_id 
@@ -249,8 +263,8 @@ BEGIN
         UPDATE terminated_6m t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
         FROM user_proj_repo_after_6mon u1, user_proj_repo_after_6mon u2
         WHERE t.user1_id = u1.user_id 
@@ -284,8 +298,8 @@ BEGIN
         UPDATE sustained_6m t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
         FROM user_proj_repo_after_6mon u1, user_proj_repo_after_6mon u2
         WHERE t.user1_id = u1.user_id 
@@ -319,8 +333,8 @@ BEGIN
         UPDATE temporary_6m t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
 
         FROM user_proj_repo_after_6mon u1, user_proj_repo_after_6mon u2
@@ -359,8 +373,8 @@ BEGIN
         UPDATE triggered_2y t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
         FROM user_proj_repo u1, user_proj_repo u2
         WHERE t.user1_id = u1.user_id 
@@ -394,8 +408,8 @@ BEGIN
         UPDATE terminated_2y t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
         FROM user_proj_repo u1, user_proj_repo u2
         WHERE t.user1_id = u1.user_id 
@@ -429,8 +443,8 @@ BEGIN
         UPDATE sustained_2y t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
         FROM user_proj_repo u1, user_proj_repo u2
         WHERE t.user1_id = u1.user_id 
@@ -464,8 +478,8 @@ BEGIN
         UPDATE temporary_2y t
         SET 
             avg_outside_repos_before = (
-                COALESCE(jsonb_array_length(u1.repos_outside), 0) + 
-                COALESCE(jsonb_array_length(u2.repos_outside), 0)
+                COALESCE(u1.repos_outside_num, 0) + 
+                COALESCE(u2.repos_outside_num, 0)
             ) / 2.0
         FROM user_proj_repo u1, user_proj_repo u2
         WHERE t.user1_id = u1.user_id 
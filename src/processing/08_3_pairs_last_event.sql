@@ -1,3 +1,6 @@
+-- category tables and colab pair tables share the same hash partitioning: join them partition by partition
+SET enable_partitionwise_join = on;
+
 CREATE TABLE triggered_6m_last AS
 SELECT 
     t.user1_id,
@@ -0,0 +1,212 @@
+######## Goal:
+######## Throughput benchmark for the GitHub collectors, run offline against mock_github_api.py
+########
+######## Every collector is started as a subprocess with GITHUB_API pointing at the mock server,
+######## so the scripts run unmodified. Reported per collector:
+########   requests/sec      all requests seen by the server / wall-clock seconds
+########   quota efficiency  useful (200, quota-charged) responses / quota points charged
+########   probes            200 responses to free rateLimit queries, not counted as useful
+########   latency p50/p95/p99 per endpoint (server side, including injected latency)
+########
+######## 01 and 02_contributorAPI read CSV input, which is generated here.
+######## 02_commitAPI and the 05_* collectors read their pending work from Postgres (DB_* in .env),
+######## so they are only run with --with-db against a scratch database.
+########
+######## --archive FILE records every response into a response archive (response_archive.py); with --replay the
+######## collectors run from that archive instead, so the mock sees no traffic and only wall-clock is meaningful:
+######## a fixed workload for comparing parser / DB-side changes without API latency.
+########
+######## Usage:
+########   python bench_collectors.py --collectors 01 02c --rows 200 --latency-ms 80
+########   python bench_collectors.py --with-db --collectors 05_2 05_3 --timeout 600
+########   python bench_collectors.py --collectors 01 02c --archive bench.sqlite [--replay]
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.request import Request, urlopen
+
+from mock_github_api import start_server
+
+HERE = Path(__file__).resolve().parent
+
+COLLECTORS = {
+    "01": {"script": "01_accessibility.py", "needs_db": False},
+    "02c": {"script": "02_get_contributors_contributorAPI.py", "needs_db": False},
+    "02": {"script": "02_get_contributors_commitAPI.py", "needs_db": True},
+    "02g": {"script": "02_get_contributors_commitAPI.py", "needs_db": True, "env": {"COMMIT_BACKEND": "graphql"}},
+    "05_2": {"script": "05_2_updated_get_complete_commits.py", "needs_db": True},
+    "05_2f": {"script": "05_2_fill_missing_data.py", "needs_db": True},
+    "05_3": {"script": "05_3_update_commits_6months.py", "needs_db": True},
+    "05_3f": {"script": "05_3_fill_missing_data.py", "needs_db": True},
+}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def mock_call(base, path, method="GET"):
+    req = Request(f"{base}{path}", method=method, data=b"" if method == "POST" else None)
+    with urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def write_inputs(workdir, rows, n_repos):
+    """CSV inputs for the two file-driven collectors, laid out as ../data relative to the run dir"""
+    data_dir = workdir / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    def links(i):
+        # mostly valid synthetic repos, some non-existent and some non-GitHub links
+        out = [f"https://github.com/org{(i * 7 + k) % 97}/repo{(i * 7 + k) % n_repos}" for k in range(1 + i % 3)]
+        if i % 11 == 0:
+            out.append(f"https://github.com/ghost/missing{i}")
+        if i % 13 == 0:
+            out.append("https://gitlab.com/some/project")
+        return ",".join(out)
+
+    with open(data_dir / "projects.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["submitted_to_link", "project_URL", "github_links"])
+        for i in range(rows):
+            w.writerow([f"https://hack{i % 50}.devpost.com/", f"https://devpost.com/software/p{i}", links(i)])
+
+    with open(data_dir / "hackathon_project.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["hackathon_URL", "project_URL", "github_links", "start_date_format", "end_date_format", "participants"])
+        for i in range(rows):
+            w.writerow([f"https://hack{i % 50}.devpost.com/", f"https://devpost.com/software/p{i}", links(i),
+                        "2020-03-01", "2020-03-03", ""])
+
+    run_dir = workdir / "run"
+    run_dir.mkdir(exist_ok=True)
+    return run_dir
+
+
+def run_collector(name, base, run_dir, tokens, timeout, extra_env):
+    spec = COLLECTORS[name]
+    env = {**os.environ, **extra_env, **spec.get("env", {}), "GITHUB_API": base, "TOKENS": ",".join(tokens), "PYTHONUNBUFFERED": "1"}
+    mock_call(base, "/_reset", "POST")
+
+    t0 = time.time()
+    try:
+        proc = subprocess.run(
+            [sys.executable, str(HERE / spec["script"])],
+            cwd=run_dir, env=env, timeout=timeout,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        exit_code, output = proc.returncode, proc.stdout
+    except subprocess.TimeoutExpired as e:
+        exit_code, output = "timeout", e.stdout or ""
+        if isinstance(output, bytes):
+            output = output.decode(errors="replace")
+    wall = time.time() - t0
+
+    stats = mock_call(base, "/_stats")
+    total = sum(stats["requests"].values())
+    quota = sum(stats["quota_used"].values())
+    latency = {
+        ep: {"n": len(v), "p50": percentile(v, 0.5), "p95": percentile(v, 0.95), "p99": percentile(v, 0.99)}
+        for ep, v in stats["latencies"].items()
+    }
+    return {
+        "collector": name,
+        "script": spec["script"],
+        "exit_code": exit_code,
+        "wall_seconds": round(wall, 2),
+        "requests": total,
+        "requests_per_sec": round(total / wall, 2) if wall else 0.0,
+        "useful_responses": stats["useful_responses"],
+        "probe_responses": stats["probe_responses"],
+        "quota_used": stats["quota_used"],
+        "quota_efficiency": round(stats["useful_responses"] / quota, 3) if quota else 0.0,
+        "by_status": stats["requests"],
+        "latency": latency,
+        "output_tail": output[-2000:],
+    }
+
+
+def print_report(results):
+    print("\n" + "=" * 103)
+    print(f"{'collector':<8} {'exit':>7} {'wall(s)':>9} {'requests':>9} {'req/s':>8} {'quota eff':>10} {'probes':>6} "
+          f"{'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    print("-" * 103)
+    for r in results:
+        worst = max(r["latency"].values(), key=lambda x: x["p99"], default={"p50": 0, "p95": 0, "p99": 0})
+        print(f"{r['collector']:<8} {str(r['exit_code']):>7} {r['wall_seconds']:>9} {r['requests']:>9} "
+              f"{r['requests_per_sec']:>8} {r['quota_efficiency']:>10} {r.get('probe_responses', 0):>6} "
+              f"{worst['p50'] * 1000:>9.1f} {worst['p95'] * 1000:>9.1f} {worst['p99'] * 1000:>9.1f}")
+    print("=" * 103)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the collectors")
+    parser.add_argument("--collectors", nargs="+", default=["01", "02c"], choices=sorted(COLLECTORS))
+    parser.add_argument("--with-db", action="store_true", help="also allow collectors that read pending work from Postgres")
+    parser.add_argument("--tokens", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=200, help="input rows for CSV-driven collectors")
+    parser.add_argument("--timeout", type=int, default=900)
+    parser.add_argument("--output", default="bench_collectors.json")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--secondary-rate", type=float, default=0.0)
+    parser.add_argument("--error-502-rate", type=float, default=0.0)
+    parser.add_argument("--error-403-rate", type=float, default=0.0)
+    parser.add_argument("--max-inflight-per-token", type=int, default=0)
+    parser.add_argument("--core-limit", type=int, default=5000)
+    parser.add_argument("--graphql-limit", type=int, default=5000)
+    parser.add_argument("--repos", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--archive", default="", help="response archive to record into (or replay from)")
+    parser.add_argument("--replay", action="store_true", help="run the collectors from --archive, without requests")
+    args = parser.parse_args()
+    if args.replay and not args.archive:
+        parser.error("--replay needs --archive")
+    extra_env = {}
+    if args.archive:
+        extra_env = {"GITHUB_ARCHIVE": str(Path(args.archive).resolve()),
+                     "GITHUB_ARCHIVE_MODE": "replay" if args.replay else "record"}
+
+    server = start_server(
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+        secondary_rate=args.secondary_rate, error_502_rate=args.error_502_rate, error_403_rate=args.error_403_rate,
+        max_inflight_per_token=args.max_inflight_per_token,
+        core_limit=args.core_limit, graphql_limit=args.graphql_limit,
+        repos=args.repos, users=args.users,
+    )
+    base = f"http://127.0.0.1:{server.server_port}"
+    print(f"Mock GitHub API on {base}")
+
+    tokens = [f"bench_token_{i}" for i in range(args.tokens)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        run_dir = write_inputs(Path(tmp), args.rows, args.repos)
+        for name in args.collectors:
+            if COLLECTORS[name]["needs_db"] and not args.with_db:
+                print(f"Skipping {name}: reads pending work from Postgres (use --with-db)")
+                continue
+            print(f"Running {name} ({COLLECTORS[name]['script']})...")
+            results.append(run_collector(name, base, run_dir, tokens, args.timeout, extra_env))
+
+    server.shutdown()
+    print_report(results)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Full results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+######## Goal:
+######## End-to-end scale benchmark of stages 06_1 - 09 on synthetic data (synthetic_devpost.py)
+########
+######## For every --scale the scratch database (DB_* in .env) is generated again, then the stages run in pipeline
+######## order, each as its own process (python for 06_1 / parallel_stages.py, psql for the SQL), and per stage are
+######## recorded:
+########   seconds          wall-clock
+########   client_rss_mb    peak RSS of the stage's process (VmHWM, read from /proc while it runs)
+########   server_rss_mb    peak private (anonymous) RSS summed over the stage's backends, sampled every 0.2 s from
+########                    /proc; only when the database server runs on this host, else null
+########   temp_mb          temp files the server wrote (sorts / hashes spilling past work_mem)
+########   tables           total size (heap + indexes + TOAST, over all partitions) and estimated rows of every
+########                    table the stage created or changed
+########
+######## Notebook stages run the SQL of their cells: 06_2 the string cells of
+######## 06_2_construct_colab_pairs_single_multi.ipynb, 08_2n the commented-out cells of 08_2_update_features_pairs.ipynb
+######## (common_event_num, common_project_num, time - needed by 08_3). 08_1 is not run: the generator already writes
+######## its feature columns.
+########
+######## Usage:
+########   python bench_pipeline.py --scales 1 10
+########   python bench_pipeline.py --scales 10 --parallel 8            # 06_3 / 07_1 / 08_2 via parallel_stages.py
+########   python bench_pipeline.py --no-generate --stages 06_1 06_2     # on an already generated database
+
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+
+import psycopg2
+
+from synthetic_devpost import DB_DSN
+
+HERE = Path(__file__).resolve().parent
+APP_NAME = "bench_pipeline"
+
+STAGES = {
+    "06_1": {"kind": "python", "script": "06_1_construct_colab_pairs_clean.py"},
+    "06_2": {"kind": "notebook", "script": "06_2_construct_colab_pairs_single_multi.ipynb"},
+    "06_2p": {"kind": "sql", "script": "06_2_partition_window_and_pair_tables.sql"},
+    "06_3": {"kind": "sql", "script": "06_3_fill_common_repos.sql", "parallel": True},
+    "06_4": {"kind": "sql", "script": "06_4_update_colab_pairs_hid.sql"},
+    "07_1": {"kind": "sql", "script": "07_1_categorize_pairs_to_4types.sql", "parallel": True},
+    "08_2n": {"kind": "notebook_commented", "script": "08_2_update_features_pairs.ipynb"},
+    "08_2": {"kind": "sql", "script": "08_2_update_pair_features.sql", "parallel": True},
+    "08_3": {"kind": "sql", "script": "08_3_pairs_last_event.sql"},
+    "09": {"kind": "sql", "script": "09_prepare_dataset.sql"},
+    "09_last": {"kind": "sql", "script": "09_prepare_dataset_last.sql"},
+}
+
+TABLE_SIZES = """
+SELECT c.relname, SUM(pg_total_relation_size(l.oid)), SUM(GREATEST(l.reltuples, 0))
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_class l ON l.oid = c.oid AND c.relkind = 'r'
+                OR l.oid IN (SELECT relid FROM pg_partition_tree(c.oid) WHERE isleaf)
+WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+GROUP BY c.relname
+"""
+
+# backends of the stage's sessions, with the parallel workers they started
+STAGE_BACKENDS = """
+SELECT pid FROM pg_stat_activity
+WHERE application_name = %(app)s
+   OR leader_pid IN (SELECT pid FROM pg_stat_activity WHERE application_name = %(app)s)
+"""
+
+
+# ────── Stage scripts ────────────────────────────────────────────────
+def notebook_sql(path, commented=False):
+    """SQL of a notebook's code cells: the string-literal cells, or with commented the fully commented-out cells"""
+    parts = []
+    for cell in json.loads(path.read_text(encoding="utf-8"))["cells"]:
+        if cell["cell_type"] != "code":
+            continue
+        source = "".join(cell["source"])
+        lines = [line for line in source.splitlines() if line.strip()]
+        if commented:
+            if lines and all(line.lstrip().startswith("#") for line in lines):
+                parts.append("\n".join(re.sub(r"^\s*# ?", "", line) for line in source.splitlines()))
+            continue
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", SyntaxWarning)
+            try:
+                tree = ast.parse(source)
+            except SyntaxError:
+                continue
+        parts += [node.value.value for node in tree.body
+                  if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+                  and isinstance(node.value.value, str)]
+    return "\n".join(parts)
+
+
+def stage_commands(name, args, workdir):
+    """argv lists that make up a stage, run one after the other"""
+    stage = STAGES[name]
+    path = HERE / stage["script"]
+    psql = [args.psql, "-X", "-q", "-v", "ON_ERROR_STOP=1", "-f"]
+    if stage["kind"] == "python":
+        return [[sys.executable, str(path)]]
+    if stage["kind"].startswith("notebook"):
+        script = workdir / f"{name}.sql"
+        script.write_text(notebook_sql(path, stage["kind"] == "notebook_commented"), encoding="utf-8")
+        return [psql + [str(script)]]
+    if args.parallel and stage.get("parallel"):
+        runner = [sys.executable, str(HERE / "parallel_stages.py"), name, "--workers", str(args.parallel)]
+        if name != "06_3":
+            return [runner]
+        # columns and helper functions first (Steps 0-1 and the helpers), the batch updates in parallel
+        text = path.read_text(encoding="utf-8")
+        setup = workdir / "06_3_setup.sql"
+        setup.write_text(text[:text.index("-- Step 2:")], encoding="utf-8")
+        return [psql + [str(setup)], runner]
+    return [psql + [str(path)]]
+
+
+def pg_environment():
+    env = dict(os.environ, PGAPPNAME=APP_NAME)
+    for var, key in (("PGHOST", "DB_HOST"), ("PGPORT", "DB_PORT"), ("PGUSER", "DB_USER"),
+                     ("PGPASSWORD", "DB_PASSWORD"), ("PGDATABASE", "DB_NAME")):
+        if os.getenv(key):
+            env[var] = os.getenv(key)
+    return env
+
+
+# ────── Measurements ─────────────────────────────────────────────────
+def status_kb(pid, field):
+    """A kB field of /proc/<pid>/status, None if the process is gone or not on this host"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class BackendMemory(threading.Thread):
+    """Peak of the summed RssAnon of the stage's backends; None if their /proc entries are not readable here"""
+
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_kb = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        conn = psycopg2.connect(DB_DSN, application_name=f"{APP_NAME}_monitor")
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                while not self.stopped.wait(self.interval):
+                    cur.execute(STAGE_BACKENDS, {"app": APP_NAME})
+                    sizes = [kb for kb in (status_kb(pid, "RssAnon") for pid, in cur.fetchall()) if kb is not None]
+                    if sizes:
+                        self.peak_kb = max(self.peak_kb or 0, sum(sizes))
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return None if self.peak_kb is None else round(self.peak_kb / 1024, 1)
+
+
+def temp_bytes(cur):
+    cur.execute("SELECT pg_stat_clear_snapshot()")
+    cur.execute("SELECT temp_bytes FROM pg_stat_database WHERE datname = current_database()")
+    return cur.fetchone()[0]
+
+
+def table_sizes(cur):
+    cur.execute(TABLE_SIZES)
+    return {name: (int(size or 0), int(rows or 0)) for name, size, rows in cur.fetchall()}
+
+
+def run_process(argv, env, log):
+    """(exit code, peak RSS in MB) of a child process, output appended to log"""
+    log.write(f"$ {' '.join(argv)}\n")
+    log.flush()
+    proc = subprocess.Popen(argv, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    # VmHWM only grows, so the last reading before exit is the peak (up to the final interval)
+    peak_kb = 0
+    while proc.poll() is None:
+        peak_kb = max(peak_kb, status_kb(proc.pid, "VmHWM") or 0)
+        time.sleep(0.1)
+    return proc.returncode, round(peak_kb / 1024, 1)
+
+
+def run_stage(name, args, cur, env, workdir, log_dir):
+    before = table_sizes(cur)
+    temp_before = temp_bytes(cur)
+    monitor = BackendMemory()
+    monitor.start()
+    exit_code, client_rss = 0, 0.0
+    t0 = time.time()
+    with open(log_dir / f"{name}.log", "a", encoding="utf-8") as log:
+        for argv in stage_commands(name, args, workdir):
+            exit_code, rss = run_process(argv, env, log)
+            client_rss = max(client_rss, rss)
+            if exit_code != 0:
+                break
+    seconds = time.time() - t0
+    server_rss = monitor.stop()
+    time.sleep(0.5)   # ended backends report their temp file statistics on exit
+    temp_mb = round((temp_bytes(cur) - temp_before) / 2 ** 20, 1)
+
+    after = table_sizes(cur)
+    changed = [t for t in after if before.get(t, (None,))[0] != after[t][0]]
+    if changed:
+        cur.execute("ANALYZE " + ", ".join(f'"{t}"' for t in changed))
+        after = table_sizes(cur)
+    return {
+        "stage": name, "exit_code": exit_code, "seconds": round(seconds, 2), "client_rss_mb": client_rss,
+        "server_rss_mb": server_rss, "temp_mb": temp_mb,
+        "tables": {t: {"mb": round(after[t][0] / 2 ** 20, 2), "rows": after[t][1]} for t in sorted(changed)},
+    }
+
+
+# ────── Report ───────────────────────────────────────────────────────
+def print_report(results):
+    print("\n" + "=" * 104)
+    print(f"{'scale':>6} {'stage':<8} {'exit':>5} {'wall(s)':>9} {'client MB':>10} {'server MB':>10} {'temp MB':>8}  "
+          f"largest output")
+    print("-" * 104)
+    for run in results:
+        for r in run["stages"]:
+            largest = max(r["tables"].items(), key=lambda kv: kv[1]["mb"], default=None)
+            output = f"{largest[0]} {largest[1]['mb']} MB / {largest[1]['rows']} rows" if largest else "-"
+            server = "-" if r["server_rss_mb"] is None else r["server_rss_mb"]
+            print(f"{run['scale']:>6} {r['stage']:<8} {r['exit_code']:>5} {r['seconds']:>9} {r['client_rss_mb']:>10} "
+                  f"{server:>10} {r['temp_mb']:>8}  {output}")
+        print(f"{run['scale']:>6} {'total':<8} {'':>5} {round(sum(r['seconds'] for r in run['stages']), 2):>9}")
+    print("=" * 104)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scale benchmark of stages 06_1 - 09 on synthetic data")
+    parser.add_argument("--scales", nargs="+", type=float, default=[1.0])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--no-generate", action="store_true", help="run on the dataset already in the database")
+    parser.add_argument("--parallel", type=int, default=0, help="run 06_3 / 07_1 / 08_2 on N connections")
+    parser.add_argument("--psql", default="psql")
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--log-dir", default="bench_pipeline_logs")
+    args = parser.parse_args()
+    if args.no_generate and len(args.scales) > 1:
+        parser.error("--no-generate runs on one dataset; give a single --scales value")
+
+    env = pg_environment()
+    results = []
+    for scale in args.scales:
+        log_dir = Path(args.log_dir) / f"scale_{scale:g}"
+        log_dir.mkdir(parents=True, exist_ok=True)
+        run = {"scale": scale, "seed": args.seed, "stages": []}
+        if not args.no_generate:
+            print(f"Generating scale {scale:g}...")
+            with open(log_dir / "generate.log", "w", encoding="utf-8") as log:
+                t0 = time.time()
+                code, rss = run_process([sys.executable, str(HERE / "synthetic_devpost.py"), "--scale", str(scale),
+                                         "--seed", str(args.seed), "--replace"], env, log)
+            run["generate"] = {"exit_code": code, "seconds": round(time.time() - t0, 2), "client_rss_mb": rss}
+            if code != 0:
+                print(f"Generation failed, see {log_dir / 'generate.log'}")
+                results.append(run)
+                break
+
+        conn = psycopg2.connect(DB_DSN)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur, tempfile.TemporaryDirectory() as workdir:
+                cur.execute("SELECT to_regclass('synthetic_dataset') IS NOT NULL")
+                if not cur.fetchone()[0]:
+                    raise SystemExit("no synthetic dataset in this database (run synthetic_devpost.py first)")
+                for name in sorted(args.stages, key=list(STAGES).index):
+                    print(f"[scale {scale:g}] {name} ({STAGES[name]['script']})...")
+                    result = run_stage(name, args, cur, env, Path(workdir), log_dir)
+                    run["stages"].append(result)
+                    if result["exit_code"] != 0:
+                        print(f"{name} failed, see {log_dir / (name + '.log')}")
+                        break
+        finally:
+            conn.close()
+        results.append(run)
+
+    print_report(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Full results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+######## Goal:
+######## Query-plan capture and plan-regression check for the heavy SQL stages 06_3, 06_4, 07_1, 08_2 and 08_3
+########
+######## capture  regenerates the synthetic fixture (synthetic_devpost.py, fixed --scale / --seed) and runs the pipeline
+########          up to 08_3 (other stages as in bench_pipeline.py). The captured stages run statement by statement:
+########            SELECT / WITH / INSERT / UPDATE / DELETE / CREATE TABLE AS
+########                        under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) - that run is the stage's real run
+########            DO blocks   every static statement of the body (plpgsql SELECT ... INTO and EXECUTE skipped) with
+########                        the DECLARE defaults filled in (batch_size ...), under EXPLAIN ANALYZE in a transaction
+########                        that is rolled back; then the block itself runs, timed. A batch loop thus shows the
+########                        plan of one batch.
+########            the rest    (SET, ALTER, CREATE INDEX ...) executed and timed
+########          Plans, timings and buffer counts go to --output (JSON); with --baseline the run is compared at once.
+########
+######## compare  matches the statements of two captures (by normalized text, then by position within the stage for
+########          statements whose text changed) and flags:
+########            join        a Hash / Merge Join over a set of relations that became a Nested Loop
+########            seq scan    a Seq Scan reading >= --large-rows rows on a relation that was not seq scanned before
+########            spill       temp blocks written where the baseline wrote none (sort / hash past work_mem)
+########            time        more than --time-tolerance slower and at least --min-ms slower
+########          Exit code 1 when anything is flagged, so it can gate changes to indexes, schema or the SQL files.
+########
+######## Captures are only comparable for the same fixture (scale, seed) and server settings; compare warns otherwise.
+########
+######## Usage:
+########   python bench_plans.py capture --output plans_baseline.json
+########   python bench_plans.py capture --output plans_new.json --baseline plans_baseline.json
+########   python bench_plans.py compare plans_baseline.json plans_new.json --time-tolerance 0.3
+
+import argparse
+import hashlib
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg2
+
+from bench_pipeline import HERE, STAGES, pg_environment, run_process, stage_commands
+from synthetic_devpost import DB_DSN
+
+CAPTURED = ["06_3", "06_4", "07_1", "08_2", "08_3"]
+EXPLAINABLE = re.compile(r"^(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES|MERGE)\b"
+                         r"|^CREATE\s+(\w+\s+)*TABLE\s+(IF\s+NOT\s+EXISTS\s+)?\S+\s+AS\b", re.I)
+DOLLAR_QUOTE = re.compile(r"\$([A-Za-z_]\w*)?\$")
+JOINS = {"Nested Loop", "Hash Join", "Merge Join"}
+PARTITION = re.compile(r"_p\d+$")  # hash partitions of 06_2p / 07_1 are reported as their parent table
+SETTINGS = ["server_version", "work_mem", "shared_buffers", "effective_cache_size", "random_page_cost", "jit",
+            "max_parallel_workers_per_gather"]
+
+
+# ────── SQL scripts ──────────────────────────────────────────────────
+def segments(text):
+    """(kind, text) pieces of a SQL script: 'code', 'comment', 'quoted' (strings, identifiers, dollar quotes)"""
+    i = start = 0
+    n = len(text)
+    while i < n:
+        if text.startswith("--", i) or text.startswith("/*", i):
+            end = text.find("\n", i) if text[i] == "-" else text.find("*/", i + 2) + 2
+            end = n if end <= 1 or end < i else end
+        elif text[i] in "'\"":
+            end = i + 1
+            while end < n and not (text[end] == text[i] and text[end + 1:end + 2] != text[i]):
+                end += 2 if text[end] == text[i] else 1
+            end = min(end + 1, n)
+        elif text[i] == "$" and (m := DOLLAR_QUOTE.match(text, i)):
+            close = text.find(m.group(0), m.end())
+            end = n if close < 0 else close + len(m.group(0))
+        else:
+            i += 1
+            continue
+        if start < i:
+            yield "code", text[start:i]
+        yield ("comment" if text[i] in "-/" else "quoted"), text[i:end]
+        i = start = end
+    if start < n:
+        yield "code", text[start:]
+
+
+def split_sql(text):
+    """Top-level statements of a script, split on semicolons outside comments and quotes (as psql does)"""
+    statements, current = [], []
+    for kind, piece in segments(text):
+        if kind != "code":
+            current.append(piece)
+            continue
+        *done, rest = piece.split(";")
+        for part in done:
+            current.append(part)
+            statements.append("".join(current))
+            current = []
+        current.append(rest)
+    statements.append("".join(current))
+    return [s.strip() for s in statements if normalize(s)]
+
+
+def normalize(statement):
+    """Statement without comments and with whitespace collapsed: the identity of a statement across captures"""
+    return " ".join("".join(p for kind, p in segments(statement) if kind != "comment").split())
+
+
+def do_statements(block):
+    """Static SQL statements of a DO block, with the DECLARE defaults substituted for the variables"""
+    match = DOLLAR_QUOTE.search(block)
+    body = block[match.end():block.rindex(match.group(0))]
+    declare, _, code = re.split(r"^\s*(BEGIN)\b", body, maxsplit=1, flags=re.M | re.I) if \
+        re.search(r"^\s*DECLARE\b", body, re.M | re.I) else ("", "", body)
+    declare = re.sub(r"^\s*DECLARE\b", "", declare, flags=re.I)
+    defaults = dict(re.findall(r"^[ \t]*(\w+)\s+[\w\[\]() ,]+?:=\s*([^;]+);", declare, flags=re.M))
+    found = []
+    for piece in split_sql(code):
+        # look for the statement in code only (not in EXECUTE strings) and not nested in IF EXISTS (...)
+        masked = "".join(p if kind == "code" else " " * len(p) for kind, p in segments(piece))
+        m = re.search(r"^\s*(WITH|UPDATE|INSERT|DELETE|SELECT)\b", masked, flags=re.M | re.I)
+        if not m or masked[:m.start()].count("(") > masked[:m.start()].count(")"):
+            continue
+        statement = piece[m.start(1):].strip()
+        if re.match(r"SELECT\b", statement, re.I) and re.search(r"\bINTO\b", statement, re.I):
+            continue
+        for name, value in defaults.items():
+            statement = re.sub(rf"\b{name}\b", value.strip(), statement)
+        found.append(statement)
+    return found
+
+
+def label(statement, width=90):
+    text = normalize(statement)
+    return text if len(text) <= width else text[:width - 3] + "..."
+
+
+# ────── Capture ──────────────────────────────────────────────────────
+def explain(cur, statement):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement)
+    plan = cur.fetchone()[0]
+    return plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+
+
+def entry(stage, seq, source, statement, ms, plan=None, error=None):
+    return {"stage": stage, "seq": seq, "source": source, "key": hashlib.sha1(normalize(statement).encode()).hexdigest()[:12],
+            "label": label(statement), "ms": round(ms, 2), "plan": plan, "error": error}
+
+
+def capture_stage(conn, stage):
+    entries = []
+    with conn.cursor() as cur:
+        for seq, statement in enumerate(split_sql((HERE / STAGES[stage]["script"]).read_text(encoding="utf-8"))):
+            if re.match(r"DO\b", normalize(statement), re.I):
+                for inner in do_statements(statement):
+                    cur.execute("BEGIN")
+                    try:
+                        plan = explain(cur, inner)
+                        entries.append(entry(stage, seq, "in-do-block", inner,
+                                             plan["Planning Time"] + plan["Execution Time"], plan))
+                    except psycopg2.Error as e:
+                        entries.append(entry(stage, seq, "in-do-block", inner, 0, error=str(e).strip()))
+                    finally:
+                        cur.execute("ROLLBACK")
+                t0 = time.time()
+                cur.execute(statement)
+                entries.append(entry(stage, seq, "do-block", statement, (time.time() - t0) * 1000))
+            elif EXPLAINABLE.match(normalize(statement)):
+                plan = explain(cur, statement)
+                entries.append(entry(stage, seq, "statement", statement,
+                                     plan["Planning Time"] + plan["Execution Time"], plan))
+            else:
+                t0 = time.time()
+                cur.execute(statement)
+                entries.append(entry(stage, seq, "statement", statement, (time.time() - t0) * 1000))
+    return entries
+
+
+def capture(args):
+    env = pg_environment()
+    log_dir = Path(args.log_dir)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    if not args.no_generate:
+        print(f"Generating fixture (scale {args.scale:g}, seed {args.seed})...")
+        with open(log_dir / "generate.log", "w", encoding="utf-8") as log:
+            code, _ = run_process([sys.executable, str(HERE / "synthetic_devpost.py"), "--scale", str(args.scale),
+                                   "--seed", str(args.seed), "--replace"], env, log)
+        if code != 0:
+            raise SystemExit(f"fixture generation failed, see {log_dir / 'generate.log'}")
+
+    conn = psycopg2.connect(DB_DSN, application_name="bench_plans")
+    conn.autocommit = True
+    entries = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT scale, seed FROM synthetic_dataset")
+            scale, seed = cur.fetchone()
+            settings = {}
+            for name in SETTINGS:
+                cur.execute(f"SHOW {name}")
+                settings[name] = cur.fetchone()[0]
+        last = max(list(STAGES).index(s) for s in args.stages)
+        with tempfile.TemporaryDirectory() as workdir:
+            for name in list(STAGES)[:last + 1]:
+                t0 = time.time()
+                if name in args.stages:
+                    print(f"{name}: capturing plans...")
+                    stage_entries = capture_stage(conn, name)
+                    entries += stage_entries
+                    explained = sum(e["plan"] is not None for e in stage_entries)
+                    print(f"{name}: {len(stage_entries)} statements, {explained} plans ({time.time() - t0:.1f}s)")
+                    continue
+                print(f"{name}: running...")
+                with open(log_dir / f"{name}.log", "w", encoding="utf-8") as log:
+                    for argv in stage_commands(name, args, Path(workdir)):
+                        code, _ = run_process(argv, env, log)
+                        if code != 0:
+                            raise SystemExit(f"{name} failed, see {log_dir / (name + '.log')}")
+    finally:
+        conn.close()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    result = {
+        "meta": {"scale": float(scale), "seed": seed, "captured_at": datetime.now(timezone.utc).isoformat(),
+                 "git_commit": commit, "settings": settings},
+        "entries": entries,
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=1)
+    print(f"{len(entries)} statements written to {args.output}")
+    return result
+
+
+# ────── Plans ────────────────────────────────────────────────────────
+def nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from nodes(child)
+
+
+def relation(node):
+    return PARTITION.sub("", node["Relation Name"])
+
+
+def relations(node):
+    return frozenset(relation(n) for n in nodes(node) if "Relation Name" in n)
+
+
+def summarize(plan):
+    """Joins by the relations below them, rows read by seq scans per relation, temp blocks written"""
+    root = plan["Plan"]
+    joins = defaultdict(set)
+    seq_scans = Counter()
+    for node in nodes(root):
+        if node["Node Type"] in JOINS:
+            joins[relations(node)].add(node["Node Type"])
+        if node["Node Type"] == "Seq Scan":
+            loops = node.get("Actual Loops", 1)
+            read = (node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)) * loops
+            seq_scans[relation(node)] += read
+    return {"joins": joins, "seq_scans": seq_scans, "temp_written": root.get("Temp Written Blocks", 0)}
+
+
+def plan_regressions(base, cur, large_rows):
+    b, c = summarize(base), summarize(cur)
+    found = []
+    for rels, types in c["joins"].items():
+        before = b["joins"].get(rels, set())
+        if "Nested Loop" in types and "Nested Loop" not in before and before & {"Hash Join", "Merge Join"}:
+            found.append(("join", f"{'/'.join(sorted(before))} -> Nested Loop over {', '.join(sorted(rels))}"))
+    for rel, read in c["seq_scans"].items():
+        if read >= large_rows and rel not in b["seq_scans"]:
+            found.append(("seq scan", f"new Seq Scan on {rel} ({read} rows read)"))
+    if c["temp_written"] and not b["temp_written"]:
+        found.append(("spill", f"writes {c['temp_written'] * 8 // 1024} MB of temp files, baseline none"))
+    return list(dict.fromkeys(found))
+
+
+# ────── Compare ──────────────────────────────────────────────────────
+def match_entries(base, cur):
+    """(baseline, current, text changed) pairs; equal texts first, the rest by position within the stage"""
+    def keyed(entries):
+        seen = Counter()
+        out = {}
+        for e in entries:
+            seen[e["stage"], e["source"], e["key"]] += 1
+            out[e["stage"], e["source"], e["key"], seen[e["stage"], e["source"], e["key"]]] = e
+        return out
+
+    b, c = keyed(base), keyed(cur)
+    pairs = [(b[k], c[k], False) for k in c if k in b]
+    left = defaultdict(list)
+    for k in b.keys() - c.keys():
+        left[k[0], k[1]].append(b[k])
+    right = defaultdict(list)
+    for k in c.keys() - b.keys():
+        right[k[0], k[1]].append(c[k])
+    unmatched = []
+    for group, entries in right.items():
+        olds = sorted(left.pop(group, []), key=lambda e: e["seq"])
+        news = sorted(entries, key=lambda e: e["seq"])
+        pairs += [(o, n, True) for o, n in zip(olds, news)]
+        unmatched += [("new", e) for e in news[len(olds):]] + [("removed", e) for e in olds[len(news):]]
+    unmatched += [("removed", e) for entries in left.values() for e in entries]
+    return pairs, unmatched
+
+
+def compare(base, cur, args):
+    if base["meta"]["scale"] != cur["meta"]["scale"] or base["meta"]["seed"] != cur["meta"]["seed"]:
+        print(f"warning: different fixtures (scale/seed {base['meta']['scale']}/{base['meta']['seed']} vs "
+              f"{cur['meta']['scale']}/{cur['meta']['seed']}), plans and timings are not comparable")
+    for name, value in cur["meta"]["settings"].items():
+        if base["meta"]["settings"].get(name) != value:
+            print(f"warning: {name} differs ({base['meta']['settings'].get(name)} vs {value})")
+
+    pairs, unmatched = match_entries(base["entries"], cur["entries"])
+    flagged = []
+    for old, new, changed in sorted(pairs, key=lambda p: (CAPTURED.index(p[1]["stage"]), p[1]["seq"])):
+        issues = []
+        if new["error"] and not old["error"]:
+            issues.append(("error", new["error"].splitlines()[0]))
+        if old["plan"] and new["plan"]:
+            issues += plan_regressions(old["plan"], new["plan"], args.large_rows)
+        if new["ms"] > old["ms"] * (1 + args.time_tolerance) and new["ms"] - old["ms"] >= args.min_ms:
+            issues.append(("time", f"{old['ms']:.0f} ms -> {new['ms']:.0f} ms"))
+        if issues:
+            flagged.append((new, changed, issues))
+
+    print("\n" + "=" * 110)
+    for new, changed, issues in flagged:
+        print(f"{new['stage']:<5} #{new['seq']:<3} {new['label']}" + ("  [query text changed]" if changed else ""))
+        for kind, detail in issues:
+            print(f"      {kind:<9} {detail}")
+    for what, e in unmatched:
+        print(f"{e['stage']:<5} #{e['seq']:<3} {what}: {e['label']}")
+    total_old = sum(o["ms"] for o, _, _ in pairs)
+    total_new = sum(n["ms"] for _, n, _ in pairs)
+    print("-" * 110)
+    print(f"{len(pairs)} statements compared, {len(flagged)} flagged, {len(unmatched)} unmatched; "
+          f"matched time {total_old / 1000:.1f}s -> {total_new / 1000:.1f}s")
+    print("=" * 110)
+    return 1 if flagged else 0
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture and compare query plans of the heavy SQL stages")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cap = sub.add_parser("capture", help="run the stages on the fixture and store their plans")
+    cap.add_argument("--output", default="plans.json")
+    cap.add_argument("--baseline", default="", help="compare against this capture afterwards")
+    cap.add_argument("--scale", type=float, default=0.25)
+    cap.add_argument("--seed", type=int, default=42)
+    cap.add_argument("--stages", nargs="+", default=CAPTURED, choices=CAPTURED)
+    cap.add_argument("--no-generate", action="store_true", help="use the freshly generated fixture in the database")
+    cap.add_argument("--psql", default="psql")
+    cap.add_argument("--log-dir", default="bench_plans_logs")
+    cmp = sub.add_parser("compare", help="flag plan and timing regressions between two captures")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    for p in (cap, cmp):
+        p.add_argument("--large-rows", type=int, default=10_000, help="seq scans reading fewer rows are not flagged")
+        p.add_argument("--time-tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 = 50%%")
+        p.add_argument("--min-ms", type=float, default=100.0, help="smaller slowdowns are not flagged")
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        args.parallel = 0
+        result = capture(args)
+        if args.baseline:
+            raise SystemExit(compare(load(args.baseline), result, args))
+    else:
+        raise SystemExit(compare(load(args.baseline), load(args.current), args))
+
+
+if __name__ == "__main__":
+    main()
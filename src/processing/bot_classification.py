@@ -0,0 +1,222 @@
+######## Goal:
+######## Keep the RABBIT bot/human classification of every GitHub login in one keyed store, and turn it into the
+######## pseudonymized human tables of 04_2_remove_bots_hash_users.ipynb in a single vectorized pass
+########
+######## - ClassificationStore: SQLite table (login -> type, confidence, checked_at) in ../data/rabbit_classifications.sqlite.
+########   04_1_run_rabbit_parallel.py only sends logins that are not in the store yet, so a rerun after new
+########   contributors were collected costs time proportional to the new logins only.
+######## - contributor_links / classify_humans / filter_project_contributors: the notebook's merge, 'bot' name filter,
+########   SHA-256 hashing and per-project contributor filtering with explode / isin / groupby instead of .apply
+########
+######## Usage:
+########   python bot_classification.py import ../data/rabbit_output_parallel.csv   # seed the store with an old run
+########   python bot_classification.py contributors --data-dir ../data             # -> ../contributors.csv, logins.txt
+########   python 04_1_run_rabbit_parallel.py                                     # classifies the new logins only
+########   python bot_classification.py humans --data-dir ../data                   # -> humans_hash[_complete].csv,
+########                                                                           #    proj_hack_human[_complete].csv
+
+import argparse
+import csv
+import hashlib
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
+
+from devpost_io import read_devpost
+
+STORE_PATH = Path(__file__).resolve().parent.parent / 'data' / 'rabbit_classifications.sqlite'
+
+# which RABBIT types count as human for the two output variants of 04_2
+KEEP_TYPES = {
+    'human': ['Human'],
+    'complete': ['Human', 'Unknown'],
+}
+OUTPUTS = {
+    'human': ('humans_hash.csv', 'proj_hack_human.csv'),
+    'complete': ('humans_hash_complete.csv', 'proj_hack_human_complete.csv'),
+}
+
+
+# ────── Store ────────────────────────────────────────────────────────
+class ClassificationStore:
+    """RABBIT results keyed by login; the latest classification of a login wins"""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS classifications (
+                login      TEXT PRIMARY KEY,
+                type       TEXT NOT NULL,
+                confidence REAL,
+                checked_at TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM classifications").fetchone()[0]
+
+    def missing(self, logins, max_age_days=None):
+        """Logins (in input order) that were never classified, or not within the last max_age_days"""
+        query = "SELECT login FROM classifications"
+        params = ()
+        if max_age_days is not None:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+            query += " WHERE checked_at >= ?"
+            params = (cutoff.isoformat(timespec='seconds'),)
+        known = {login for (login,) in self.conn.execute(query, params)}
+        return [login for login in dict.fromkeys(logins) if login not in known]
+
+    def upsert(self, rows, checked_at=None):
+        """rows: (login, type, confidence) with confidence '-' / '' / None for 'no score'"""
+        checked_at = checked_at or datetime.now(timezone.utc).isoformat(timespec='seconds')
+        records = [(login, kind, parse_confidence(conf), checked_at) for login, kind, conf in rows if login]
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO classifications (login, type, confidence, checked_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (login) DO UPDATE SET
+                    type = excluded.type, confidence = excluded.confidence, checked_at = excluded.checked_at
+            """, records)
+        return len(records)
+
+    def ingest_csv(self, path):
+        """Load a RABBIT output CSV (contributor, type, confidence); returns the number of rows stored"""
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            return self.upsert((row['contributor'], row['type'], row['confidence']) for row in reader)
+
+    def to_frame(self, logins=None):
+        """contributor / type / confidence, like rabbit_output_parallel.csv"""
+        df = pd.read_sql_query(
+            "SELECT login AS contributor, type, confidence FROM classifications ORDER BY rowid", self.conn
+        )
+        if logins is not None:
+            order = pd.Index(pd.unique(pd.Series(list(logins), dtype=object)))
+            df = df[df['contributor'].isin(order)]
+            df = df.iloc[order.get_indexer(df['contributor']).argsort(kind='stable')]
+        return df.reset_index(drop=True)
+
+    def export_csv(self, path, logins=None):
+        """Write the store (or the given logins) in RABBIT's CSV format, '-' for a missing confidence"""
+        df = self.to_frame(logins)
+        df['confidence'] = df['confidence'].astype(object).where(df['confidence'].notna(), '-')
+        df.to_csv(path, index=False)
+        return len(df)
+
+
+def parse_confidence(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ────── Vectorized filtering / hashing ───────────────────────────────
+def split_links(series):
+    """One stripped link per row, indexed like the input (missing values dropped)"""
+    return series.dropna().astype(str).str.split(',').explode().str.strip()
+
+
+def contributor_links(proj_hack_member):
+    """Unique contributor links of hackathon_project_contributor, with the login as 'name'"""
+    links = split_links(proj_hack_member['contributors'])
+    links = pd.unique(links[links != ''])
+    return pd.DataFrame({'link': links, 'name': pd.Series(links, dtype=object).str.split('/').str[-1]})
+
+
+def sha256_hex(series):
+    """SHA-256 hex digest of every value, computed in one batch over the column"""
+    return pd.Series([hashlib.sha256(v.encode('utf-8')).hexdigest() for v in series.astype(str)],
+                     index=series.index, dtype=object)
+
+
+def classify_humans(rabbit, contributors, types):
+    """link / name / hash of the contributors RABBIT classified as one of `types`, without 'bot' names"""
+    kept = rabbit.loc[rabbit['type'].isin(types), ['contributor']]
+    humans = kept.merge(contributors, how='left', left_on='contributor', right_on='name')[['link', 'name']]
+    is_bot = (
+        humans['link'].str.contains('bot', case=False, na=False)
+        | humans['name'].str.contains('bot', case=False, na=False)
+    )
+    humans = humans[~is_bot].dropna(subset=['link']).reset_index(drop=True)
+    return humans.assign(hash=sha256_hex(humans['link']))
+
+
+def filter_project_contributors(proj_hack_member, humans):
+    """Projects with more than one human contributor, contributors restricted to humans and mapped to logins"""
+    link_to_name = humans.drop_duplicates(subset=['link'], keep='last').set_index('link')['name']
+    links = split_links(proj_hack_member['contributors'])
+    links = links[links.isin(link_to_name.index)]
+
+    counts = links.groupby(level=0, sort=False).size()
+    keep = counts.index[counts > 1]
+    links = links[links.index.isin(keep)]
+
+    grouped = links.groupby(level=0, sort=False)
+    out = proj_hack_member.loc[proj_hack_member.index.isin(keep)].copy()
+    out['contributors'] = grouped.agg(','.join)
+    out['contributor_github_username'] = links.map(link_to_name).groupby(level=0, sort=False).agg(','.join)
+    return out
+
+
+# ────── CLI ──────────────────────────────────────────────────────────
+def run_contributors(data_dir, store):
+    proj_hack_member = read_devpost('hackathon_project_contributor', data_dir, columns=['contributors'])
+    contributors = contributor_links(proj_hack_member)
+    contributors.to_csv(Path(data_dir).parent / 'contributors.csv', index=False)
+    Path('logins.txt').write_text(''.join(f'{name}\n' for name in contributors['name']), encoding='utf-8')
+    new = store.missing(contributors['name'])
+    print(f"{len(contributors)} contributor links, {len(new)} logins not classified yet")
+
+
+def run_humans(data_dir, store):
+    data_dir = Path(data_dir)
+    contributors = pd.read_csv(data_dir.parent / 'contributors.csv')
+    rabbit = store.to_frame(contributors['name'])
+    print(f"{len(rabbit)} of {len(contributors)} contributors classified")
+
+    proj_hack_member = read_devpost('hackathon_project_contributor', data_dir)
+    for variant, types in KEEP_TYPES.items():
+        humans_csv, proj_csv = OUTPUTS[variant]
+        humans = classify_humans(rabbit, contributors, types)
+        humans.to_csv(data_dir / humans_csv, index=False)
+        projects = filter_project_contributors(proj_hack_member, humans)
+        projects.to_csv(data_dir / proj_csv, index=False)
+        print(f"{variant}: {len(humans)} users -> {humans_csv}, {len(projects)} projects -> {proj_csv}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RABBIT classification store and human filtering (04_2)")
+    parser.add_argument('step', choices=['import', 'contributors', 'humans'])
+    parser.add_argument('csv', nargs='?', help="RABBIT output CSV for 'import'")
+    parser.add_argument('--data-dir', default='../data')
+    parser.add_argument('--store', default=STORE_PATH)
+    args = parser.parse_args()
+
+    with ClassificationStore(args.store) as store:
+        if args.step == 'import':
+            if not args.csv:
+                parser.error("import needs the RABBIT output CSV")
+            print(f"imported {store.ingest_csv(args.csv)} rows, {len(store)} logins in {store.path}")
+        elif args.step == 'contributors':
+            run_contributors(args.data_dir, store)
+        else:
+            run_humans(args.data_dir, store)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+######## Goal:
+######## Collaboration-graph analytics of 03_preliminary_analysis_contributor.ipynb on a sparse incidence matrix
+########
+######## B is the user x project incidence matrix (scipy.sparse CSR, 1 = user contributed to project), built from
+######## the user_projects table (or from hackathon_project_contributor.csv). Everything else is derived from it:
+########   pair co-occurrence     B @ B.T, upper triangle = number of shared projects per pair, computed in row
+########                         blocks so the ~25M pairs never have to be held at once; the shared projects
+########                         themselves are B[a] * B[b] (elementwise) for the pairs of a block
+########   degree distributions  projects per user (row sums), users per project (column sums),
+########                         distinct collaborators per user (non-zeros per row of B @ B.T)
+########   connected components  scipy.sparse.csgraph on the bipartite graph [[0, B], [B.T, 0]]
+########   repeat histogram      pairs per number of shared projects, bucketed like the notebook (1, 2, 3–5, 6+)
+########
+######## Usage:
+########   python collab_graph.py --source db                        # user_projects in Postgres (.env)
+########   python collab_graph.py --source csv --data-dir ../data    # hackathon_project_contributor.csv
+########   python collab_graph.py --source db --pairs-out ../data/contributor_collaboration_pair_counts.csv
+
+import argparse
+import io
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+REPEAT_BUCKETS = [(1, 1, "1 time"), (2, 2, "2 times"), (3, 5, "3–5 times"), (6, None, "6 or more times")]
+
+
+class CollabGraph:
+    """User x project incidence matrix with the labels of its rows (users) and columns (projects)"""
+
+    def __init__(self, incidence, users, projects):
+        self.B = incidence.tocsr()
+        self.BT = self.B.T.tocsr()
+        self.users = pd.Index(users)
+        self.projects = pd.Index(projects)
+
+    # ────── Construction ─────────────────────────────────────────────
+    @classmethod
+    def from_pairs(cls, user_ids, project_ids):
+        """Incidence matrix of (user, project) pairs; duplicate pairs count once"""
+        u, users = pd.factorize(pd.Series(user_ids), sort=True)
+        p, projects = pd.factorize(pd.Series(project_ids), sort=True)
+        keep = (u >= 0) & (p >= 0)
+        B = sparse.csr_matrix(
+            (np.ones(keep.sum(), dtype=np.int32), (u[keep], p[keep])), shape=(len(users), len(projects))
+        )
+        B.sum_duplicates()
+        B.data[:] = 1
+        return cls(B, users, projects)
+
+    @classmethod
+    def from_db(cls, conn):
+        """user_projects streamed out of Postgres with COPY"""
+        buf = io.StringIO()
+        with conn.cursor() as cur:
+            cur.copy_expert("COPY (SELECT user_id, project_id FROM user_projects) TO STDOUT WITH (FORMAT csv)", buf)
+        buf.seek(0)
+        df = pd.read_csv(buf, names=["user_id", "project_id"], dtype={"user_id": str, "project_id": np.int64})
+        return cls.from_pairs(df["user_id"], df["project_id"])
+
+    @classmethod
+    def from_contributors(cls, proj_hack_member, user_col="contributors", project_col="project_URL"):
+        """hackathon_project_contributor-style frame: one row per project, comma-separated contributor links"""
+        links = proj_hack_member[user_col].dropna().astype(str).str.split(",").explode().str.strip()
+        links = links[links != ""]
+        return cls.from_pairs(links.to_numpy(), proj_hack_member.loc[links.index, project_col].to_numpy())
+
+    @property
+    def shape(self):
+        return self.B.shape
+
+    # ────── Pairs ────────────────────────────────────────────────────
+    def pair_blocks(self, chunk_rows=20000):
+        """
+        (a, b, shared, collaborators) per block of users: the pairs a < b in that block with their number of
+        shared projects, and the number of distinct collaborators of every user in the block
+        """
+        n = self.B.shape[0]
+        for start in range(0, n, chunk_rows):
+            stop = min(start + chunk_rows, n)
+            block = (self.B[start:stop] @ self.BT).tocoo()
+            rows = block.row.astype(np.int64) + start
+            upper = block.col > rows
+            collaborators = np.bincount(block.row[block.col != rows], minlength=stop - start)
+            yield rows[upper], block.col[upper].astype(np.int64), block.data[upper], collaborators
+
+    def shared_projects(self, a, b):
+        """Projects of each pair (a[i], b[i]) as a CSR matrix: row i holds the project columns both users are in"""
+        return self.B[a].multiply(self.B[b]).tocsr()
+
+    def pair_summary(self, chunk_rows=20000, pairs_out=None):
+        """Pairs per number of shared projects and collaborators per user, optionally writing every pair to CSV"""
+        shared_counts = np.zeros(1, dtype=np.int64)
+        collaborators = np.zeros(self.B.shape[0], dtype=np.int64)
+        if pairs_out:
+            Path(pairs_out).write_text("contributor_a,contributor_b,shared_projects\n")
+
+        start = 0
+        for a, b, shared, block_collaborators in self.pair_blocks(chunk_rows):
+            counts = np.bincount(shared)
+            if len(counts) > len(shared_counts):
+                counts[:len(shared_counts)] += shared_counts
+                shared_counts = counts
+            else:
+                shared_counts[:len(counts)] += counts
+            collaborators[start:start + len(block_collaborators)] = block_collaborators
+            start += len(block_collaborators)
+            if pairs_out:
+                pd.DataFrame({
+                    "contributor_a": self.users[a], "contributor_b": self.users[b], "shared_projects": shared,
+                }).to_csv(pairs_out, mode="a", header=False, index=False)
+
+        shared = pd.Series(shared_counts, name="pairs").rename_axis("shared_projects")
+        return shared[shared > 0], pd.Series(collaborators, index=self.users, name="collaborators")
+
+    def collaborator_rows(self, rows):
+        """Binary collaborator adjacency (shared >= 1 project, self excluded) of the users at positions `rows`"""
+        rows = np.asarray(rows, dtype=np.int64)
+        block = (self.B[rows] @ self.BT).tocoo()
+        keep = block.col != rows[block.row]
+        return sparse.csr_matrix(
+            (np.ones(keep.sum(), dtype=np.float64), (block.row[keep], block.col[keep])),
+            shape=(len(rows), self.B.shape[0]),
+        )
+
+    def collaborator_counts(self, chunk_rows=20000):
+        """Number of distinct collaborators of every user"""
+        counts = [collaborators for _, _, _, collaborators in self.pair_blocks(chunk_rows)]
+        return pd.Series(np.concatenate(counts) if counts else [], index=self.users, name="collaborators")
+
+    # ────── Distributions ────────────────────────────────────────────
+    def user_degrees(self):
+        return pd.Series(np.diff(self.B.indptr), index=self.users, name="projects")
+
+    def project_sizes(self):
+        return pd.Series(np.bincount(self.B.indices, minlength=self.B.shape[1]), index=self.projects, name="users")
+
+    def components(self):
+        """Component label per user and per project in the bipartite user-project graph"""
+        n_users, n_projects = self.B.shape
+        adjacency = sparse.bmat([[None, self.B], [self.B.T, None]], format="csr")
+        n, labels = connected_components(adjacency, directed=False)
+        return (pd.Series(labels[:n_users], index=self.users, name="component"),
+                pd.Series(labels[n_users:], index=self.projects, name="component"))
+
+
+def distribution(values, name):
+    """value -> how many users / projects / pairs have it"""
+    return values.value_counts().sort_index().rename_axis(name).rename("count")
+
+
+def repeat_histogram(shared):
+    """The notebook's 'Collaboration Count' table from pairs-per-shared-projects counts"""
+    total = shared.sum()
+    rows = []
+    for low, high, label in REPEAT_BUCKETS:
+        in_bucket = shared.index >= low
+        if high is not None:
+            in_bucket &= shared.index <= high
+        pairs = int(shared[in_bucket].sum())
+        rows.append((label, pairs, f"{pairs / total * 100:.2f}%" if total else "0.00%"))
+    return pd.DataFrame(rows, columns=["Collaboration Count", "Number of Pairs", "Percentage"])
+
+
+# ────── CLI ──────────────────────────────────────────────────────────
+def load_graph(args):
+    if args.source == "csv":
+        from devpost_io import read_devpost
+        df = read_devpost("hackathon_project_contributor", args.data_dir, columns=["project_URL", "contributors"])
+        return CollabGraph.from_contributors(df)
+
+    import psycopg2
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+    dsn = f"dbname={os.getenv('DB_NAME')} user={os.getenv('DB_USER')} " \
+          f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST','localhost')} " \
+          f"port={os.getenv('DB_PORT','5432')}"
+    conn = psycopg2.connect(dsn)
+    try:
+        return CollabGraph.from_db(conn)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sparse collaboration-graph statistics (03_preliminary_analysis)")
+    parser.add_argument("--source", choices=["db", "csv"], default="db")
+    parser.add_argument("--data-dir", default="../data")
+    parser.add_argument("--chunk-rows", type=int, default=20000, help="users per B @ B.T block")
+    parser.add_argument("--pairs-out", default=None, help="also write every pair with its shared project count")
+    parser.add_argument("--out-prefix", default=None,
+                        help="write the distributions to <prefix>_{repeat,degrees,components}.csv")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    graph = load_graph(args)
+    n_users, n_projects = graph.shape
+    print(f"incidence matrix: {n_users} users x {n_projects} projects, {graph.B.nnz} memberships "
+          f"({time.time() - t0:.1f}s)")
+
+    t0 = time.time()
+    shared, collaborators = graph.pair_summary(args.chunk_rows, args.pairs_out)
+    print(f"{int(shared.sum())} collaborating pairs ({time.time() - t0:.1f}s)")
+    repeat = repeat_histogram(shared)
+    print(repeat.to_string(index=False))
+
+    user_components, _ = graph.components()
+    component_sizes = user_components.value_counts()
+    print(f"\n{len(component_sizes)} connected components, largest has {component_sizes.iloc[0]} users "
+          f"({component_sizes.iloc[0] / n_users * 100:.2f}%), {int((component_sizes == 1).sum())} single-user")
+
+    degrees = pd.concat([
+        distribution(graph.user_degrees(), "degree").rename("users_by_projects"),
+        distribution(collaborators, "degree").rename("users_by_collaborators"),
+        distribution(graph.project_sizes(), "degree").rename("projects_by_users"),
+    ], axis=1).fillna(0).astype(np.int64)
+    print(f"median projects per user {graph.user_degrees().median():.0f}, "
+          f"median collaborators per user {collaborators.median():.0f}, "
+          f"median users per project {graph.project_sizes().median():.0f}")
+
+    if args.out_prefix:
+        repeat.to_csv(f"{args.out_prefix}_repeat.csv", index=False)
+        degrees.to_csv(f"{args.out_prefix}_degrees.csv")
+        distribution(component_sizes, "users").rename("components").to_csv(f"{args.out_prefix}_components.csv")
+
+
+if __name__ == "__main__":
+    main()
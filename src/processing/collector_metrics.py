@@ -0,0 +1,277 @@
+######## Goal:
+######## Structured runtime metrics for the collectors: token usage, request latency,
+######## retries/backoff, queue depth, DB write lag and event-loop stalls.
+########
+######## Exposure (both optional, configured in .env / environment):
+########   METRICS_PORT=9108            Prometheus text format on http://127.0.0.1:9108/metrics
+########                                (JSON of the same data on /metrics.json)
+########   METRICS_SNAPSHOT=run.json    periodic JSON snapshot, every METRICS_INTERVAL seconds (default 30)
+########
+######## Usage in a collector:
+########   from collector_metrics import metrics, start_metrics, loop_monitor, token_label
+########   start_metrics("05_2")                      # once, at start-up
+########   async with loop_monitor():                 # around the body of an async collector
+########   with metrics.timer("github_request_duration_seconds", endpoint="graphql") as labels:
+########       resp = ...; labels["status"] = resp.status_code
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import asynccontextmanager, contextmanager, suppress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HELP = {
+    "github_token_in_flight": "Requests currently holding the token",
+    "github_token_busy_seconds_total": "Seconds the token spent serving requests",
+    "github_token_remaining": "Last known remaining quota of the token",
+    "github_token_quota_used_total": "Quota units charged to the token",
+    "github_token_acquire_wait_seconds": "Time spent waiting for a token",
+    "github_request_duration_seconds": "GitHub request latency by endpoint and status",
+    "github_retries_total": "Retried GitHub requests by endpoint and reason",
+    "github_backoff_sleep_seconds_total": "Seconds slept in backoff or rate-limit waits by reason",
+    "github_concurrency_limit": "Current adaptive (AIMD) concurrency limit, per token and global",
+    "collector_queue_depth": "Work items waiting for a concurrency slot",
+    "collector_items_total": "Processed work items by outcome",
+    "db_write_seconds": "Duration of DB writes by table",
+    "archive_requests_total": "Requests answered from (hit / miss / probe) or stored into (recorded) the response archive",
+    "contribution_coverage_days_total": "Days of contribution windows answered from the coverage index (hit) or fetched",
+    "commit_cache_repo_days_total": "Repo-days of project windows answered from the commit author cache (hit) or fetched",
+    "event_loop_lag_seconds": "Delay between scheduled and actual wake-up of the loop monitor",
+    "event_loop_stalls_total": "Event-loop stalls over the threshold by blocking call site",
+}
+
+
+def token_label(token):
+    """Stable non-secret label for a token"""
+    return "t" + hashlib.sha256(token.encode()).hexdigest()[:8]
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    """Label value as the Prometheus text format requires: backslash, double quote and newline escaped"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and histograms with labels"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def inc(self, name, value=1.0, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            k = _key(labels)
+            series[k] = series.get(k, 0.0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_key(labels)] = float(value)
+
+    def add(self, name, value, **labels):
+        with self.lock:
+            series = self.gauges.setdefault(name, {})
+            k = _key(labels)
+            series[k] = series.get(k, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            h = series.get(_key(labels))
+            if h is None:
+                h = series[_key(labels)] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    h["buckets"][i] += 1
+            h["sum"] += value
+            h["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the block; the yielded dict may be updated with late labels (e.g. status)"""
+        labels = dict(labels)
+        t0 = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels.setdefault("status", "exception")
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    # ── Exposition ──
+    def snapshot(self):
+        with self.lock:
+            def series(d):
+                return {name: [{"labels": dict(k), "value": v} for k, v in s.items()] for name, s in d.items()}
+            hist = {
+                name: [{"labels": dict(k), "count": h["count"], "sum": h["sum"],
+                        "buckets": dict(zip(map(str, self.buckets), h["buckets"]))} for k, h in s.items()]
+                for name, s in self.histograms.items()
+            }
+            return {
+                "timestamp": time.time(),
+                "uptime_seconds": time.time() - self.started,
+                "counters": series(self.counters),
+                "gauges": series(self.gauges),
+                "histograms": hist,
+            }
+
+    def prometheus(self):
+        def fmt(labels):
+            if not labels:
+                return ""
+            inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            return "{" + inner + "}"
+
+        lines = []
+        with self.lock:
+            for kind, store in (("counter", self.counters), ("gauge", self.gauges)):
+                for name, s in sorted(store.items()):
+                    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for k, v in s.items():
+                        lines.append(f"{name}{fmt(k)} {v}")
+            for name, s in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for k, h in s.items():
+                    for bound, n in zip(self.buckets, h["buckets"]):
+                        lines.append(f"{name}_bucket{fmt(k + (('le', bound),))} {n}")
+                    lines.append(f"{name}_bucket{fmt(k + (('le', '+Inf'),))} {h['count']}")
+                    lines.append(f"{name}_sum{fmt(k)} {h['sum']}")
+                    lines.append(f"{name}_count{fmt(k)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# ────── Exporters ────────────────────────────────────────────────────
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, ctype = json.dumps(metrics.snapshot()).encode(), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, ctype = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _snapshot_loop(path, interval, collector):
+    while True:
+        time.sleep(interval)
+        write_snapshot(path, collector)
+
+
+def write_snapshot(path, collector=None):
+    snap = metrics.snapshot()
+    snap["collector"] = collector
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snap, f, indent=1)
+    os.replace(tmp, path)
+
+
+_started = False
+
+
+def start_metrics(collector):
+    """Start the exporters configured via METRICS_PORT / METRICS_SNAPSHOT (no-op if neither is set)"""
+    global _started
+    if _started:
+        return
+    _started = True
+
+    port = os.getenv("METRICS_PORT")
+    if port:
+        server = ThreadingHTTPServer(("127.0.0.1", int(port)), _MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Metrics: http://127.0.0.1:{port}/metrics")
+
+    path = os.getenv("METRICS_SNAPSHOT")
+    if path:
+        interval = float(os.getenv("METRICS_INTERVAL", "30"))
+        threading.Thread(target=_snapshot_loop, args=(path, interval, collector), daemon=True).start()
+        print(f"Metrics: JSON snapshot every {interval:.0f}s to {path}")
+
+
+# ────── Event-loop stall detection ───────────────────────────────────
+def _blocking_site(thread_id):
+    """Innermost frame of the loop thread that belongs to our own scripts (not stdlib / site-packages)"""
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return "unknown"
+    stack = traceback.extract_stack(frame)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for fs in reversed(stack):
+        if os.path.abspath(fs.filename).startswith(here) and not fs.filename.endswith("collector_metrics.py"):
+            return f"{os.path.basename(fs.filename)}:{fs.lineno} {fs.name}"
+    fs = stack[-1]
+    return f"{os.path.basename(fs.filename)}:{fs.lineno} {fs.name}"
+
+
+async def watch_event_loop(interval=0.1, threshold=0.25):
+    """
+    Measure loop lag and attribute stalls to the blocking call site.
+    A watchdog thread samples the loop thread's stack when the heartbeat is older than threshold,
+    so blocking calls inside coroutines (requests.get, psycopg2) show up with file:line.
+    """
+    loop_thread = threading.get_ident()
+    heartbeat = [time.perf_counter()]
+    stop = threading.Event()
+
+    def watchdog():
+        reported = None
+        while not stop.wait(threshold / 2):
+            beat = heartbeat[0]
+            if time.perf_counter() - beat > threshold and reported != beat:
+                reported = beat
+                metrics.inc("event_loop_stalls_total", where=_blocking_site(loop_thread))
+
+    threading.Thread(target=watchdog, daemon=True).start()
+    try:
+        while True:
+            t0 = time.perf_counter()
+            heartbeat[0] = t0
+            await asyncio.sleep(interval)
+            metrics.observe("event_loop_lag_seconds", max(time.perf_counter() - t0 - interval, 0.0))
+    finally:
+        stop.set()
+
+
+@asynccontextmanager
+async def loop_monitor(**kwargs):
+    """Run watch_event_loop for the duration of the block; the task is kept and cancelled on exit"""
+    task = asyncio.create_task(watch_event_loop(**kwargs))
+    try:
+        yield task
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
@@ -0,0 +1,119 @@
+######## Goal:
+######## Repo x day cache of commit author logins for 02_get_contributors_commitAPI.py, shared by every project
+######## whose window touches the repo. Many repos are submitted to several hackathons with overlapping or adjacent
+######## dates; with the cache, a project window is answered from the days already stored and only the uncovered
+######## date ranges are fetched from GitHub.
+########
+######## repo_commit_author_days   (repo, day) -> author logins of the commits of that day
+######## repo_commit_coverage      repo -> datemultirange of days fully fetched (days without commits have no row)
+########
+######## Days are calendar days in the DB session time zone, the zone the project windows are cut in
+######## (inclusive_since / inclusive_until). Only days before today are marked covered, since commits of
+######## the current day can still arrive. Needs PostgreSQL 14+ (multiranges).
+
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from collector_metrics import metrics
+
+DDL = """
+CREATE TABLE IF NOT EXISTS repo_commit_author_days (
+    repo TEXT NOT NULL,
+    day DATE NOT NULL,
+    logins TEXT[] NOT NULL,
+    PRIMARY KEY (repo, day)
+);
+CREATE TABLE IF NOT EXISTS repo_commit_coverage (
+    repo TEXT PRIMARY KEY,
+    covered DATEMULTIRANGE NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMPTZ DEFAULT now()
+);
+"""
+
+
+def parse_commit_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class CommitAuthorCache:
+    """Covered day ranges and per-day author logins of repos, on its own connection"""
+
+    def __init__(self, dsn):
+        self.conn = psycopg2.connect(dsn)
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(DDL)
+            cur.execute("SHOW TimeZone")
+            self.tz = ZoneInfo(cur.fetchone()[0])
+
+    def close(self):
+        self.conn.close()
+
+    # ── Days ──
+    def window_days(self, start_date, end_date):
+        """[first, end) days of a project window from its start / end timestamps (end day included)"""
+        return start_date.astimezone(self.tz).date(), end_date.astimezone(self.tz).date() + timedelta(days=1)
+
+    def day_iso(self, day):
+        """UTC instant at which a day starts, in the format of inclusive_since / inclusive_until"""
+        return datetime.combine(day, time(), self.tz).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def day_of(self, committed_at):
+        return parse_commit_time(committed_at).astimezone(self.tz).date()
+
+    def today(self):
+        return datetime.now(self.tz).date()
+
+    # ── Lookups ──
+    def uncovered(self, repo, first, end):
+        """Day ranges [lo, hi) of [first, end) not fetched yet"""
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT lower(r), upper(r)
+                FROM unnest(datemultirange(daterange(%s, %s)) - COALESCE(
+                    (SELECT covered FROM repo_commit_coverage WHERE repo = %s), '{}'::datemultirange)) r
+                ORDER BY 1
+            """, (first, end, repo))
+            ranges = cur.fetchall()
+        missing = sum((hi - lo).days for lo, hi in ranges)
+        metrics.inc("commit_cache_repo_days_total", (end - first).days - missing, outcome="hit")
+        metrics.inc("commit_cache_repo_days_total", missing, outcome="fetched")
+        return ranges
+
+    def authors(self, repo, first, end):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT login
+                FROM repo_commit_author_days, unnest(logins) AS login
+                WHERE repo = %s AND day >= %s AND day < %s
+            """, (repo, first, end))
+            return {login for login, in cur.fetchall()}
+
+    # ── Updates ──
+    def store(self, repo, lo, hi, commits):
+        """
+        Record the (committed_at, login) pairs fetched for [lo, hi) and mark the range covered, in one
+        transaction; logins already stored for a day are kept.
+        """
+        by_day = {}
+        for committed_at, login in commits:
+            day = self.day_of(committed_at)
+            if lo <= day < hi:
+                by_day.setdefault(day, set()).add(login)
+        covered_hi = min(hi, self.today())
+
+        with self.conn, self.conn.cursor() as cur:
+            if by_day:
+                execute_values(cur, """
+                    INSERT INTO repo_commit_author_days (repo, day, logins) VALUES %s
+                    ON CONFLICT (repo, day) DO UPDATE
+                    SET logins = ARRAY(SELECT DISTINCT unnest(repo_commit_author_days.logins || EXCLUDED.logins))
+                """, [(repo, day, sorted(logins)) for day, logins in by_day.items()])
+            if lo < covered_hi:
+                cur.execute("""
+                    INSERT INTO repo_commit_coverage (repo, covered) VALUES (%s, datemultirange(daterange(%s, %s)))
+                    ON CONFLICT (repo) DO UPDATE
+                    SET covered = repo_commit_coverage.covered + EXCLUDED.covered, updated_at = now()
+                """, (repo, lo, covered_hi))
@@ -0,0 +1,155 @@
+######## Goal:
+######## Per-user coverage index of the contributionsCollection spans the 05_* collectors fetched successfully, so a
+######## window is only fetched where it is not covered yet: when a window is extended, when project dates move,
+######## or where an earlier year-chunk failed (failed chunks are never recorded).
+########
+######## user_contribution_spans   (user_id, span) -> repos the user committed to within the span
+########
+######## A window [start, end) is answered by the recorded spans lying inside it plus fresh requests for the gaps
+######## between them; the spans of one window partition it, so the union of their repos is the window's repo set.
+######## Spans reaching past now() are not recorded, since contributions can still be added to them.
+########
+######## The index is seeded from the window rows written before it existed (backfill(), run by the collectors'
+######## --delta mode), but only from past 183-day windows with a non-empty repo list: they were fetched with a single
+######## request, so a failure left them empty. The old 730-day windows took 2-3 year-chunks and the fill scripts
+######## wrote whatever chunks succeeded, so a non-empty one may still be missing repos; those stay uncovered and
+######## are fetched again.
+########
+######## Usage in a collector (the a* methods run the psycopg2 calls on a worker thread):
+########   coverage = ContributionCoverage(DB_DSN)
+########   spans = await coverage.aspans(login)
+########   repos, gaps = plan_window(spans, start, end)
+########   for lo, hi in gaps: for a, b in year_chunks(lo, hi): ... await coverage.astore(login, a, b, chunk_repos)
+
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2 import sql
+
+from collector_metrics import metrics
+
+DDL = """
+CREATE TABLE IF NOT EXISTS user_contribution_spans (
+    user_id TEXT NOT NULL,
+    span TSTZRANGE NOT NULL,
+    repos TEXT[] NOT NULL,
+    fetched_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (user_id, span)
+);
+"""
+
+# window rows of the collectors that map onto spans: (table, window length); single-chunk windows only (see above)
+BACKFILL_SOURCES = [("user_proj_repo_after_6mon", "183 days")]
+
+
+def year_chunks(window_start, window_end):
+    """Split a window into the 1-year spans a contributionsCollection query accepts"""
+    ptr = window_start
+    while ptr < window_end:
+        try:
+            nxt = ptr.replace(year=ptr.year + 1)
+        except ValueError:
+            # Feb 29 in leap year -> Feb 28 in non-leap year
+            nxt = ptr.replace(year=ptr.year + 1, day=28)
+        nxt = min(nxt, window_end)
+        yield ptr, nxt
+        ptr = nxt
+
+
+def merge_intervals(intervals):
+    """Merge overlapping intervals (touching ones are kept apart), sorted by start"""
+    merged = []
+    for s, e in sorted(intervals, key=lambda x: x[0]):
+        if not merged or s > merged[-1][1]:
+            merged.append([s, e])
+        else:
+            merged[-1][1] = max(merged[-1][1], e)
+    return merged
+
+
+def plan_window(spans, start, end):
+    """
+    (repos, gaps) of the window [start, end): repos of the recorded spans inside it and the
+    [lo, hi) ranges of the window that no such span covers
+    """
+    inside = sorted((lo, hi, repos) for lo, hi, repos in spans if start <= lo and hi <= end)
+    repos = set()
+    gaps = []
+    ptr = start
+    for lo, hi, span_repos in inside:
+        if lo > ptr:
+            gaps.append((ptr, lo))
+        ptr = max(ptr, hi)
+        repos.update(span_repos)
+    if ptr < end:
+        gaps.append((ptr, end))
+
+    missing = sum((hi - lo).total_seconds() for lo, hi in gaps)
+    metrics.inc("contribution_coverage_days_total", ((end - start).total_seconds() - missing) / 86400, outcome="hit")
+    metrics.inc("contribution_coverage_days_total", missing / 86400, outcome="fetched")
+    return repos, gaps
+
+
+class ContributionCoverage:
+    """Recorded spans of users, on its own connection shared by the worker threads of one collector"""
+
+    def __init__(self, dsn):
+        self.conn = psycopg2.connect(dsn)
+        self.lock = threading.Lock()
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(DDL)
+
+    def close(self):
+        self.conn.close()
+
+    def backfill(self):
+        """Seed the index from the existing single-chunk window rows; returns the number of spans added"""
+        added = 0
+        with self.lock, self.conn, self.conn.cursor() as cur:
+            for table, length in BACKFILL_SOURCES:
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+                if not cur.fetchone()[0]:
+                    continue
+                cur.execute(sql.SQL("""
+                    INSERT INTO user_contribution_spans (user_id, span, repos)
+                    SELECT user_id, tstzrange(window_start_time, window_end_time),
+                           ARRAY(SELECT DISTINCT r FROM jsonb_array_elements_text(repos) AS r ORDER BY r)
+                    FROM {}
+                    WHERE window_end_time <= now()
+                      AND window_end_time - window_start_time = %s::interval
+                      AND jsonb_typeof(repos) = 'array' AND jsonb_array_length(repos) > 0
+                    ON CONFLICT (user_id, span) DO NOTHING
+                """).format(sql.Identifier(table)), (length,))
+                added += cur.rowcount
+        return added
+
+    def spans(self, login):
+        """[(lo, hi, repos)] recorded for a user"""
+        with self.lock, self.conn, self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT lower(span), upper(span), repos FROM user_contribution_spans WHERE user_id = %s
+            """, (login,))
+            return cur.fetchall()
+
+    def store(self, login, lo, hi, repos):
+        """Record a successfully fetched span; returns it as a spans() entry, or None if it reaches past now"""
+        if hi > datetime.now(timezone.utc):
+            return None
+        repos = sorted(repos)
+        with self.lock, self.conn, self.conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO user_contribution_spans (user_id, span, repos) VALUES (%s, tstzrange(%s, %s), %s)
+                ON CONFLICT (user_id, span) DO UPDATE SET repos = EXCLUDED.repos, fetched_at = now()
+            """, (login, lo, hi, repos))
+        return lo, hi, repos
+
+    async def aspans(self, login):
+        return await asyncio.to_thread(self.spans, login)
+
+    async def astore(self, login, lo, hi, repos):
+        return await asyncio.to_thread(self.store, login, lo, hi, repos)
+
+    async def abackfill(self):
+        return await asyncio.to_thread(self.backfill)
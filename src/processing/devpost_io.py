@@ -0,0 +1,313 @@
+######## Goal:
+######## One ingestion layer for the Devpost exports (projects, participants, hackathons, ...) instead of
+######## a default pd.read_csv in every stage
+########
+######## - declared schemas: every column gets a fixed type, no object-dtype inference per read
+######## - parsing with the multi-threaded pyarrow CSV reader, undecodable bytes replaced (was errors='replace' in 08_1)
+######## - chunked iteration (iter_devpost) for files that should not be held in memory at once
+######## - one-time conversion to a cached parquet file next to the CSV (data/.parquet/<name>.parquet);
+########   the cache is rebuilt automatically when the CSV's size or mtime changes
+########
+######## Usage:
+########   from devpost_io import read_devpost, iter_devpost
+########   projects = read_devpost('projects', data_dir, columns=['project_URL', 'participants'])
+########   for chunk in iter_devpost('hackathon_project_contributor', data_dir, chunk_rows=100_000): ...
+########
+########   python devpost_io.py convert all --data-dir ../data     # build / refresh the parquet caches
+########   python devpost_io.py info --data-dir ../data            # rows, columns and cache state per file
+
+import argparse
+import csv
+import io
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+CACHE_DIR = '.parquet'
+CACHE_KEY = b'devpost_io.source'
+BLOCK_SIZE = 16 << 20   # bytes of CSV parsed per block / record batch
+
+# same strings pd.read_csv treats as missing ('Nan' is deliberately not one of them, see clean_accessible_projects)
+NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+S, F, I, B = pa.string(), pa.float64(), pa.int64(), pa.bool_()
+
+# Columns that are not listed are read as strings
+SCHEMAS = {
+    'projects': {
+        'Unnamed: 0': I, 'submission_gal_url': S, 'project_URL': S, 'github_links': S, 'participants': S,
+        'participants_num': F, 'build_with': S, 'repo_link': S, 'repo': S, 'submitted_to_link': S,
+        'submitted_to_name': S, 'submitted_to_hacks_num': F, 'likes': F, 'comments': F,
+    },
+    'projects_github_accessibility': {
+        'project_URL': S, 'github_links': S, 'submitted_to_link': S, 'accessibility': B,
+    },
+    'projects_processed': {
+        'project_URL': S, 'github_links': S, 'submitted_to_link': S, 'accessibility': B, 'participants': S,
+    },
+    'hackathons': {
+        'Unnamed: 0': I, 'URL': S, 'Criteria': S, 'schedule': S, 'hack_type': S, 'info': S,
+        'start_date_format': S, 'end_date_format': S, 'Prizes': S, 'prize_money': S, 'Id': S,
+        'Title': S, 'Location': S, 'start_date': S, 'end_date': S, 'year': S, 'themes': S,
+        'prize': S, 'registered_N': S, 'featured': S, 'organization_name': S,
+        'winners_announced': S, 'submission_gallery_url': S, 'start_a_submission_url': S,
+    },
+    'participants': {
+        'url': S, 'name': S, 'website': S, 'github': S, 'twitter': S, 'address': S, 'skills': S, 'interests': S,
+    },
+    'hackathon_project': {
+        'hackathon_URL': S, 'project_URL': S, 'github_links': S, 'start_date_format': S, 'end_date_format': S,
+        'participants': S,
+    },
+    'hackathon_project_contributor': {
+        'hackathon_URL': S, 'project_URL': S, 'github_links': S, 'start_date_format': S, 'end_date_format': S,
+        'participants': S, 'contributors': S,
+    },
+    'proj_hack_people': {
+        'hackathon_URL': S, 'project_URL': S, 'github_links': S, 'start_date_format': S, 'end_date_format': S,
+        'participants': S, 'participants_githubs': S,
+    },
+}
+
+
+# ────── Paths ────────────────────────────────────────────────────────
+def csv_path(name, data_dir):
+    return Path(data_dir) / f'{name}.csv'
+
+
+def cache_path(name, data_dir):
+    return Path(data_dir) / CACHE_DIR / f'{name}.parquet'
+
+
+def source_stamp(path):
+    """What the cache was built from: size + mtime of the CSV and the declared schema"""
+    st = path.stat()
+    schema = {c: str(t) for c, t in SCHEMAS.get(path.stem, {}).items()}
+    return json.dumps({'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'schema': schema}, sort_keys=True).encode()
+
+
+def cache_is_fresh(name, data_dir):
+    cache = cache_path(name, data_dir)
+    if not cache.exists():
+        return False
+    metadata = pq.read_schema(cache).metadata or {}
+    return metadata.get(CACHE_KEY) == source_stamp(csv_path(name, data_dir))
+
+
+# ────── CSV parsing ──────────────────────────────────────────────────
+class Utf8Recoder(io.RawIOBase):
+    """Byte stream of a text file re-encoded as UTF-8, undecodable bytes replaced by U+FFFD"""
+
+    def __init__(self, path, encoding='utf-8'):
+        self.text = open(path, encoding=encoding, errors='replace', newline='')
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self.pending:
+            chunk = self.text.read(1 << 20)
+            if not chunk:
+                return 0
+            self.pending = chunk.encode('utf-8')
+        n = min(len(buf), len(self.pending))
+        buf[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        self.text.close()
+        super().close()
+
+
+def read_header(path):
+    with open(path, encoding='utf-8', errors='replace', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def pandas_names(header):
+    """Column names as pd.read_csv would give them (an unnamed index column becomes 'Unnamed: 0')"""
+    return [col if col else f'Unnamed: {i}' for i, col in enumerate(header)]
+
+
+def csv_options(name, path):
+    names = pandas_names(read_header(path))
+    schema = SCHEMAS.get(name, {})
+    read = pv.ReadOptions(column_names=names, skip_rows=1, block_size=BLOCK_SIZE)
+    convert = pv.ConvertOptions(
+        column_types={col: schema.get(col, S) for col in names},
+        null_values=NA_VALUES,
+        strings_can_be_null=True,
+        true_values=['True', 'TRUE', 'true'],
+        false_values=['False', 'FALSE', 'false'],
+    )
+    parse = pv.ParseOptions(newlines_in_values=True)
+    return read, parse, convert
+
+
+def csv_batches(name, data_dir, recode=False):
+    """Record batches of the CSV, parsed block by block with the pyarrow reader"""
+    path = csv_path(name, data_dir)
+    read, parse, convert_options = csv_options(name, path)
+    source = io.BufferedReader(Utf8Recoder(path)) if recode else path
+    reader = pv.open_csv(source, read_options=read, parse_options=parse, convert_options=convert_options)
+    return reader.schema, reader
+
+
+def is_utf8_error(e):
+    return 'utf8' in str(e).lower() or 'utf-8' in str(e).lower()
+
+
+def read_csv_table(name, data_dir, columns=None):
+    """The whole CSV as an Arrow table; re-read with byte replacement if it is not valid UTF-8"""
+    for recode in (False, True):
+        try:
+            schema, reader = csv_batches(name, data_dir, recode)
+            table = pa.Table.from_batches(list(reader), schema=schema)
+            break
+        except pa.ArrowInvalid as e:
+            if recode or not is_utf8_error(e):
+                raise
+            print(f"{name}.csv: not valid UTF-8, replacing undecodable bytes")
+    return table.select(columns) if columns else table
+
+
+def csv_chunks(name, data_dir, columns, chunk_rows, recode=False, skip=0):
+    """DataFrames of at most chunk_rows rows straight from the CSV, after dropping the first `skip` rows"""
+    _, reader = csv_batches(name, data_dir, recode)
+    pending, pending_rows = [], 0
+    for batch in reader:
+        if skip:
+            dropped = min(skip, batch.num_rows)
+            batch, skip = batch.slice(dropped), skip - dropped
+        if columns:
+            batch = batch.select(columns)
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunk_rows:
+            table = pa.Table.from_batches(pending)
+            yield to_frame(table.slice(0, chunk_rows))
+            rest = table.slice(chunk_rows)
+            pending, pending_rows = rest.to_batches(), rest.num_rows
+    if pending_rows:
+        yield to_frame(pa.Table.from_batches(pending))
+
+
+def to_frame(table):
+    """pandas frame with NaN (not None) for missing strings, as pd.read_csv returns"""
+    df = table.to_pandas()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+
+# ────── Parquet cache ────────────────────────────────────────────────
+def convert(name, data_dir, verbose=True):
+    """Stream the CSV into data/.parquet/<name>.parquet (one pass, bounded memory); returns the cache path"""
+    source = csv_path(name, data_dir)
+    target = cache_path(name, data_dir)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_suffix('.tmp')
+
+    t0 = time.time()
+    for recode in (False, True):
+        try:
+            schema, reader = csv_batches(name, data_dir, recode)
+            schema = schema.with_metadata({CACHE_KEY: source_stamp(source)})
+            rows = 0
+            with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+                for batch in reader:
+                    writer.write_table(pa.Table.from_batches([batch], schema=schema))
+                    rows += batch.num_rows
+            break
+        except pa.ArrowInvalid as e:
+            tmp.unlink(missing_ok=True)
+            if recode or not is_utf8_error(e):
+                raise
+            print(f"{source.name}: not valid UTF-8, replacing undecodable bytes")
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+    tmp.replace(target)
+
+    if verbose:
+        print(f"{name}: {rows} rows, {source.stat().st_size / 1e6:.1f} MB csv -> "
+              f"{target.stat().st_size / 1e6:.1f} MB parquet in {time.time() - t0:.1f}s")
+    return target
+
+
+def ensure_cache(name, data_dir):
+    if not cache_is_fresh(name, data_dir):
+        convert(name, data_dir)
+    return cache_path(name, data_dir)
+
+
+# ────── Public API ───────────────────────────────────────────────────
+def read_devpost(name, data_dir='../data', columns=None, cache=True):
+    """
+    One Devpost export as a DataFrame with the declared column types.
+    With cache=True the parquet cache is built on first use and read (only `columns`) afterwards.
+    """
+    if cache:
+        return to_frame(pq.read_table(ensure_cache(name, data_dir), columns=columns))
+    return to_frame(read_csv_table(name, data_dir, columns))
+
+
+def iter_devpost(name, data_dir='../data', columns=None, chunk_rows=100_000, cache=True):
+    """The export as DataFrames of at most chunk_rows rows, never holding more than one in memory"""
+    if cache:
+        parquet = pq.ParquetFile(ensure_cache(name, data_dir))
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield to_frame(pa.Table.from_batches([batch]))
+        return
+
+    # as read_csv_table: on invalid UTF-8 start over with byte replacement, skipping the rows already yielded
+    yielded = 0
+    for recode in (False, True):
+        try:
+            for df in csv_chunks(name, data_dir, columns, chunk_rows, recode, skip=yielded):
+                yielded += len(df)
+                yield df
+            return
+        except pa.ArrowInvalid as e:
+            if recode or not is_utf8_error(e):
+                raise
+            print(f"{name}.csv: not valid UTF-8, replacing undecodable bytes")
+
+
+# ────── CLI ──────────────────────────────────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description="Typed, cached ingestion of the Devpost CSV exports")
+    parser.add_argument('command', choices=['convert', 'info'])
+    parser.add_argument('names', nargs='*', default=['all'], help="export names (file stems) or 'all'")
+    parser.add_argument('--data-dir', default='../data')
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    names = [n for n in args.names if n != 'all']
+    if not names:
+        names = [n for n in SCHEMAS if csv_path(n, data_dir).exists()]
+
+    for name in names:
+        if args.command == 'convert':
+            convert(name, data_dir)
+            continue
+        fresh = cache_is_fresh(name, data_dir)
+        line = f"{name}: {csv_path(name, data_dir).stat().st_size / 1e6:.1f} MB csv, cache {'fresh' if fresh else 'stale/missing'}"
+        if fresh:
+            meta = pq.ParquetFile(cache_path(name, data_dir)).metadata
+            line += f", {meta.num_rows} rows x {meta.num_columns} columns"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+######## Goal:
+######## Vectorized version of the joins in 01_preprocessing.ipynb, importable from other notebooks and runnable as a CLI
+########
+######## 1. projects: accessible projects, duplicates per project_URL merged (union of links), participants joined
+########    -> projects_processed.csv
+######## 2. hackathons: projects exploded over submitted_to_link and joined with hackathons.csv
+########    -> hackathon_project.csv
+######## 3. participants: participants' GitHub links added to hackathon_project
+########    -> proj_hack_people.csv
+########
+######## Outputs are identical to the notebook cells (same rows, order and separators) but use
+######## str.split().explode() / groupby / merge instead of iterrows, so the whole Devpost export runs in seconds.
+######## Inputs are read through devpost_io (typed schemas, parquet cache in data/.parquet).
+########
+######## Usage:
+########   python devpost_preprocessing.py all --data-dir ../data
+########   python devpost_preprocessing.py hackathons --data-dir ../data
+########   from devpost_preprocessing import analyze_and_merge_project_urls, merge_projects_hackathons
+
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from devpost_io import read_devpost
+
+NO_GITHUB = 'no github link'
+
+HACKATHON_PROJECT_COLUMNS = [
+    'hackathon_URL', 'project_URL', 'github_links', 'start_date_format', 'end_date_format', 'participants',
+]
+
+
+# ────── Helpers ──────────────────────────────────────────────────────
+def explode_links(series, sep=','):
+    """One row per stripped link, indexed like the input (NaN / non-string values dropped)"""
+    s = series[series.map(lambda v: isinstance(v, str))]
+    return s.str.split(sep).explode().str.strip()
+
+
+def merge_links(df, key, field):
+    """Union of the comma-separated links of `field` per `key`, sorted and joined with ', ' (None if empty)"""
+    links = explode_links(df[field])
+    links = pd.DataFrame({key: df.loc[links.index, key].to_numpy(), field: links.to_numpy()})
+    merged = (
+        links.drop_duplicates()
+        .sort_values([key, field])
+        .groupby(key, sort=False)[field]
+        .agg(', '.join)
+    )
+    return merged.reindex(pd.unique(df[key])).astype(object).where(lambda s: s.notna(), None)
+
+
+# ────── 1. Projects ──────────────────────────────────────────────────
+def clean_accessible_projects(proj_accs):
+    """Accessible projects only, without 'Nan' hackathon links and exact duplicates"""
+    proj_accs = proj_accs[proj_accs['accessibility'] == True]
+    # 'Nan' could not be removed by dropna
+    proj_accs = proj_accs[~proj_accs['submitted_to_link'].isin(['Nan', 'nan'])]
+    return proj_accs.drop_duplicates(subset=['project_URL', 'submitted_to_link', 'github_links'], keep='first')
+
+
+def analyze_and_merge_project_urls(df, fields_to_merge, verbose=True):
+    """
+    Merge rows sharing a project_URL into their first row, with the union of the links in fields_to_merge.
+    Unique rows keep their order; merged rows follow, sorted by project_URL.
+    """
+    total_rows = len(df)
+    duplicate_mask = df.duplicated(subset=['project_URL'], keep=False)
+    duplicate_rows = df[duplicate_mask]
+
+    merged = duplicate_rows.drop_duplicates(subset=['project_URL'], keep='first').sort_values('project_URL', kind='stable')
+    merged = merged.set_index('project_URL', drop=False)
+    for field in fields_to_merge:
+        merged[field] = merge_links(duplicate_rows, 'project_URL', field).reindex(merged.index)
+
+    df_merged = pd.concat([df[~duplicate_mask], merged.reset_index(drop=True)], ignore_index=True)
+
+    if verbose:
+        print(f"Total rows in the original dataframe: {total_rows}")
+        print(f"Number of unique project URLs after merging: {df_merged['project_URL'].nunique()}")
+        print(f"Number of rows in merged dataframe: {len(df_merged)}")
+    return df_merged
+
+
+def build_projects_processed(project, proj_accs, verbose=True):
+    """projects_processed.csv: merged accessible projects with the participants of projects.csv"""
+    proj_accs = clean_accessible_projects(proj_accs)
+    if verbose:
+        print('Projects with accessible GitHub links: ', proj_accs.shape[0])
+    proj_accs = analyze_and_merge_project_urls(proj_accs, ['github_links', 'submitted_to_link'], verbose)
+
+    proj_for_join = project[['project_URL', 'participants']].dropna(subset=['project_URL', 'participants'])
+    proj_for_join = proj_for_join.drop_duplicates(subset=['project_URL', 'participants'], keep='first')
+
+    proj_accs = proj_accs.assign(project_URL=proj_accs['project_URL'].astype(str))
+    proj_for_join = proj_for_join.assign(project_URL=proj_for_join['project_URL'].astype(str))
+    merged_df = proj_accs.merge(proj_for_join, on='project_URL', how='left')
+    return analyze_and_merge_project_urls(merged_df, ['participants'], verbose)
+
+
+# ────── 2. Hackathons ────────────────────────────────────────────────
+def prepare_hackathons(hackathons):
+    hackathons = hackathons.assign(
+        start_date_format=pd.to_datetime(hackathons['start_date_format'], errors='coerce'),
+        end_date_format=pd.to_datetime(hackathons['end_date_format'], errors='coerce'),
+    )
+    hackathons = hackathons.dropna(subset=['URL'])
+    return hackathons.drop_duplicates(subset=['URL'], keep='first')
+
+
+def merge_projects_hackathons(projects, hackathons, verbose=True):
+    """One row per (project, hackathon it was submitted to), in project order then link order"""
+    links = projects['submitted_to_link'].astype(str).str.split(',').explode().str.strip()
+    links = links[links != '']
+    exploded = projects.loc[links.index, ['project_URL', 'github_links', 'participants']].assign(
+        hackathon_URL=links.to_numpy()
+    )
+    hack = hackathons.drop_duplicates(subset=['URL'], keep='first')[['URL', 'start_date_format', 'end_date_format']]
+    new_df = exploded.merge(hack, left_on='hackathon_URL', right_on='URL', how='inner')
+    new_df = new_df[HACKATHON_PROJECT_COLUMNS].reset_index(drop=True)
+
+    if verbose:
+        print(f"Original projects rows: {len(projects)}")
+        print(f"Merged dataframe rows: {len(new_df)}")
+    return new_df
+
+
+# ────── 3. Participants ──────────────────────────────────────────────
+def prepare_participants(participants):
+    participants = participants.dropna(subset=['url'])
+    participants = participants.drop_duplicates(subset=['url', 'github'], keep='first')
+    return participants.drop_duplicates(subset=['url'], keep='first')
+
+
+def add_participant_githubs(proj_hack, participants):
+    """participants_githubs: the GitHub link of every Devpost participant link, 'no github link' if unknown"""
+    github = participants.drop_duplicates(subset=['url'], keep='first').set_index('url')['github']
+    links = proj_hack['participants'].dropna().astype(str).str.split(',').explode().str.strip()
+    found = links.map(github)
+    githubs = found.where(found.notna(), NO_GITHUB).astype(str)
+    joined = githubs.groupby(level=0, sort=False).agg(', '.join)
+    return proj_hack.assign(participants_githubs=joined.reindex(proj_hack.index).fillna(''))
+
+
+# ────── CLI ──────────────────────────────────────────────────────────
+def run_projects(data_dir):
+    project = read_devpost('projects', data_dir, columns=['project_URL', 'participants'])
+    proj_accs = read_devpost('projects_github_accessibility', data_dir)
+    out = build_projects_processed(project, proj_accs)
+    out.to_csv(data_dir / 'projects_processed.csv', index=False, encoding='utf-8')
+    return out
+
+
+def run_hackathons(data_dir):
+    projects = read_devpost('projects_processed', data_dir)
+    hackathons = prepare_hackathons(read_devpost('hackathons', data_dir))
+    out = merge_projects_hackathons(projects, hackathons)
+    out.to_csv(data_dir / 'hackathon_project.csv', index=False, encoding='utf-8')
+    return out
+
+
+def run_participants(data_dir):
+    proj_hack = read_devpost('hackathon_project', data_dir)
+    participants = prepare_participants(read_devpost('participants', data_dir))
+    out = add_participant_githubs(proj_hack, participants)
+    out.to_csv(data_dir / 'proj_hack_people.csv', index=False, encoding='utf-8')
+    return out
+
+
+STEPS = {'projects': run_projects, 'hackathons': run_hackathons, 'participants': run_participants}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Devpost preprocessing (01_preprocessing.ipynb, vectorized)")
+    parser.add_argument('step', choices=[*STEPS, 'all'])
+    parser.add_argument('--data-dir', default='../data')
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    for name in (STEPS if args.step == 'all' else [args.step]):
+        t0 = time.time()
+        out = STEPS[name](data_dir)
+        print(f"{name}: {len(out)} rows in {time.time() - t0:.1f}s\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,573 @@
+######## Goal:
+######## Shared async token manager for the GitHub collectors, with quota accounted in points per API family.
+########
+######## REST ("core") charges 1 point per request. GraphQL charges points by query complexity and has its own
+######## budget, so every GraphQL document asks for rateLimit { cost remaining resetAt } and the manager keeps
+######## per-token, per-family budgets up to date from the response. Before a query is sent its cost is forecast
+######## (static estimate from the query's connections, corrected by costs GitHub actually charged), and the
+######## points are reserved, so a token is only handed out when its budget really covers the request.
+########
+######## Concurrency is not fixed: an AIMD controller per token and one overall raise the number of concurrent
+######## requests while latency and error rates are healthy and halve it on secondary-limit / abuse responses.
+######## Throttled tokens are held back for exactly Retry-After (or until X-RateLimit-Reset).
+########
+######## Usage:
+########   tm = TokenManager(TOKENS, family="graphql")
+########   resp = await tm.request(client, "POST", f"{GITHUB_API}/graphql", query=GQL, variables=variables)
+######## or, when the request is sent by other means:
+########   lease = await tm.acquire(query=GQL, variables=variables)
+########   resp = ...  headers={"Authorization": f"Bearer {lease.token}"}
+########   await tm.release_response(lease, resp, latency)
+
+import asyncio
+import hashlib
+import heapq
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager, suppress
+from datetime import datetime
+
+from collector_metrics import metrics, token_label
+from response_archive import ARCHIVE
+
+DEFAULT_LIMIT = 5000
+# Requests allowed in flight on one token. Above 1, each token gets its own HTTP/2 client and the
+# requests are multiplexed as streams over that single connection.
+MAX_IN_FLIGHT_PER_TOKEN = int(os.getenv("GITHUB_INFLIGHT_PER_TOKEN", "1"))
+RATE_LIMIT_FIELDS = "rateLimit { cost remaining resetAt limit }"
+
+
+# ────── GraphQL cost forecasting ─────────────────────────────────────
+_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\(([^()]*)\)|\{|\}|[A-Za-z_]\w*|\S')
+_PAGE_ARG_RE = re.compile(r'\b(?:first|last)\s*:\s*(\d+|\$\w+)')
+
+
+def with_rate_limit(query):
+    """Add the rateLimit selection to the top-level selection set of a GraphQL document"""
+    if "rateLimit" in query:
+        return query
+    end = query.rstrip().rfind("}")
+    return query[:end] + "  " + RATE_LIMIT_FIELDS + "\n" + query[end:]
+
+
+def estimate_graphql_cost(query, variables=None):
+    """
+    GitHub's documented formula: for every connection, the number of requests needed to fill it is the
+    product of the page sizes (first/last) of its enclosing connections; sum them, divide by 100, round,
+    minimum 1. Unbound $variables count as the maximum page size of 100.
+    """
+    variables = variables or {}
+    stack = [1]
+    pending_args = None
+    requests = 0
+    for m in _TOKEN_RE.finditer(query):
+        tok = m.group(0)
+        if m.group(1) is not None:
+            pending_args = m.group(1)
+        elif tok == "{":
+            size = 1
+            arg = _PAGE_ARG_RE.search(pending_args or "")
+            if arg:
+                raw = arg.group(1)
+                size = int(variables.get(raw[1:], 100)) if raw.startswith("$") else int(raw)
+                requests += stack[-1]
+            stack.append(stack[-1] * size)
+            pending_args = None
+        elif tok == "}":
+            if len(stack) > 1:
+                stack.pop()
+            pending_args = None
+        elif tok[0].isalpha() or tok[0] == "_":
+            pending_args = None
+    return max(1, round(requests / 100))
+
+
+def query_key(query):
+    return hashlib.sha1(query.encode()).hexdigest()[:12]
+
+
+class CostModel:
+    """Forecast = max(static estimate, highest cost GitHub charged for the same document)"""
+    def __init__(self):
+        self.observed = {}
+
+    def forecast(self, query, variables=None):
+        return max(estimate_graphql_cost(query, variables), self.observed.get(query_key(query), 0))
+
+    def observe(self, key, cost):
+        if key and cost is not None:
+            self.observed[key] = max(self.observed.get(key, 0), int(cost))
+
+
+def graphql_rate_limit(resp):
+    """rateLimit object of a GraphQL response (httpx or requests), or None"""
+    try:
+        if resp.status_code != 200:
+            return None
+        return ((resp.json() or {}).get("data") or {}).get("rateLimit")
+    except Exception:
+        return None
+
+
+def parse_reset_at(value):
+    """rateLimit.resetAt ('2024-01-01T00:00:00Z') -> epoch seconds"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+# ────── Throttling and adaptive concurrency ──────────────────────────
+THROTTLED = ("primary", "secondary")
+
+
+def throttle_wait(status, hdr, text="", now=None):
+    """
+    Classify a throttled response: ("secondary" | "primary", seconds to wait) or (None, 0).
+    Retry-After is honored exactly; a primary limit waits for X-RateLimit-Reset; a secondary limit
+    without Retry-After waits one minute, as GitHub's docs ask. A 403 without any of these is a
+    permission error, not throttling.
+    """
+    now = now or time.time()
+    if status == 200:
+        if '"RATE_LIMITED"' in text:  # GraphQL reports an exhausted budget in errors[].type
+            reset = float(hdr.get("X-RateLimit-Reset", now + 60))
+            return "primary", max(reset - now, 0) + 1
+        return None, 0
+    if status not in (403, 429):
+        return None, 0
+    if "Retry-After" in hdr:
+        try:
+            return "secondary", float(hdr["Retry-After"])
+        except ValueError:
+            return "secondary", 60.0
+    if hdr.get("X-RateLimit-Remaining") == "0":
+        reset = float(hdr.get("X-RateLimit-Reset", now + 60))
+        return "primary", max(reset - now, 0) + 1
+    low = text.lower()
+    if "secondary rate limit" in low or "abuse" in low or status == 429:
+        return "secondary", 60.0
+    return None, 0
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease limit on concurrent requests.
+    The limit grows by about one per round of successful requests while latency stays within
+    latency_tolerance x the best latency seen and the error rate stays low; it is cut by `backoff`
+    on throttling and by `error_backoff` when errors pile up. Responses to requests sent before the
+    last cut do not cut again, so one burst of 403s counts once. Callers hold the lock.
+    """
+    def __init__(self, initial, maximum, minimum=1, backoff=0.5, error_backoff=0.9,
+                 latency_tolerance=2.0, max_error_rate=0.05):
+        self.maximum, self.minimum = maximum, minimum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.backoff, self.error_backoff = backoff, error_backoff
+        self.latency_tolerance, self.max_error_rate = latency_tolerance, max_error_rate
+        self.latency = None
+        self.best_latency = None
+        self.error_rate = 0.0
+        self.last_decrease = 0.0
+
+    def capacity(self):
+        return max(int(self.limit), self.minimum)
+
+    def healthy(self):
+        if self.error_rate > self.max_error_rate:
+            return False
+        return self.latency is None or self.latency <= self.best_latency * self.latency_tolerance
+
+    def on_success(self, latency=None):
+        self.error_rate *= 0.95
+        if latency is not None:
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+            # let the baseline drift up slowly so a permanently slower API does not freeze the limit
+            self.best_latency = self.latency if self.best_latency is None else min(self.best_latency * 1.001, self.latency)
+        if self.healthy():
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_error(self, started_at):
+        self.error_rate = 0.95 * self.error_rate + 0.05
+        if self.error_rate > self.max_error_rate:
+            self._decrease(self.error_backoff, started_at)
+
+    def on_throttle(self, started_at):
+        self._decrease(self.backoff, started_at)
+
+    def _decrease(self, factor, started_at):
+        if started_at < self.last_decrease:
+            return
+        self.limit = max(self.minimum, self.limit * factor)
+        self.last_decrease = time.time()
+
+
+class ConcurrencyGate:
+    """
+    Thread-side AIMD limit for the threaded collectors (01, 02_contributorAPI):
+        with GATE.slot() as started:
+            resp = requests.get(...)
+        kind, wait = GATE.record(started, resp.status_code, resp.headers, resp.text, latency)
+    """
+    def __init__(self, initial, maximum, scope="global"):
+        self.aimd = AIMDController(initial, maximum)
+        self.scope = scope
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.in_flight < self.aimd.capacity())
+            self.in_flight += 1
+        try:
+            yield time.time()
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                self.cond.notify_all()
+
+    def record(self, started_at, status=None, hdr=None, text="", latency=None):
+        """Feed one outcome to the controller (status None = network error); returns throttle_wait()"""
+        kind, wait = throttle_wait(status, hdr or {}, text) if status is not None else (None, 0)
+        with self.cond:
+            if kind:
+                self.aimd.on_throttle(started_at)
+            elif status is None or status >= 500:
+                self.aimd.on_error(started_at)
+            else:
+                self.aimd.on_success(latency)
+            self.cond.notify_all()
+        metrics.set("github_concurrency_limit", self.aimd.limit, scope=self.scope)
+        return kind, wait
+
+
+# ────── Token Manager ────────────────────────────────────────────────
+class Budget:
+    __slots__ = ("limit", "remaining", "reset", "reserved", "synthetic")
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit, self.remaining, self.reset, self.reserved = limit, limit, 0.0, 0
+        self.synthetic = False  # reset is a guess (now + 300), not one GitHub reported
+
+    def refill(self, now):
+        if self.reset and now >= self.reset and self.remaining < self.limit:
+            self.remaining = self.limit
+
+    def headroom(self):
+        return self.remaining - self.reserved
+
+    def observe(self, remaining, reset, limit=None, synthetic=False):
+        """
+        Apply a reported budget. With several requests in flight, responses arrive out of order:
+        within one reset window remaining only goes down, so an older (higher) report is ignored,
+        and a report from an earlier window never overwrites a newer one. A guessed reset
+        (synthetic=True) is always replaced by the next reported one.
+        """
+        if limit:
+            self.limit = limit
+        if self.synthetic and not synthetic:
+            self.remaining, self.reset, self.synthetic = remaining, reset, False
+        elif self.reset and abs(reset - self.reset) < 1:
+            self.remaining = min(self.remaining, remaining)
+        elif reset > self.reset:
+            self.remaining, self.reset, self.synthetic = remaining, reset, synthetic
+
+
+class TokenState:
+    __slots__ = ("token", "label", "budgets", "in_flight", "acquired_at", "blocked_until", "aimd", "client")
+    def __init__(self, token, max_in_flight=1):
+        self.token, self.label = token, token_label(token)
+        self.budgets = {"core": Budget(), "graphql": Budget()}
+        self.in_flight, self.acquired_at, self.blocked_until = 0, 0.0, 0.0
+        self.aimd = AIMDController(1, max_in_flight)
+        self.client = None
+
+
+class TokenLease:
+    """One acquired token for one request; carries the reserved points until release"""
+    __slots__ = ("state", "family", "cost", "key", "started_at", "released")
+    def __init__(self, state, family, cost, key):
+        self.state, self.family, self.cost, self.key = state, family, cost, key
+        self.started_at, self.released = time.time(), False
+
+    @property
+    def token(self):
+        return self.state.token
+
+
+class TokenManager:
+    """
+    Hands out tokens under two adaptive limits: a global one (at most per_token_concurrency x tokens
+    concurrent requests) and one per token (at most max_per_token in flight on the same token,
+    default GITHUB_INFLIGHT_PER_TOKEN). With max_per_token > 1, request() sends through one client
+    per token (one HTTP/2 connection, or max_per_token HTTP/1.1 connections; `limits` overrides);
+    use the manager as `async with tm:` so those clients are closed.
+    """
+    def __init__(self, tokens, family="graphql", per_token_concurrency=5, max_per_token=None, limits=None):
+        max_per_token = max_per_token or MAX_IN_FLIGHT_PER_TOKEN
+        self.family = family
+        self.max_per_token = max_per_token
+        self.limits = limits
+        self.tokens = [TokenState(t, max_per_token) for t in tokens]
+        self.multiplex = max_per_token > 1
+        self.aimd = AIMDController(len(tokens), len(tokens) * max(per_token_concurrency, max_per_token))
+        self.in_flight = 0
+        self.cond = asyncio.Condition()  # guards all token state; notified on every release
+        self.wakeups = []                # heap of times when a reset or Retry-After makes a token usable
+        self.timer = None                # task sleeping until wakeups[0]
+        self.costs = CostModel()
+
+    # ── Wake-ups ──
+    def _pick(self, family, cost, now):
+        """Usable token with the most headroom, or None (cond held)"""
+        best = None
+        for t in self.tokens:
+            b = t.budgets[family]
+            b.refill(now)
+            if (t.in_flight < t.aimd.capacity() and t.blocked_until <= now
+                    and b.headroom() >= min(cost, b.limit)):
+                if best is None or b.headroom() > best.budgets[family].headroom():
+                    best = t
+        return best
+
+    def _usable_at(self, family, cost, now):
+        """
+        Earliest future time at which the clock alone (not a release) makes a token usable:
+        the end of a Retry-After, or the reset of a budget that cannot cover `cost`.
+        """
+        times = []
+        for t in self.tokens:
+            b = t.budgets[family]
+            at = t.blocked_until if t.blocked_until > now else now
+            if b.headroom() < min(cost, b.limit) and b.reset > now:
+                at = max(at, b.reset + 1)  # 1s slack for clock skew against GitHub
+            if at > now:
+                times.append(at)
+        return min(times) if times else None
+
+    def _schedule(self, when):
+        """Make sure waiters are notified at `when` (cond held)"""
+        if when in self.wakeups:
+            return
+        if self.wakeups and self.wakeups[0] <= when and self.timer is not None:
+            heapq.heappush(self.wakeups, when)
+            return
+        heapq.heappush(self.wakeups, when)
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().create_task(self._wake(self.wakeups[0]))
+
+    async def _wake(self, when):
+        await asyncio.sleep(max(when - time.time(), 0))
+        async with self.cond:
+            self.timer = None
+            now = time.time()
+            while self.wakeups and self.wakeups[0] <= now:
+                heapq.heappop(self.wakeups)
+            if self.wakeups:
+                self._schedule(heapq.heappop(self.wakeups))
+            self.cond.notify_all()
+
+    # ── Acquire / release ──
+    async def acquire(self, query=None, variables=None, cost=None, family=None):
+        """
+        Wait for a global slot and a token whose budget covers the forecast cost, and reserve that cost.
+        Waiters sleep on a condition that is notified on every release and, via the wake-up heap, the
+        moment a reset or Retry-After expires; there is no polling.
+        """
+        family = family or self.family
+        key = query_key(query) if query else None
+        if cost is None:
+            cost = self.costs.forecast(query, variables) if query else 1
+
+        t_wait = time.time()
+        metrics.add("collector_queue_depth", 1, queue="token_permit")
+        async with self.cond:
+            while True:
+                now = time.time()
+                t = self._pick(family, cost, now) if self.in_flight < self.aimd.capacity() else None
+                if t is not None:
+                    break
+
+                reason = "token_busy"
+                if self.in_flight < self.aimd.capacity():
+                    at = self._usable_at(family, cost, now)
+                    if at is not None and not any(
+                            s.budgets[family].headroom() >= cost and s.blocked_until <= now for s in self.tokens):
+                        reason = "quota_exhausted" if all(
+                            s.budgets[family].headroom() < cost for s in self.tokens) else "secondary_limit"
+                        if not self.wakeups or at < self.wakeups[0]:
+                            print(f"No usable token ({reason}); next one available in {at - now:.1f}s.")
+                        self._schedule(at)
+                t0 = time.time()
+                await self.cond.wait()
+                if reason != "token_busy":
+                    metrics.inc("github_backoff_sleep_seconds_total", time.time() - t0, reason=reason)
+
+            self.in_flight += 1
+            t.in_flight += 1
+            t.acquired_at = now
+            t.budgets[family].reserved += cost
+        metrics.add("collector_queue_depth", -1, queue="token_permit")
+        metrics.observe("github_token_acquire_wait_seconds", now - t_wait)
+        metrics.set("github_token_in_flight", t.in_flight, token=t.label)
+        return TokenLease(t, family, cost, key)
+
+    async def release(self, lease, hdr, rate_limit=None, status=None, latency=None, text=""):
+        """
+        Return the token and settle its budget from, in order of preference:
+        the GraphQL rateLimit object, the X-RateLimit-* headers, or the forecast cost.
+        status/latency/text feed the concurrency controllers; without a status the request is
+        counted as a network error. Returns "primary"/"secondary" when the response was throttled
+        (the token is then held back for exactly the wait GitHub asked for), else None.
+        Releasing the same lease twice is a no-op.
+        """
+        if lease.released:
+            return None
+        lease.released = True
+        t = lease.state
+        hdr = hdr or {}
+        family = hdr.get("X-RateLimit-Resource", lease.family)
+        if family not in t.budgets:
+            family = lease.family
+
+        async with self.cond:
+            now = time.time()
+            b = t.budgets[lease.family]
+            b.reserved -= lease.cost
+            t.in_flight -= 1
+            self.in_flight -= 1
+            metrics.set("github_token_in_flight", t.in_flight, token=t.label)
+            metrics.inc("github_token_busy_seconds_total", now - lease.started_at, token=t.label)
+
+            b = t.budgets[family]
+            charged = lease.cost
+            if rate_limit and rate_limit.get("remaining") is not None:
+                if rate_limit.get("resetAt"):
+                    reset_ts, guessed = parse_reset_at(rate_limit["resetAt"]), False
+                else:
+                    reset_ts, guessed = b.reset, b.synthetic
+                b.observe(int(rate_limit["remaining"]), reset_ts, int(rate_limit.get("limit") or 0), guessed)
+                if rate_limit.get("cost") is not None:
+                    charged = int(rate_limit["cost"])
+                    self.costs.observe(lease.key, charged)
+            elif "X-RateLimit-Remaining" in hdr:
+                try:
+                    reset_ts, guessed = float(hdr["X-RateLimit-Reset"]), False
+                    if reset_ts < now:
+                        reset_ts, guessed = now + 300, True
+                except (KeyError, ValueError):
+                    reset_ts, guessed = (b.reset, b.synthetic) if b.reset else (now + 300, True)
+                b.observe(int(hdr["X-RateLimit-Remaining"]), reset_ts, int(hdr.get("X-RateLimit-Limit", 0)), guessed)
+            else:
+                # no quota information (network error): assume the forecast was charged
+                b.remaining = max(b.remaining - lease.cost, 0)
+                if not b.reset:
+                    b.reset, b.synthetic = now + 300, True
+
+            kind, wait = throttle_wait(status, hdr, text, now) if status is not None else (None, 0)
+            if kind:
+                t.blocked_until = max(t.blocked_until, now + wait)
+                if kind == "primary":
+                    b.remaining = 0
+                t.aimd.on_throttle(lease.started_at)
+                self.aimd.on_throttle(lease.started_at)
+            elif status is None or status >= 500:
+                t.aimd.on_error(lease.started_at)
+                self.aimd.on_error(lease.started_at)
+            else:
+                t.aimd.on_success(latency)
+                self.aimd.on_success(latency)
+
+            metrics.inc("github_token_quota_used_total", charged, token=t.label, family=family)
+            metrics.set("github_token_remaining", b.remaining, token=t.label, family=family)
+            metrics.set("github_concurrency_limit", t.aimd.limit, scope=t.label)
+            metrics.set("github_concurrency_limit", self.aimd.limit, scope="global")
+            self.cond.notify_all()
+        return kind
+
+    async def release_response(self, lease, resp, latency=None):
+        """release() with everything taken from an httpx/requests response"""
+        status = resp.status_code
+        rate_limit = graphql_rate_limit(resp) if lease.family == "graphql" else None
+        text = resp.text if status in (403, 429) or (status == 200 and rate_limit is None and lease.family == "graphql") else ""
+        return await self.release(lease, resp.headers, rate_limit, status=status, latency=latency, text=text)
+
+    async def request(self, client, method, url, *, query=None, variables=None, endpoint="graphql",
+                      headers=None, **kwargs):
+        """
+        Send one request with a leased token. Throttled responses are retried here, on whichever token
+        is free first, without counting as failures; every other response is returned to the caller.
+        With GITHUB_ARCHIVE set, responses are recorded, or replayed without a token (response_archive.py).
+        """
+        if query is not None and "json" not in kwargs:
+            kwargs["json"] = {"query": query, "variables": variables or {}}
+        if ARCHIVE.replaying:
+            return ARCHIVE.replay(method, url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"))
+        while True:
+            lease = await self.acquire(query=query, variables=variables)
+            hdrs = {**(headers or {}), "Authorization": f"Bearer {lease.token}"}
+            t0 = time.time()
+            try:
+                sender = self._token_client(lease.state, client, url) if self.multiplex else client
+                resp = await sender.request(method, url, headers=hdrs, **kwargs)
+            except BaseException:
+                await self.release(lease, {})
+                raise
+            elapsed = time.time() - t0
+            metrics.observe("github_request_duration_seconds", elapsed, endpoint=endpoint, status=resp.status_code)
+            kind = await self.release_response(lease, resp, elapsed)
+            if kind not in THROTTLED:
+                if ARCHIVE.recording:
+                    ARCHIVE.record(method, url, resp, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"))
+                return resp
+            metrics.inc("github_retries_total", endpoint=endpoint, reason=kind)
+
+    def _token_client(self, t, client, url):
+        """
+        Client of the token, with the caller's timeout, headers and redirect policy. Over HTTP/2 the token's
+        concurrent requests become streams on one connection; where HTTP/2 is not available (http:// URLs,
+        h2 not installed) the token gets max_per_token HTTP/1.1 connections instead.
+        """
+        if t.client is None:
+            import httpx
+            try:
+                import h2  # noqa: F401
+                http2 = str(url).startswith("https://")
+            except ImportError:
+                http2 = False
+            connections = 1 if http2 else self.max_per_token
+            t.client = httpx.AsyncClient(
+                http2=http2,
+                limits=self.limits or httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+                timeout=client.timeout,
+                headers=client.headers,
+                follow_redirects=client.follow_redirects,
+            )
+        return t.client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.timer
+            self.timer = None
+        for t in self.tokens:
+            if t.client is not None:
+                await t.client.aclose()
+                t.client = None
+
+    def capacity(self, family=None):
+        """Points currently available across all tokens for a family"""
+        family = family or self.family
+        now = time.time()
+        total = 0
+        for t in self.tokens:
+            b = t.budgets[family]
+            b.refill(now)
+            total += max(b.headroom(), 0)
+        return total
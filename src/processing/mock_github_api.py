@@ -0,0 +1,525 @@
+######## Goal:
+######## Local stand-in for the GitHub endpoints used by the collectors, so that
+######## throughput can be measured without spending real quota.
+########
+######## Emulated endpoints:
+########   POST /graphql                      repository(...) aliases (optionally with defaultBranchRef history),
+########                                      user.contributionsCollection, rateLimit
+########   GET  /repos/{owner}/{repo}/commits  since/until, per_page/page, Link pagination
+########   GET  /repos/{owner}/{repo}/contributors
+########   GET  /rate_limit
+########   GET  /_stats, POST /_reset          benchmark bookkeeping (not part of the GitHub API)
+########
+######## Usage:
+########   python mock_github_api.py --port 8787 --latency-ms 80 --secondary-rate 0.01
+########   GITHUB_API=http://127.0.0.1:8787 TOKENS=t1,t2 python 05_2_updated_get_complete_commits.py
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+DEFAULTS = {
+    "users": 2000,
+    "repos": 5000,
+    "core_limit": 5000,
+    "graphql_limit": 5000,
+    "reset_seconds": 3600,
+    "latency_ms": 50.0,
+    "latency_jitter_ms": 20.0,
+    "error_403_rate": 0.0,
+    "error_502_rate": 0.0,
+    "secondary_rate": 0.0,
+    "secondary_retry_after": 60,
+    "max_inflight_per_token": 0,    # 0 = no concurrency-triggered secondary limit
+    "seed": 42,
+}
+
+EPOCH_START = datetime(2014, 1, 1, tzinfo=timezone.utc)
+EPOCH_END = datetime(2025, 12, 31, tzinfo=timezone.utc)
+
+
+# ────── Synthetic world ──────────────────────────────────────────────
+class SyntheticWorld:
+    """Deterministic users, repos and commits derived from a seed"""
+    def __init__(self, n_users, n_repos, seed):
+        self.n_users = n_users
+        self.n_repos = n_repos
+        self.seed = seed
+        self._commits = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, key):
+        return random.Random(zlib.crc32(f"{self.seed}:{key}".encode()))
+
+    def user_login(self, i):
+        return f"user{i}"
+
+    def repo_name(self, j):
+        return f"org{j % 97}/repo{j}"
+
+    def repo_index(self, full_name):
+        m = re.fullmatch(r"org\d+/repo(\d+)", full_name)
+        if not m or int(m.group(1)) >= self.n_repos:
+            return None
+        return int(m.group(1))
+
+    def user_index(self, login):
+        m = re.fullmatch(r"user(\d+)", login)
+        if not m or int(m.group(1)) >= self.n_users:
+            return None
+        return int(m.group(1))
+
+    def commits(self, j):
+        """All commits of repo j as a list of (date, author_login), newest first"""
+        with self._lock:
+            if j in self._commits:
+                return self._commits[j]
+        rng = self._rng(f"repo:{j}")
+        team = [self.user_login(rng.randrange(self.n_users)) for _ in range(rng.randint(1, 8))]
+        n_commits = int(rng.paretovariate(1.2) * 20)
+        span = (EPOCH_END - EPOCH_START).total_seconds()
+        commits = []
+        for _ in range(n_commits):
+            ts = EPOCH_START + timedelta(seconds=rng.random() * span)
+            # some commits have no linked GitHub account
+            author = rng.choice(team) if rng.random() > 0.05 else None
+            commits.append((ts, author))
+        commits.sort(key=lambda c: c[0], reverse=True)
+        with self._lock:
+            self._commits[j] = commits
+        return commits
+
+    def user_repos(self, login):
+        """Repos a user commits to, derived from the user's own seed"""
+        i = self.user_index(login)
+        if i is None:
+            return None
+        rng = self._rng(f"user:{i}")
+        return sorted({rng.randrange(self.n_repos) for _ in range(rng.randint(0, 40))})
+
+    def contributions(self, login, start, end):
+        """nameWithOwner of repos the user committed to in [start, end)"""
+        repos = self.user_repos(login)
+        if repos is None:
+            return None
+        result = []
+        for j in repos:
+            rng = self._rng(f"contrib:{login}:{j}")
+            active_from = EPOCH_START + timedelta(days=rng.randint(0, 3500))
+            active_to = active_from + timedelta(days=rng.randint(30, 900))
+            if active_from < end and active_to > start:
+                result.append(self.repo_name(j))
+        return result
+
+
+# ────── Rate limits ──────────────────────────────────────────────────
+class RateLimits:
+    """Per-token, per-family (core / graphql) quota buckets"""
+    def __init__(self, core_limit, graphql_limit, reset_seconds):
+        self.limits = {"core": core_limit, "graphql": graphql_limit}
+        self.reset_seconds = reset_seconds
+        self.buckets = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, token, family):
+        now = time.time()
+        key = (token, family)
+        b = self.buckets.get(key)
+        if b is None or now >= b["reset"]:
+            b = {"limit": self.limits[family], "used": 0, "reset": int(now + self.reset_seconds)}
+            self.buckets[key] = b
+        return b
+
+    def consume(self, token, family, cost=1):
+        """Charge cost points, return (allowed, bucket snapshot)"""
+        with self.lock:
+            b = self._bucket(token, family)
+            if b["used"] + cost > b["limit"]:
+                return False, dict(b)
+            b["used"] += cost
+            return True, dict(b)
+
+    def peek(self, token, family):
+        with self.lock:
+            return dict(self._bucket(token, family))
+
+    def enter(self, token):
+        with self.lock:
+            self.inflight[token] = self.inflight.get(token, 0) + 1
+            return self.inflight[token]
+
+    def leave(self, token):
+        with self.lock:
+            self.inflight[token] -= 1
+
+
+def rate_headers(bucket, family):
+    return {
+        "X-RateLimit-Limit": str(bucket["limit"]),
+        "X-RateLimit-Remaining": str(max(bucket["limit"] - bucket["used"], 0)),
+        "X-RateLimit-Used": str(bucket["used"]),
+        "X-RateLimit-Reset": str(bucket["reset"]),
+        "X-RateLimit-Resource": family,
+    }
+
+
+# ────── Stats ────────────────────────────────────────────────────────
+class Stats:
+    """Server-side request log used by the benchmark harness"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with getattr(self, "lock", threading.Lock()):
+            self.started = time.time()
+            self.requests = {}          # "endpoint status" -> count
+            self.latencies = {}         # endpoint -> [seconds]
+            self.quota_used = {}        # family -> points
+            self.useful = 0             # 200 responses that were charged quota
+            self.probes = 0             # 200 responses to free rateLimit queries
+
+    def record(self, endpoint, status, elapsed, family=None, cost=0):
+        with self.lock:
+            key = f"{endpoint} {status}"
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if family and cost:
+                self.quota_used[family] = self.quota_used.get(family, 0) + cost
+            if status == 200 and cost:
+                self.useful += 1
+            elif status == 200:
+                self.probes += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "elapsed": time.time() - self.started,
+                "requests": dict(self.requests),
+                "quota_used": dict(self.quota_used),
+                "useful_responses": self.useful,
+                "probe_responses": self.probes,
+                "latencies": {k: list(v) for k, v in self.latencies.items()},
+            }
+
+
+# ────── GraphQL emulation ────────────────────────────────────────────
+REPO_ALIAS_RE = re.compile(
+    r'(\w+)\s*:\s*repository\(\s*owner\s*:\s*"([^"]*)"\s*,\s*name\s*:\s*"([^"]*)"\s*\)'
+)
+HISTORY_ARGS_RE = re.compile(r'\bhistory\(([^)]*)\)')
+HISTORY_ARG_RE = re.compile(r'(\w+)\s*:\s*(?:"([^"]*)"|(\d+))')
+
+
+def parse_iso(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def graphql_cost(query):
+    """Rough GitHub point cost: 1 per request, plus 1 per 100 requested connection nodes"""
+    nodes = sum(int(n) for n in re.findall(r"first\s*:\s*(\d+)", query))
+    return max(1, nodes // 100)
+
+
+def answer_history(world, j, args):
+    """Commit.history(since:, until:, first:, after:) of repo j; the cursor is the offset into the list"""
+    params = {k: s if s else n for k, s, n in HISTORY_ARG_RE.findall(args)}
+    since = parse_iso(params["since"]) if "since" in params else EPOCH_START
+    until = parse_iso(params["until"]) if "until" in params else EPOCH_END
+    first = min(int(params.get("first", 100)), 100)
+    offset = int(params.get("after") or 0)
+    commits = [(ts, a) for ts, a in world.commits(j) if since <= ts < until]
+    page = commits[offset:offset + first]
+    return {"history": {
+        "pageInfo": {"hasNextPage": offset + first < len(commits), "endCursor": str(offset + len(page))},
+        "nodes": [{"committedDate": ts.strftime("%Y-%m-%dT%H:%M:%SZ"), "author": {"user": {"login": a} if a else None}}
+                  for ts, a in page],
+    }}
+
+
+def answer_graphql(world, query, variables, bucket, cost):
+    data = {}
+    errors = []
+
+    aliases = list(REPO_ALIAS_RE.finditer(query))
+    for k, m in enumerate(aliases):
+        alias, owner, name = m.groups()
+        j = world.repo_index(f"{owner}/{name}")
+        if j is None:
+            data[alias] = None
+            errors.append({
+                "type": "NOT_FOUND", "path": [alias],
+                "message": f"Could not resolve to a Repository with the name '{owner}/{name}'.",
+            })
+        else:
+            data[alias] = {"id": f"R_{j}", "databaseId": j, "nameWithOwner": world.repo_name(j)}
+            # the selection of this alias runs up to the next alias
+            end = aliases[k + 1].start() if k + 1 < len(aliases) else len(query)
+            history = HISTORY_ARGS_RE.search(query, m.end(), end)
+            if history:
+                data[alias]["defaultBranchRef"] = {"target": answer_history(world, j, history.group(1))}
+
+    if "contributionsCollection" in query:
+        login = variables.get("login", "")
+        start = parse_iso(variables["from"])
+        end = parse_iso(variables["to"])
+        repos = world.contributions(login, start, end)
+        if repos is None:
+            data["user"] = None
+            errors.append({
+                "type": "NOT_FOUND", "path": ["user"],
+                "message": f"Could not resolve to a User with the login of '{login}'.",
+            })
+        else:
+            data["user"] = {"contributionsCollection": {"commitContributionsByRepository": [
+                {"repository": {"nameWithOwner": r}} for r in repos
+            ]}}
+
+    if "rateLimit" in query:
+        data["rateLimit"] = {
+            "cost": cost,
+            "limit": bucket["limit"],
+            "remaining": max(bucket["limit"] - bucket["used"], 0),
+            "used": bucket["used"],
+            "resetAt": datetime.fromtimestamp(bucket["reset"], timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+    body = {"data": data}
+    if errors:
+        body["errors"] = errors
+    return body
+
+
+# ────── HTTP handler ─────────────────────────────────────────────────
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGitHub/1.0"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    # -- helpers --
+    @property
+    def cfg(self):
+        return self.server.cfg
+
+    def _token(self):
+        auth = self.headers.get("Authorization", "")
+        parts = auth.split()
+        return parts[1] if len(parts) == 2 else None
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _latency(self):
+        cfg = self.cfg
+        delay = random.gauss(cfg["latency_ms"], cfg["latency_jitter_ms"]) / 1000
+        if delay > 0:
+            time.sleep(delay)
+
+    def _guarded(self, endpoint, family, cost, handler):
+        """Apply auth, injected faults, secondary and primary limits, then run handler"""
+        t0 = time.time()
+        token = self._token()
+        if not token:
+            self._send(401, {"message": "Requires authentication"})
+            self.server.stats.record(endpoint, 401, time.time() - t0)
+            return
+
+        limits = self.server.limits
+        inflight = limits.enter(token)
+        try:
+            self._latency()
+            cfg = self.cfg
+
+            max_inflight = cfg["max_inflight_per_token"]
+            if (max_inflight and inflight > max_inflight) or random.random() < cfg["secondary_rate"]:
+                status = 403
+                self._send(status, {
+                    "message": "You have exceeded a secondary rate limit. Please wait a few minutes before you try again.",
+                    "documentation_url": "https://docs.github.com/rest/overview/rate-limits-for-the-rest-api#about-secondary-rate-limits",
+                }, {"Retry-After": str(cfg["secondary_retry_after"])})
+            elif random.random() < cfg["error_502_rate"]:
+                status = 502
+                self._send(status, {"message": "Server Error"})
+            elif random.random() < cfg["error_403_rate"]:
+                status = 403
+                self._send(status, {"message": "Resource not accessible by integration"},
+                           rate_headers(limits.peek(token, family), family))
+            else:
+                allowed, bucket = limits.consume(token, family, cost)
+                if not allowed:
+                    status = 403
+                    self._send(status, {"message": f"API rate limit exceeded for token {token[:6]}."},
+                               rate_headers(bucket, family))
+                else:
+                    status, body, headers = handler(bucket)
+                    headers = {**rate_headers(bucket, family), **headers}
+                    self._send(status, body, headers)
+                    self.server.stats.record(endpoint, status, time.time() - t0, family, cost)
+                    return
+            self.server.stats.record(endpoint, status, time.time() - t0)
+        finally:
+            limits.leave(token)
+
+    def _page_links(self, parsed, params, page, last_page):
+        if last_page <= 1:
+            return {}
+        base = f"http://{self.headers.get('Host')}{parsed.path}"
+        links = []
+
+        def url(p):
+            q = {k: v[-1] for k, v in params.items()}
+            q["page"] = str(p)
+            return f"<{base}?{urlencode(q)}>"
+
+        if page < last_page:
+            links.append(f'{url(page + 1)}; rel="next"')
+            links.append(f'{url(last_page)}; rel="last"')
+        if page > 1:
+            links.append(f'{url(1)}; rel="first"')
+            links.append(f'{url(page - 1)}; rel="prev"')
+        return {"Link": ", ".join(links)} if links else {}
+
+    # -- routes --
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+        parts = parsed.path.strip("/").split("/")
+
+        if parsed.path == "/_stats":
+            return self._send(200, self.server.stats.snapshot())
+
+        if parsed.path == "/rate_limit":
+            token = self._token()
+            if not token:
+                return self._send(401, {"message": "Requires authentication"})
+            core = self.server.limits.peek(token, "core")
+            gql = self.server.limits.peek(token, "graphql")
+
+            def res(b):
+                return {"limit": b["limit"], "used": b["used"],
+                        "remaining": b["limit"] - b["used"], "reset": b["reset"]}
+
+            return self._send(200, {"resources": {"core": res(core), "graphql": res(gql)}, "rate": res(core)})
+
+        if len(parts) == 4 and parts[0] == "repos" and parts[3] in ("commits", "contributors"):
+            full_name = f"{parts[1]}/{parts[2]}"
+            endpoint = f"/repos/{{r}}/{parts[3]}"
+            per_page = min(int(params.get("per_page", ["30"])[-1]), 100)
+            page = max(int(params.get("page", ["1"])[-1]), 1)
+
+            def handler(bucket):
+                j = self.server.world.repo_index(full_name)
+                if j is None:
+                    return 404, {"message": "Not Found"}, {}
+                commits = self.server.world.commits(j)
+                if parts[3] == "commits":
+                    since = parse_iso(params["since"][-1]) if "since" in params else EPOCH_START
+                    until = parse_iso(params["until"][-1]) if "until" in params else EPOCH_END
+                    items = [
+                        {"sha": f"{j:x}{k:08x}", "commit": {"author": {"date": ts.strftime("%Y-%m-%dT%H:%M:%SZ")},
+                                                            "committer": {"date": ts.strftime("%Y-%m-%dT%H:%M:%SZ")}},
+                         "author": {"login": a} if a else None}
+                        for k, (ts, a) in enumerate(commits) if since <= ts < until
+                    ]
+                else:
+                    counts = {}
+                    for _, a in commits:
+                        if a:
+                            counts[a] = counts.get(a, 0) + 1
+                    items = [{"login": a, "contributions": n, "type": "User"}
+                             for a, n in sorted(counts.items(), key=lambda x: -x[1])]
+                last_page = max((len(items) + per_page - 1) // per_page, 1)
+                body = items[(page - 1) * per_page: page * per_page]
+                return 200, body, self._page_links(parsed, params, page, last_page)
+
+            return self._guarded(endpoint, "core", 1, handler)
+
+        self._send(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+
+        if parsed.path == "/_reset":
+            self.server.stats.reset()
+            return self._send(200, {"ok": True})
+
+        if parsed.path != "/graphql":
+            return self._send(404, {"message": "Not Found"})
+
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            return self._send(400, {"message": "Problems parsing JSON"})
+        query = payload.get("query", "")
+        variables = payload.get("variables") or {}
+
+        # A bare rateLimit query costs nothing on GitHub
+        cost = 0 if re.fullmatch(r"\s*(query)?\s*\{\s*rateLimit\s*\{[^}]*\}\s*\}\s*", query) else graphql_cost(query)
+
+        def handler(bucket):
+            return 200, answer_graphql(self.server.world, query, variables, bucket, cost), {}
+
+        self._guarded("/graphql", "graphql", cost, handler)
+
+
+class MockGitHubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # listen() backlog; the default 5 overflows on a collector's startup burst of rate-limit probes
+    request_queue_size = 256
+
+    def __init__(self, address, cfg):
+        super().__init__(address, MockGitHubHandler)
+        self.cfg = cfg
+        self.world = SyntheticWorld(cfg["users"], cfg["repos"], cfg["seed"])
+        self.limits = RateLimits(cfg["core_limit"], cfg["graphql_limit"], cfg["reset_seconds"])
+        self.stats = Stats()
+
+
+def start_server(host="127.0.0.1", port=0, **overrides):
+    """Start the mock server in a background thread and return it (server.server_port holds the port)"""
+    cfg = {**DEFAULTS, **overrides}
+    random.seed(cfg["seed"])
+    server = MockGitHubServer((host, port), cfg)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local GitHub API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    return parser
+
+
+if __name__ == "__main__":
+    args = vars(build_parser().parse_args())
+    host, port = args.pop("host"), args.pop("port")
+    server = start_server(host, port, **args)
+    print(f"Mock GitHub API listening on http://{host}:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
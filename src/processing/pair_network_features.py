@@ -0,0 +1,268 @@
+######## Goal:
+######## Network features for every pair of dataset_new_6m / dataset_new_2y, computed with sparse matrix
+######## products in batches of pairs instead of per-pair SQL
+########
+######## For a pair (user1, user2, project_id) whose project starts at t:
+########   shared_collaborators  |N_t(u1) ∩ N_t(u2)|, N_t(u) = users who share with u at least one project (user_projects)
+########                         that starts before t, so nothing from the pair's project or later leaks in
+########   adamic_adar           sum over the shared collaborators w of 1 / log(|N_t(w)|)
+########   repo_jaccard_before   |R1 ∩ R2| / |R1 ∪ R2| of the two users' before-window repo sets for that project
+########                         (user_proj_repo_after_6mon for 6m, user_proj_repo for 2y; 0 when both are empty)
+########
+######## Matrices:
+########   B  users x projects incidence (collab_graph.CollabGraph); the collaborator rows of a batch are
+########      binarized rows of B_t[users] @ B.T, where B_t[users] keeps only the projects starting before each
+########      row's cutoff t, so the full users x users graph is never built
+########   R  (user, project) x repo incidence of the before window
+######## Per batch the rows of both users are gathered and multiplied elementwise; only --batch-pairs pairs and
+######## their neighbourhoods are in memory at a time. Results are streamed into a temporary table with COPY
+######## and written to the dataset table as extra columns with one UPDATE.
+########
+######## Usage:
+########   python pair_network_features.py                         # both horizons
+########   python pair_network_features.py --horizons 6m --repo-column repos_outside
+########   python pair_network_features.py --csv-out ../data       # write CSVs instead of updating the tables
+
+import argparse
+import io
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from scipy import sparse
+
+from collab_graph import CollabGraph
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+DB_DSN = f"dbname={os.getenv('DB_NAME')} user={os.getenv('DB_USER')} " \
+         f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST','localhost')} " \
+         f"port={os.getenv('DB_PORT','5432')}"
+
+# horizon -> (pair table, window table holding that horizon's before-window repos)
+HORIZONS = {
+    "6m": ("dataset_new_6m", "user_proj_repo_after_6mon"),
+    "2y": ("dataset_new_2y", "user_proj_repo"),
+}
+FEATURES = {
+    "shared_collaborators": "INTEGER",
+    "adamic_adar": "DOUBLE PRECISION",
+    "repo_jaccard_before": "DOUBLE PRECISION",
+}
+PAIR_KEY = ["user1_id", "user2_id", "project_id", "collaboration"]
+NEVER = np.iinfo(np.int64).max  # start of a project without a start date
+
+
+# ────── Loading ──────────────────────────────────────────────────────
+def copy_out(cur, query, names, dtype=None):
+    buf = io.StringIO()
+    cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buf)
+    buf.seek(0)
+    return pd.read_csv(buf, names=names, dtype=dtype, keep_default_na=False)
+
+
+def load_pairs(cur, table):
+    return copy_out(cur, f"SELECT {', '.join(PAIR_KEY)} FROM {table}", PAIR_KEY,
+                    dtype={"user1_id": str, "user2_id": str, "project_id": np.int64, "collaboration": str})
+
+
+def load_project_starts(cur, graph):
+    """
+    (start of every column of B, start per project_id) as int64 timestamps; a project without a start date
+    never counts as earlier than anything
+    """
+    df = copy_out(cur, "SELECT project_id, start_date FROM projects WHERE start_date IS NOT NULL",
+                  ["project_id", "start_date"], dtype={"project_id": np.int64, "start_date": str})
+    starts = pd.Series(pd.DatetimeIndex(pd.to_datetime(df["start_date"], utc=True)).asi8, index=df["project_id"])
+    return starts.reindex(graph.projects, fill_value=NEVER).to_numpy(), starts
+
+
+def load_repo_incidence(cur, window_table, repo_column):
+    """R: one row per (user_id, project_id) with a before window, one column per repo"""
+    rows = copy_out(cur, f"""
+        SELECT user_id, project_id, repo
+        FROM {window_table}
+        CROSS JOIN LATERAL jsonb_array_elements_text(
+            CASE WHEN jsonb_typeof({repo_column}) = 'array' THEN {repo_column} ELSE '[]'::jsonb END
+        ) AS repo
+        WHERE window_type = 'before'
+    """, ["user_id", "project_id", "repo"], dtype={"user_id": str, "project_id": np.int64, "repo": str})
+    k, keys = pd.factorize(pd.MultiIndex.from_arrays([rows["user_id"], rows["project_id"]]))
+    r, repos = pd.factorize(rows["repo"])
+    R = sparse.csr_matrix((np.ones(len(k)), (k, r)), shape=(len(keys), len(repos)))
+    R.sum_duplicates()
+    R.data[:] = 1
+    return R, keys
+
+
+# ────── Features ─────────────────────────────────────────────────────
+def gather_rows(M, positions):
+    """Rows of M at positions; -1 gives an empty row"""
+    valid = positions >= 0
+    out = sparse.csr_matrix((len(positions), M.shape[1]))
+    if valid.any():
+        picked = M[positions[valid]]
+        placement = sparse.csr_matrix(
+            (np.ones(valid.sum()), (np.flatnonzero(valid), np.arange(valid.sum()))), shape=(len(positions), valid.sum())
+        )
+        out = placement @ picked
+    return out.tocsr()
+
+
+def rows_before(graph, starts, positions, cutoffs):
+    """Rows of B at user positions (-1 = empty row), keeping only the projects that start before the row's cutoff"""
+    X = gather_rows(graph.B, positions)
+    row = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    keep = starts[X.indices] < cutoffs[row]
+    return sparse.csr_matrix((X.data[keep], (row[keep], X.indices[keep])), shape=X.shape)
+
+
+def neighbour_rows(graph, X, own):
+    """Binary collaborator rows of the project rows X (row i belongs to user position own[i], who is excluded)"""
+    A = (X @ graph.BT).tocoo()
+    keep = A.col != own[A.row]
+    return sparse.csr_matrix(
+        (np.ones(keep.sum()), (A.row[keep], A.col[keep])), shape=(X.shape[0], graph.B.shape[0])
+    )
+
+
+def degrees_before(graph, starts, users, cutoffs, chunk_rows=20000):
+    """|N_t(w)| for every (user position w, cutoff t)"""
+    degrees = np.zeros(len(users), dtype=np.int64)
+    for start in range(0, len(users), chunk_rows):
+        stop = min(start + chunk_rows, len(users))
+        X = rows_before(graph, starts, users[start:stop], cutoffs[start:stop])
+        degrees[start:stop] = np.diff(neighbour_rows(graph, X, users[start:stop]).indptr)
+    return degrees
+
+
+def collaborator_features(graph, starts, u1, u2, cutoffs):
+    """
+    shared collaborators and Adamic–Adar for user positions u1, u2 (-1 = user without projects), both on the
+    graph of the projects that start before the pair's cutoff
+    """
+    X = neighbour_rows(graph, rows_before(graph, starts, u1, cutoffs), u1)
+    Y = neighbour_rows(graph, rows_before(graph, starts, u2, cutoffs), u2)
+    common = X.multiply(Y).tocoo()
+    shared = np.bincount(common.row, minlength=len(u1)).astype(np.int64)
+
+    # degree of each shared collaborator as of the pair's cutoff, once per distinct (collaborator, cutoff)
+    keys, inverse = np.unique(np.stack([common.col.astype(np.int64), cutoffs[common.row]]), axis=1,
+                              return_inverse=True)
+    degrees = degrees_before(graph, starts, keys[0], keys[1])
+    # a shared collaborator has at least the two users of the pair as neighbours, so log(degree) > 0
+    weights = np.where(degrees > 1, 1.0 / np.log(np.maximum(degrees, 2)), 0.0)
+    adamic_adar = np.bincount(common.row, weights=weights[inverse.ravel()], minlength=len(u1))
+    return shared, adamic_adar
+
+
+def repo_jaccard(R, sizes, k1, k2):
+    X = gather_rows(R, k1)
+    Y = gather_rows(R, k2)
+    inter = np.asarray(X.multiply(Y).sum(axis=1)).ravel()
+    union = np.where(k1 >= 0, sizes[np.maximum(k1, 0)], 0) + np.where(k2 >= 0, sizes[np.maximum(k2, 0)], 0) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter, dtype=np.float64), where=union > 0)
+
+
+def pair_features(pairs, graph, starts, project_starts, R, repo_keys, batch_pairs):
+    """Features for every row of `pairs`, batch by batch"""
+    sizes = np.diff(R.indptr)
+    # nothing is earlier than the start of a pair's project that has no start date
+    cutoffs_all = project_starts.reindex(pairs["project_id"], fill_value=np.iinfo(np.int64).min).to_numpy()
+    u1_all = graph.users.get_indexer(pairs["user1_id"])
+    u2_all = graph.users.get_indexer(pairs["user2_id"])
+    k1_all = repo_keys.get_indexer(pd.MultiIndex.from_arrays([pairs["user1_id"], pairs["project_id"]]))
+    k2_all = repo_keys.get_indexer(pd.MultiIndex.from_arrays([pairs["user2_id"], pairs["project_id"]]))
+
+    for start in range(0, len(pairs), batch_pairs):
+        stop = min(start + batch_pairs, len(pairs))
+        shared, adamic_adar = collaborator_features(graph, starts, u1_all[start:stop], u2_all[start:stop],
+                                                    cutoffs_all[start:stop])
+        jaccard = repo_jaccard(R, sizes, k1_all[start:stop], k2_all[start:stop])
+        yield pairs.iloc[start:stop].assign(
+            shared_collaborators=shared, adamic_adar=adamic_adar, repo_jaccard_before=jaccard
+        )
+
+
+# ────── Output ───────────────────────────────────────────────────────
+def write_features(conn, table, batches):
+    """COPY the batches into a temp table, then add / fill the feature columns of `table` with one UPDATE"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TEMP TABLE pair_features_tmp (
+            user1_id TEXT, user2_id TEXT, project_id INT, collaboration TEXT,
+            {', '.join(f'{name} {kind}' for name, kind in FEATURES.items())}
+        ) ON COMMIT DROP
+    """)
+    rows = 0
+    for batch in batches:
+        buf = io.StringIO()
+        batch[PAIR_KEY + list(FEATURES)].to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        cur.copy_expert("COPY pair_features_tmp FROM STDIN WITH (FORMAT csv)", buf)
+        rows += len(batch)
+        print(f"  {table}: {rows} pairs computed", end="\r")
+    print()
+
+    cur.execute("CREATE INDEX ON pair_features_tmp (user1_id, user2_id, project_id, collaboration)")
+    cur.execute("ANALYZE pair_features_tmp")
+    for name, kind in FEATURES.items():
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {kind}")
+    cur.execute(f"""
+        UPDATE {table} t
+        SET {', '.join(f'{name} = f.{name}' for name in FEATURES)}
+        FROM pair_features_tmp f
+        WHERE t.user1_id = f.user1_id AND t.user2_id = f.user2_id
+          AND t.project_id = f.project_id AND t.collaboration = f.collaboration
+    """)
+    updated = cur.rowcount
+    conn.commit()
+    cur.close()
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared collaborators / Adamic–Adar / repo Jaccard for every pair")
+    parser.add_argument("--horizons", nargs="+", choices=list(HORIZONS), default=list(HORIZONS))
+    parser.add_argument("--repo-column", default="repos", choices=["repos", "repos_outside"],
+                        help="window-table column with the repo list (repos_outside = hackathon repos removed)")
+    parser.add_argument("--batch-pairs", type=int, default=50000)
+    parser.add_argument("--csv-out", default=None, help="directory for <table>_network_features.csv instead of UPDATE")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DB_DSN)
+
+    t0 = time.time()
+    graph = CollabGraph.from_db(conn)
+    with conn.cursor() as cur:
+        starts, project_starts = load_project_starts(cur, graph)
+    conn.commit()
+    print(f"collaboration graph: {graph.shape[0]} users x {graph.shape[1]} projects ({time.time() - t0:.1f}s)")
+
+    for horizon in args.horizons:
+        table, window_table = HORIZONS[horizon]
+        t0 = time.time()
+        with conn.cursor() as cur:
+            pairs = load_pairs(cur, table)
+            R, repo_keys = load_repo_incidence(cur, window_table, args.repo_column)
+        conn.commit()
+        print(f"{table}: {len(pairs)} pairs, {R.shape[0]} before windows x {R.shape[1]} repos from {window_table}")
+
+        batches = pair_features(pairs, graph, starts, project_starts, R, repo_keys, args.batch_pairs)
+        if args.csv_out:
+            out = Path(args.csv_out) / f"{table}_network_features.csv"
+            for i, batch in enumerate(batches):
+                batch.to_csv(out, mode="a" if i else "w", header=not i, index=False)
+            print(f"{table}: written to {out} in {time.time() - t0:.1f}s")
+        else:
+            updated = write_features(conn, table, batches)
+            print(f"{table}: {updated} rows updated in {time.time() - t0:.1f}s")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
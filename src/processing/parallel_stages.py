@@ -0,0 +1,266 @@
+######## Goal:
+######## Run the batch SQL stages 06_3 (common_repos_*), 07_1 (category tables) and 08_2 (avg_outside_repos_before)
+######## from N connections at once, so a multi-core DB host works on them in parallel instead of one DO block
+######## on one backend
+########
+######## Work is split by hash of (user1_id, user2_id): the shards are the hash partitions created by
+######## 06_2_partition_window_and_pair_tables.sql; an unpartitioned table is split into --workers keyset ranges of its
+######## primary key (user1_id, user2_id) instead.
+######## - 06_3 / 08_2: one chain per shard runs that shard's column updates one after the other (keyset batches
+########   of sql_batch_driver.py); different shards - of the same or of another table - run concurrently.
+########   A shard is never updated by two connections at once, so the batches' SKIP LOCKED never skips rows.
+######## - 07_1: the INSERTs of 07_1_categorize_pairs_to_4types.sql run per category table and hash partition, reading
+########   only the matching partitions of colab_pairs_single_proj / colab_pairs_multi_proj.
+######## work_mem (--work-mem auto) is shared out between the N sessions.
+########
+######## Usage:
+########   python parallel_stages.py 06_3 --workers 8
+########   python parallel_stages.py 06_3 07_1 08_2 --workers 16       # the stages in order, each one in parallel
+########   python parallel_stages.py 06_3 --jobs single_before multi_before --workers 4
+
+import argparse
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+
+import psycopg2
+from psycopg2 import sql
+
+from sql_batch_driver import (DB_DSN, JOBS, add_batch_arguments, configure_session, ensure_column, format_eta,
+                              format_size, run_job)
+
+CATEGORY_SQL = Path(__file__).resolve().parent / "07_1_categorize_pairs_to_4types.sql"
+PAIR_SOURCES = ["colab_pairs_single_proj", "colab_pairs_multi_proj"]
+STAGES = ["06_3", "07_1", "08_2"]
+
+
+# ────── Shards ───────────────────────────────────────────────────────
+def shards(cur, table):
+    """(leaf table, partition bound) of `table`, ordered by bound; an unpartitioned table is its own only leaf"""
+    # pg_partition_tree() has no rows for a plain table
+    cur.execute("""
+        SELECT c.relname, COALESCE(pg_get_expr(c.relpartbound, c.oid), '')
+        FROM pg_class c
+        WHERE c.oid IN (SELECT relid FROM pg_partition_tree(%s::regclass) WHERE isleaf)
+           OR (c.oid = %s::regclass AND c.relkind = 'r')
+    """, (table, table))
+    return sorted(cur.fetchall(), key=lambda row: [int(n) for n in re.findall(r"\d+", row[1])] or [0])
+
+
+def key_ranges(cur, table, count):
+    """
+    `count` primary-key ranges (after, through] of about the same number of rows, from one ordered scan of the
+    PK index; None = unbounded
+    """
+    rows = shard_rows(cur, table)
+    if count < 2 or rows < count:
+        return [(None, None)]
+    cur.execute(sql.SQL("""
+        SELECT user1_id, user2_id FROM (
+            SELECT user1_id, user2_id, row_number() OVER (ORDER BY user1_id, user2_id) AS n FROM {}
+        ) s
+        WHERE n %% %s = 0 ORDER BY n LIMIT %s
+    """).format(sql.Identifier(table)), (-(-rows // count), count - 1))
+    bounds = [None] + [tuple(key) for key in cur.fetchall()] + [None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def shard_rows(cur, table):
+    cur.execute("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+    return cur.fetchone()[0]
+
+
+# ────── Progress ─────────────────────────────────────────────────────
+class StageProgress:
+    """Rows done over all connections of a stage, printed at most once per second"""
+
+    def __init__(self, stage, todo, units):
+        self.stage = stage
+        self.todo = todo
+        self.units = units
+        self.done = self.updated = self.finished = 0
+        self.t_start = time.time()
+        self.last_print = 0.0
+        self.lock = threading.Lock()
+
+    def unit(self, label):
+        return UnitProgress(self, label)
+
+    def add(self, pending, updated):
+        with self.lock:
+            self.done += pending
+            self.updated += updated
+            self.report()
+
+    def unit_finished(self, label, updated):
+        with self.lock:
+            self.finished += 1
+            print(f"\n  {label}: {updated} rows ({self.finished}/{self.units} units done)")
+            self.report(force=True)
+
+    def report(self, force=False):
+        now = time.time()
+        if not force and now - self.last_print < 1:
+            return
+        self.last_print = now
+        elapsed = now - self.t_start
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = (self.todo - self.done) / rate if rate and self.todo else None
+        share = f" ({self.done / self.todo * 100:.1f}%)" if self.todo else ""
+        print(f"  {self.stage}: {self.done}/{self.todo}{share}, {rate:.0f} rows/s, ETA {format_eta(eta)}   ", end="\r")
+
+
+class UnitProgress:
+    """The sql_batch_driver progress interface, forwarding to the stage totals"""
+
+    def __init__(self, stage, label):
+        self.stage = stage
+        self.label = label
+        self.updated = 0
+
+    def start(self, todo, batch_rows, memory_rows, target):
+        pass
+
+    def retry(self, error, batch_rows):
+        print(f"\n  {self.label}: {type(error).__name__}, retrying with {batch_rows} rows")
+
+    def batch(self, pending, updated, seconds, next_rows):
+        self.updated += updated
+        self.stage.add(pending, updated)
+
+    def finish(self):
+        self.stage.unit_finished(self.label, self.updated)
+
+
+# ────── Units ────────────────────────────────────────────────────────
+def update_unit(job, shard, key_bounds, label, conn, args, work_mem_bytes, progress):
+    run_job(conn, job, args, work_mem_bytes, table=shard, progress=progress.unit(f"{job['name']} [{label}]"),
+            key_bounds=key_bounds)
+
+
+def insert_unit(statement, label, conn, args, work_mem_bytes, progress):
+    with conn.cursor() as cur:
+        cur.execute(statement)
+        rows = cur.rowcount
+    conn.commit()
+    progress.add(rows, rows)
+    progress.unit_finished(label, rows)
+
+
+def run_chain(chain, args, progress):
+    """The units of one shard, in order, on one connection"""
+    conn = psycopg2.connect(DB_DSN)
+    try:
+        work_mem_bytes = configure_session(conn, args.work_mem, sessions=args.workers)
+        for unit in chain:
+            unit(conn, args, work_mem_bytes, progress)
+    finally:
+        conn.close()
+
+
+# ────── Stages ───────────────────────────────────────────────────────
+def plan_updates(conn, stage, job_names, workers):
+    """
+    Chains of (job, shard) units, one chain per shard (partition, or key range of an unpartitioned table), with the
+    rows left to fill
+    """
+    jobs = [job for job in JOBS[stage] if not job_names or job["name"] in job_names]
+    chains, weights, ranges, todo = {}, {}, {}, 0
+    with conn.cursor() as cur:
+        for job in jobs:
+            ensure_column(conn, job)
+            cur.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE {} IS NULL").format(
+                sql.Identifier(job["table"]), sql.Identifier(job["column"])))
+            todo += cur.fetchone()[0]
+            for shard, _ in shards(cur, job["table"]):
+                # the same ranges for every job of a table, so a range's column updates share one chain
+                if shard not in ranges:
+                    ranges[shard] = key_ranges(cur, shard, workers) if shard == job["table"] else [(None, None)]
+                for i, key_bounds in enumerate(ranges[shard]):
+                    unit = (shard, i)
+                    label = f"{shard} {i + 1}/{len(ranges[shard])}" if len(ranges[shard]) > 1 else shard
+                    chains.setdefault(unit, []).append(partial(update_unit, job, shard, key_bounds, label))
+                    weights[unit] = shard_rows(cur, shard) / len(ranges[shard])
+    conn.commit()
+    return [chains[s] for s in sorted(chains, key=weights.get, reverse=True)], todo
+
+
+def category_statements():
+    """table -> INSERT statement of 07_1, and the DDL in front of them"""
+    text = CATEGORY_SQL.read_text(encoding="utf-8")
+    ddl = text[:text.index("-- Table 1:")]
+    inserts = {m.group(1): m.group(0) for m in re.finditer(r"^INSERT INTO (\w+)\n(?:.*\n)*?.*;$", text, flags=re.M)}
+    return ddl, inserts
+
+
+def plan_categories(conn):
+    """Create / empty the 8 category tables, then one INSERT unit per table and matching pair of source shards"""
+    ddl, inserts = category_statements()
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('triggered_6m') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute(sql.SQL("TRUNCATE {}").format(sql.SQL(", ").join(map(sql.Identifier, inserts))))
+        else:
+            cur.execute(ddl)
+        single, multi = (shards(cur, table) for table in PAIR_SOURCES)
+    conn.commit()
+
+    # partition k of both sources holds the same hash range only if the bounds agree
+    aligned = len(single) > 1 and [b for _, b in single] == [b for _, b in multi]
+    pairs = list(zip(single, multi)) if aligned else [((PAIR_SOURCES[0], ""), (PAIR_SOURCES[1], ""))]
+    chains = []
+    for table, statement in inserts.items():
+        for (single_leaf, bound), (multi_leaf, _) in pairs:
+            shard_statement = re.sub(r"\bFROM colab_pairs_single_proj\b", f"FROM {single_leaf}", statement)
+            shard_statement = re.sub(r"\bFROM colab_pairs_multi_proj\b", f"FROM {multi_leaf}", shard_statement)
+            label = f"{table} [{bound}]" if bound else table
+            chains.append([partial(insert_unit, shard_statement, label)])
+    return chains, 0
+
+
+def run_stage(stage, args):
+    conn = psycopg2.connect(DB_DSN)
+    try:
+        chains, todo = plan_categories(conn) if stage == "07_1" else plan_updates(conn, stage, args.jobs, args.workers)
+    finally:
+        conn.close()
+
+    progress = StageProgress(stage, todo, sum(len(chain) for chain in chains))
+    print(f"{stage}: {progress.units} units in {len(chains)} chains on {args.workers} connections"
+          + (f", {todo} rows to fill" if todo else ""))
+    failures = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_chain, chain, args, progress) for chain in chains]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(e)
+                print(f"\n{stage}: chain failed: {e}")
+    print(f"{stage}: {progress.updated} rows written in {format_eta(time.time() - progress.t_start)}"
+          + (f", {len(failures)} chains failed" if failures else ""))
+    if failures:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run 06_3 / 07_1 / 08_2 from several connections in parallel")
+    parser.add_argument("stages", nargs="+", choices=STAGES)
+    parser.add_argument("--workers", type=int, default=4, help="concurrent connections")
+    parser.add_argument("--jobs", nargs="+", default=None, help="restrict 06_3 / 08_2 to these sql_batch_driver jobs")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DB_DSN)
+    per_session = configure_session(conn, args.work_mem, sessions=args.workers)
+    conn.close()
+    print(f"{args.workers} connections, work_mem {format_size(per_session)} each")
+    for stage in sorted(args.stages, key=STAGES.index):
+        run_stage(stage, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+######## Goal:
+######## Dry run of the GraphQL collectors 05_2_updated_get_complete_commits.py and 05_3_update_commits_6months.py:
+######## how many requests, GraphQL points, quota resets and hours a run will take with the configured tokens,
+######## before starting it. Nothing is sent to GitHub unless --live is given (rateLimit queries cost no points).
+########
+######## Work is read from the DB exactly as the collectors select it (--delta: as their --delta mode) and expanded
+######## with their batching rules:
+########   05_2  pending users x projects -> before / after windows (2 years), overlapping windows of a
+########         (project, window_type) merged, every window split into 1-year contributionsCollection chunks
+########   05_3  'after' windows without processed_keys, plus the windows 05_2 will still write -> one 183-day request
+######## With the coverage index (CONTRIB_COVERAGE, on by default as in the collectors) only the gaps that
+######## user_contribution_spans does not cover are requested (contribution_coverage.plan_window).
+######## Points per request come from estimate_graphql_cost() on the collector's own query. Throughput is
+######## tokens x in-flight per token / latency (GITHUB_INFLIGHT_PER_TOKEN, TokenManager's limits), capped by
+######## GitHub's secondary limit of 2000 points per minute per token; quota is simulated per reset window.
+########
+######## Alternative settings are simulated as a grid and ranked by ETA:
+########   tokens=N,...      token count                    inflight=N,...   requests in flight per token
+########   latency=S,...     seconds per request            coverage=on,off  request only the uncovered gaps
+########
+######## Usage:
+########   python plan_collection.py 05_2 05_3
+########   python plan_collection.py 05_2 --metrics run.json --simulate tokens=4,8,16 inflight=1,2,4 coverage=on,off
+########   python plan_collection.py 05_2 05_3 --delta
+########   python plan_collection.py 05_3 --live
+
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import psycopg2
+import requests
+from dotenv import load_dotenv
+
+from contribution_coverage import merge_intervals, plan_window, year_chunks
+from github_tokens import DEFAULT_LIMIT, MAX_IN_FLIGHT_PER_TOKEN, estimate_graphql_cost, parse_reset_at, with_rate_limit
+from sql_batch_driver import format_eta
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
+DB_DSN = (
+    f"dbname={os.getenv('DB_NAME')} "
+    f"user={os.getenv('DB_USER')} "
+    f"password={os.getenv('DB_PASSWORD')} "
+    f"host={os.getenv('DB_HOST','localhost')} "
+    f"port={os.getenv('DB_PORT','5432')}"
+)
+TOKENS = [t.strip() for t in os.getenv("TOKENS", "").split(",") if t.strip()]
+GITHUB_API = os.getenv("GITHUB_API", "https://api.github.com")
+# as in the collectors: windows are answered from the coverage index unless CONTRIB_COVERAGE=0
+CONTRIB_COVERAGE = os.getenv("CONTRIB_COVERAGE", "1") != "0"
+
+HERE = Path(__file__).resolve().parent
+SCRIPTS = {"05_2": "05_2_updated_get_complete_commits.py", "05_3": "05_3_update_commits_6months.py"}
+WINDOW_2Y = timedelta(days=730)        # 05_2 before / after windows
+WINDOW_6M = timedelta(days=183)        # 05_3 after window
+RESET_SECONDS = 3600
+SECONDARY_POINTS_PER_MINUTE = 2000     # GitHub's GraphQL secondary limit
+DEFAULT_LATENCY = 1.0
+
+
+# ────── Collector queries ────────────────────────────────────────────
+def collector_cost(stage):
+    """GraphQL points per request of a collector, from the GQL string in its source"""
+    text = (HERE / SCRIPTS[stage]).read_text(encoding="utf-8")
+    query = re.search(r'GQL = with_rate_limit\("""(.*?)"""\)', text, flags=re.S).group(1)
+    return estimate_graphql_cost(with_rate_limit(query))
+
+
+# ────── Pending work ─────────────────────────────────────────────────
+def table_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+
+def pending_05_2(cur, limit_users=0, delta=False):
+    """user -> [(project_id, start_date, end_date)] as selected by 05_2's main() (all users with delta)"""
+    processed = "LEFT JOIN processed_users pu ON pu.user_id = up.user_id" \
+        if table_exists(cur, "processed_users") and not delta else ""
+    cur.execute(f"""
+        SELECT up.user_id, up.project_id, p.start_date, p.end_date
+        FROM user_projects up
+        JOIN projects p ON p.project_id = up.project_id
+        {processed}
+        WHERE {'pu.user_id IS NULL' if processed else 'TRUE'}
+        {f'AND up.user_id IN (SELECT user_id FROM user_projects LIMIT {int(limit_users)})' if limit_users else ''}
+    """)
+    users = defaultdict(list)
+    for user_id, project_id, start_date, end_date in cur.fetchall():
+        users[user_id].append((project_id, start_date, end_date))
+    return users
+
+
+def windows_05_3(cur, users_05_2, delta=False):
+    """(login, start, end) of 05_3: unprocessed 'after' windows (all with delta), and those 05_2 has yet to write"""
+    keys = {}
+    if table_exists(cur, "user_proj_repo"):
+        processed = table_exists(cur, "processed_keys") and not delta
+        cur.execute(f"""
+            SELECT upr.user_id, upr.project_id, upr.window_start_time
+            FROM user_proj_repo upr
+            {'LEFT JOIN processed_keys pk ON upr.user_id = pk.user_id AND upr.project_id = pk.project_id' if processed else ''}
+            WHERE upr.window_type = 'after' {'AND pk.user_id IS NULL' if processed else ''}
+        """)
+        keys = {(u, p): start for u, p, start in cur.fetchall()}
+    for login, projects in users_05_2.items():
+        for project_id, _, end_date in projects:
+            keys.setdefault((login, project_id), end_date)
+    return [(login, start, start + WINDOW_6M) for (login, _), start in keys.items()]
+
+
+def load_spans(cur, logins):
+    """login -> [(lo, hi, repos)] recorded in the coverage index (repos left empty)"""
+    spans = defaultdict(list)
+    if logins and table_exists(cur, "user_contribution_spans"):
+        cur.execute("SELECT user_id, lower(span), upper(span) FROM user_contribution_spans WHERE user_id = ANY(%s)",
+                    (sorted(logins),))
+        for login, lo, hi in cur.fetchall():
+            spans[login].append((lo, hi, ()))
+    return spans
+
+
+def gaps(spans, login, start, end):
+    """The parts of a window the collector requests: all of it without coverage, else the uncovered gaps"""
+    return [(start, end)] if spans is None else plan_window(spans.get(login, []), start, end)[1]
+
+
+def requests_05_2(users, spans=None):
+    """(login, from, to) of every request 05_2 sends for the pending users"""
+    calls = []
+    for login, projects in users.items():
+        windows = defaultdict(list)
+        for project_id, start_date, end_date in projects:
+            windows[(project_id, "before")].append((start_date - WINDOW_2Y, start_date))
+            windows[(project_id, "after")].append((end_date, end_date + WINDOW_2Y))
+        # all windows of a user are planned before any of their chunks is recorded
+        for merged in windows.values():
+            for start, end in merge_intervals(merged):
+                calls += [(login, s, e) for lo, hi in gaps(spans, login, start, end) for s, e in year_chunks(lo, hi)]
+    return calls
+
+
+def requests_05_3(windows, spans=None):
+    """(login, from, to) of every request 05_3 sends; a chunk recorded for one row covers a later row of the user"""
+    spans = None if spans is None else {login: list(s) for login, s in spans.items()}
+    now = datetime.now(timezone.utc)
+    calls = []
+    for login, start, end in windows:
+        for lo, hi in gaps(spans, login, start, end):
+            for s, e in year_chunks(lo, hi):
+                calls.append((login, s, e))
+                if spans is not None and e <= now:
+                    spans.setdefault(login, []).append((s, e, ()))
+    return calls
+
+
+# ────── Token budgets ────────────────────────────────────────────────
+def live_budgets(tokens):
+    """(remaining, limit, seconds to reset) per token from free rateLimit queries"""
+    budgets = []
+    for token in tokens:
+        resp = requests.post(f"{GITHUB_API}/graphql", json={"query": "{ rateLimit { remaining limit resetAt } }"},
+                             headers={"Authorization": f"Bearer {token}"}, timeout=30)
+        resp.raise_for_status()
+        rl = resp.json()["data"]["rateLimit"]
+        budgets.append((rl["remaining"], rl["limit"], max(parse_reset_at(rl["resetAt"]) - time.time(), 0)))
+    return budgets
+
+
+def full_budgets(n):
+    return [(DEFAULT_LIMIT, DEFAULT_LIMIT, RESET_SECONDS)] * n
+
+
+# ────── Projection ───────────────────────────────────────────────────
+def latency_from_snapshot(path):
+    """Mean latency of successful GraphQL requests in a METRICS_SNAPSHOT file"""
+    snap = json.loads(Path(path).read_text())
+    count = total = 0
+    for series in snap["histograms"].get("github_request_duration_seconds", []):
+        labels = series["labels"]
+        if labels.get("endpoint") == "graphql" and str(labels.get("status")) == "200":
+            count += series["count"]
+            total += series["sum"]
+    return total / count if count else None
+
+
+def project(n_requests, cost, tokens, inflight, latency, budgets):
+    """
+    ETA of n_requests at `cost` points each. Requests run at tokens x inflight / latency, capped by the
+    secondary limit; when the remaining budget of all tokens is spent, the run waits for the next reset.
+    Returns seconds, resets crossed and seconds spent waiting for quota.
+    """
+    burn = min(tokens * inflight / latency * cost, tokens * SECONDARY_POINTS_PER_MINUTE / 60)
+    budgets = [list(b) for b in budgets[:tokens]]
+    budgets += [[DEFAULT_LIMIT, DEFAULT_LIMIT, RESET_SECONDS] for _ in range(tokens - len(budgets))]
+    left = n_requests * cost
+    t = waited = 0.0
+    resets = 0
+    while left > 0:
+        next_reset = min(b[2] for b in budgets)
+        avail = sum(b[0] for b in budgets)
+        spend = min(avail, burn * (next_reset - t))
+        if left <= spend:
+            t += left / burn
+            break
+        left -= spend
+        waited += (next_reset - t) - spend / burn
+        for b in budgets:
+            b[0] -= spend * b[0] / avail if avail else 0
+        t = next_reset
+        for b in budgets:
+            if b[2] <= t:
+                b[0], b[2] = b[1], b[2] + RESET_SECONDS
+        resets += 1
+    return t, resets, waited
+
+
+def parse_grid(specs, current):
+    """--simulate key=v1,v2 ... on top of the current settings"""
+    grid = {k: [v] for k, v in current.items()}
+    for spec in specs or []:
+        key, values = spec.split("=", 1)
+        if key not in grid:
+            raise SystemExit(f"Unknown setting {key!r}, use one of {', '.join(grid)}")
+        cast = str if key == "coverage" else (float if key == "latency" else int)
+        grid[key] = [cast(v) for v in values.split(",")]
+    keys = list(grid)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*grid.values())]
+
+
+def report(stage, calls, cost, settings, current, budgets):
+    """calls: coverage setting -> requests of the stage"""
+    counts = ", ".join(f"{len(c)} with coverage {k}" for k, c in calls.items())
+    print(f"\n{stage} ({SCRIPTS[stage]}): {counts}, {cost} point(s) each")
+    rows = []
+    for s in settings:
+        n = len(calls[s["coverage"]])
+        seconds, resets, waited = project(n, cost, s["tokens"], s["inflight"], s["latency"], budgets)
+        rows.append((seconds, s, n, resets, waited))
+    print(f"  {'tokens':>6} {'inflight':>8} {'latency':>7} {'coverage':>8} {'requests':>9} {'points':>9} "
+          f"{'resets':>6} {'quota wait':>10} {'ETA':>9}")
+    for seconds, s, n, resets, waited in sorted(rows, key=lambda r: r[0]):
+        mark = "  <- current" if s == current else ""
+        print(f"  {s['tokens']:>6} {s['inflight']:>8} {s['latency']:>7.2f} {s['coverage']:>8} {n:>9} {n * cost:>9} "
+              f"{resets:>6} {format_eta(waited):>10} {format_eta(seconds):>9}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate requests, points and ETA of the 05_2 / 05_3 collectors")
+    parser.add_argument("stages", nargs="+", choices=list(SCRIPTS))
+    parser.add_argument("--limit-users", type=int, default=0, help="as 05_2 --limit-users")
+    parser.add_argument("--tokens", type=int, default=len(TOKENS) or 1, help="token count (default: TOKENS)")
+    parser.add_argument("--latency", type=float, default=None, help="seconds per request")
+    parser.add_argument("--metrics", default=None, help="METRICS_SNAPSHOT file of an earlier run, for the latency")
+    parser.add_argument("--delta", action="store_true", help="as the collectors' --delta: revisit processed work too")
+    parser.add_argument("--live", action="store_true", help="start from the tokens' current budgets")
+    parser.add_argument("--simulate", nargs="+", metavar="KEY=V1,V2", help="alternative settings to compare")
+    args = parser.parse_args()
+
+    latency = args.latency
+    if latency is None and args.metrics:
+        latency = latency_from_snapshot(args.metrics)
+        print(f"Latency from {args.metrics}: {latency:.2f}s" if latency else f"No GraphQL latency in {args.metrics}")
+    latency = latency or DEFAULT_LATENCY
+
+    if args.live:
+        if not TOKENS:
+            raise SystemExit("--live needs TOKENS in .env")
+        budgets = live_budgets(TOKENS)
+        print("Token budgets: " + ", ".join(f"{r}/{l} (reset in {format_eta(s)})" for r, l, s in budgets))
+    else:
+        budgets = full_budgets(args.tokens)
+
+    current = {"tokens": args.tokens, "inflight": MAX_IN_FLIGHT_PER_TOKEN, "latency": latency,
+               "coverage": "on" if CONTRIB_COVERAGE else "off"}
+    settings = parse_grid(args.simulate, current)
+    if unknown := {s["coverage"] for s in settings} - {"on", "off"}:
+        raise SystemExit(f"coverage must be on or off, not {', '.join(sorted(unknown))}")
+
+    conn = psycopg2.connect(DB_DSN)
+    with conn.cursor() as cur:
+        users = pending_05_2(cur, args.limit_users, args.delta)
+        print(f"05_2 pending users: {len(users)} ({sum(len(p) for p in users.values())} user-projects)")
+        windows = windows_05_3(cur, users, args.delta) if "05_3" in args.stages else []
+        spans = load_spans(cur, set(users) | {login for login, _, _ in windows})
+        print(f"Coverage index: {sum(len(s) for s in spans.values())} spans of {len(spans)} of these users")
+        for stage in args.stages:
+            calls = {}
+            for coverage in sorted({s["coverage"] for s in settings}):
+                covered = spans if coverage == "on" else None
+                calls[coverage] = requests_05_2(users, covered) if stage == "05_2" else requests_05_3(windows, covered)
+            report(stage, calls, collector_cost(stage), settings, current, budgets)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
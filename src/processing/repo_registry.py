@@ -0,0 +1,320 @@
+######## Goal:
+######## One identity for every GitHub repository the pipeline sees
+########
+######## Repos show up as full URLs (projects.repo_links), as owner/name (projects.github_repos, the window tables'
+######## repos) and, after renames or transfers, under several names at once. This module
+########   - parses all of these forms the same way (repo_alias, mirrored in SQL by repo_alias_key()); parse_github_url
+########     takes bare owner/name only with allow_bare=True, and with strict=True (01, 02c) only http(s)://github.com/ URLs
+########   - resolves every alias not seen before to GitHub's repository databaseId and current nameWithOwner with
+########     alias-batched GraphQL lookups (GitHub follows rename / transfer redirects, so old names land on the same id)
+########   - keeps the result in
+########       repo_registry   repo_id (databaseId) -> node_id, current name_with_owner
+########       repo_aliases    alias (lower-case owner/name) -> repo_id, or status 'not_found'
+######## Stages key on the integer id through repo_id_of(text) / repo_ids_of(text[]); --apply also writes
+######## github_repo_ids BIGINT[] to projects and projects_clean.
+########
+######## Usage:
+########   python repo_registry.py                           # resolve new aliases of projects and projects_clean
+########   python repo_registry.py --sources projects windows --apply
+########   python repo_registry.py --recheck-missing         # retry aliases that were not found before
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from collector_metrics import metrics, start_metrics, loop_monitor
+from github_tokens import TokenManager, with_rate_limit
+from response_archive import ARCHIVE
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
+DB_DSN = (
+    f"dbname={os.getenv('DB_NAME')} "
+    f"user={os.getenv('DB_USER')} "
+    f"password={os.getenv('DB_PASSWORD')} "
+    f"host={os.getenv('DB_HOST','localhost')} "
+    f"port={os.getenv('DB_PORT','5432')}"
+)
+
+GITHUB_API = os.getenv("GITHUB_API", "https://api.github.com")
+LOOKUP_BATCH = 100      # aliases per GraphQL request
+ROUND_BATCHES = 20      # requests in flight before the results are written
+
+# scheme and host are optional, so owner/name parses too (group 1 = the host part, empty for owner/name);
+# anything after the name (/tree/..., ?, #) is ignored
+REPO_RE = re.compile(
+    r'^((?:https?://)?(?:www\.)?github\.com/)?([A-Za-z0-9][A-Za-z0-9-]*)/([A-Za-z0-9._-]+?)(?:\.git)?(?:[/?#].*)?$',
+    re.IGNORECASE,
+)
+STRICT_PREFIX_RE = re.compile(r'^https?://github\.com/$')
+
+# observed repo references: source -> (table, column, kind)
+SOURCES = {
+    "projects": [("projects", "repo_links", "array"), ("projects", "github_repos", "array")],
+    "projects_clean": [("projects_clean", "github_repos", "array")],
+    "windows": [("user_proj_repo", "repos", "jsonb"), ("user_proj_repo_after_6mon", "repos", "jsonb")],
+}
+APPLY_TABLES = ["projects", "projects_clean"]
+
+DDL = r"""
+CREATE OR REPLACE FUNCTION repo_alias_key(link TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+    SELECT lower(m[1] || '/' || m[2])
+    FROM regexp_match(btrim(link),
+        '^(?:(?:https?://)?(?:www\.)?github\.com/)?([A-Za-z0-9][A-Za-z0-9-]*)/([A-Za-z0-9._-]+?)(?:\.git)?(?:[/?#].*)?$',
+        'i') AS m
+$$;
+
+CREATE TABLE IF NOT EXISTS repo_registry (
+    repo_id BIGINT PRIMARY KEY,                 -- GitHub databaseId
+    node_id TEXT,
+    name_with_owner TEXT NOT NULL,
+    resolved_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS repo_aliases (
+    alias TEXT PRIMARY KEY,                     -- repo_alias_key(): lower-case owner/name
+    repo_id BIGINT REFERENCES repo_registry(repo_id),
+    status TEXT NOT NULL CHECK (status IN ('resolved', 'not_found')),
+    checked_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS repo_aliases_repo_idx ON repo_aliases (repo_id);
+
+CREATE OR REPLACE FUNCTION repo_id_of(link TEXT) RETURNS BIGINT
+LANGUAGE sql STABLE STRICT PARALLEL SAFE AS $$
+    SELECT repo_id FROM repo_aliases WHERE alias = repo_alias_key(link)
+$$;
+
+CREATE OR REPLACE FUNCTION repo_ids_of(links TEXT[]) RETURNS BIGINT[]
+LANGUAGE sql STABLE STRICT PARALLEL SAFE AS $$
+    SELECT COALESCE(array_agg(DISTINCT a.repo_id ORDER BY a.repo_id), '{}')
+    FROM unnest(links) AS link
+    JOIN repo_aliases a ON a.alias = repo_alias_key(link)
+    WHERE a.repo_id IS NOT NULL
+$$;
+"""
+
+
+# ────── Parsing ──────────────────────────────────────────────────────
+def parse_github_url(url, allow_bare=False, strict=False):
+    """
+    (owner, repo) of a GitHub repository URL (or of a bare owner/name with allow_bare), else (None, None).
+    strict keeps the collectors' old rule: only http(s)://github.com/ URLs, no www. and no scheme-less links.
+    """
+    m = REPO_RE.match(url.strip()) if url else None
+    if not m or not (m.group(1) or allow_bare):
+        return None, None
+    if strict and not (m.group(1) and STRICT_PREFIX_RE.match(m.group(1))):
+        return None, None
+    return m.group(2), m.group(3)
+
+
+def repo_alias(value):
+    """Lower-case owner/name of a repository reference, as repo_alias_key() in SQL; None if it is not one"""
+    owner, name = parse_github_url(value, allow_bare=True)
+    return f"{owner}/{name}".lower() if owner else None
+
+
+def canonical_repo_names(cur, repos):
+    """reference -> current name_with_owner for the references already resolved (empty without a registry)"""
+    cur.execute("SELECT to_regclass('repo_aliases') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return {}
+    aliases = {repo: repo_alias(repo) for repo in repos}
+    cur.execute("""
+        SELECT a.alias, r.name_with_owner
+        FROM repo_aliases a
+        JOIN repo_registry r USING (repo_id)
+        WHERE a.alias = ANY(%s)
+    """, (sorted({a for a in aliases.values() if a}),))
+    names = dict(cur.fetchall())
+    return {repo: names[alias] for repo, alias in aliases.items() if alias in names}
+
+
+# ────── Observed aliases ─────────────────────────────────────────────
+def source_columns(cur, sources):
+    present = []
+    for table, column, kind in (c for s in sources for c in SOURCES[s]):
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+        """, (table, column))
+        if cur.fetchone():
+            present.append((table, column, kind))
+    return present
+
+
+def pending_aliases(cur, sources, recheck_missing):
+    """Aliases referenced by the sources that have no registry entry yet (or were not found, with recheck)"""
+    links = [
+        sql.SQL("SELECT {} AS link FROM {}").format(
+            sql.SQL("unnest({})" if kind == "array" else "jsonb_array_elements_text({})").format(sql.Identifier(column)),
+            sql.Identifier(table))
+        for table, column, kind in source_columns(cur, sources)
+    ]
+    if not links:
+        return []
+    known = "status = 'resolved'" if recheck_missing else "TRUE"
+    cur.execute(sql.SQL("""
+        SELECT DISTINCT repo_alias_key(link) AS alias FROM ({}) s WHERE repo_alias_key(link) IS NOT NULL
+        EXCEPT
+        SELECT alias FROM repo_aliases WHERE {}
+        ORDER BY 1
+    """).format(sql.SQL(" UNION ALL ").join(links), sql.SQL(known)))
+    return [alias for alias, in cur.fetchall()]
+
+
+# ────── Lookups ──────────────────────────────────────────────────────
+def lookup_query(aliases):
+    parts = []
+    for i, alias in enumerate(aliases):
+        owner, name = alias.split("/", 1)
+        parts.append(f"a{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+                     f"{{ databaseId id nameWithOwner }}")
+    return with_rate_limit("query {\n" + "\n".join(parts) + "\n}")
+
+
+async def lookup(tm, client, aliases, retries=3):
+    """
+    alias -> (databaseId, node id, nameWithOwner), or None when GitHub reports it NOT_FOUND.
+    Aliases failing for any other reason are left out and stay pending for the next run.
+    """
+    query = lookup_query(aliases)
+    for attempt in range(1, retries + 1):
+        try:
+            resp = await tm.request(client, "POST", f"{GITHUB_API}/graphql", query=query, timeout=60)
+            if resp.status_code == 200 and resp.json().get("data") is not None:
+                break
+            reason = f"http_{resp.status_code}"
+        except Exception as e:
+            reason = type(e).__name__
+        if attempt < retries:
+            metrics.inc("github_retries_total", endpoint="graphql", reason=reason)
+            metrics.inc("github_backoff_sleep_seconds_total", 2 ** attempt, reason="retry")
+            await asyncio.sleep(2 ** attempt)
+    else:
+        print(f"Lookup failed for {len(aliases)} aliases ({reason}), left pending")
+        return {}
+
+    body = resp.json()
+    not_found = {e["path"][0] for e in body.get("errors", []) if e.get("type") == "NOT_FOUND" and e.get("path")}
+    results = {}
+    for i, alias in enumerate(aliases):
+        node = body["data"].get(f"a{i}")
+        if node is not None:
+            results[alias] = (node["databaseId"], node["id"], node["nameWithOwner"])
+        elif f"a{i}" in not_found:
+            results[alias] = None
+    return results
+
+
+def store(conn, results):
+    """Upsert the resolved repos and all their aliases; a repo's current name is an alias of it as well"""
+    repos = {r[0]: r for r in results.values() if r}
+    aliases = {alias: (r[0] if r else None) for alias, r in results.items()}
+    aliases.update({name.lower(): repo_id for repo_id, _, name in repos.values()})
+    with conn, conn.cursor() as cur:
+        if repos:
+            execute_values(cur, """
+                INSERT INTO repo_registry (repo_id, node_id, name_with_owner) VALUES %s
+                ON CONFLICT (repo_id) DO UPDATE
+                SET node_id = EXCLUDED.node_id, name_with_owner = EXCLUDED.name_with_owner, resolved_at = now()
+            """, list(repos.values()))
+        execute_values(cur, """
+            INSERT INTO repo_aliases (alias, repo_id, status) VALUES %s
+            ON CONFLICT (alias) DO UPDATE
+            SET repo_id = EXCLUDED.repo_id, status = EXCLUDED.status, checked_at = now()
+        """, [(alias, repo_id, "resolved" if repo_id else "not_found") for alias, repo_id in aliases.items()])
+    for r in results.values():
+        metrics.inc("collector_items_total", outcome="resolved" if r else "not_found")
+
+
+async def resolve(conn, aliases, tokens):
+    import httpx
+
+    tm = TokenManager(tokens, family="graphql")
+    batches = [aliases[i:i + LOOKUP_BATCH] for i in range(0, len(aliases), LOOKUP_BATCH)]
+    done = 0
+    t_start = time.time()
+    async with tm, httpx.AsyncClient(timeout=60) as client:
+        for i in range(0, len(batches), ROUND_BATCHES):
+            rounds = await asyncio.gather(*(lookup(tm, client, b) for b in batches[i:i + ROUND_BATCHES]))
+            results = {alias: r for found in rounds for alias, r in found.items()}
+            t_db = time.time()
+            store(conn, results)
+            metrics.observe("db_write_seconds", time.time() - t_db, table="repo_aliases")
+            done += sum(len(b) for b in batches[i:i + ROUND_BATCHES])
+            print(f"  {done}/{len(aliases)} aliases looked up ({time.time() - t_start:.0f}s)")
+
+
+# ────── Apply ────────────────────────────────────────────────────────
+def apply_ids(conn):
+    """github_repo_ids of projects / projects_clean from every repo reference they hold"""
+    with conn, conn.cursor() as cur:
+        for table in APPLY_TABLES:
+            columns = [c for t, c, _ in source_columns(cur, ["projects", "projects_clean"]) if t == table]
+            if not columns:
+                continue
+            links = sql.SQL(" || ").join(sql.SQL("COALESCE({}, '{{}}')").format(sql.Identifier(c)) for c in columns)
+            cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS github_repo_ids BIGINT[]").format(
+                sql.Identifier(table)))
+            cur.execute(sql.SQL("UPDATE {} SET github_repo_ids = repo_ids_of({})").format(sql.Identifier(table), links))
+            print(f"{table}.github_repo_ids: {cur.rowcount} rows")
+
+
+def print_summary(conn):
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*) FILTER (WHERE status = 'resolved'),
+                   COUNT(*) FILTER (WHERE status = 'not_found'),
+                   COUNT(DISTINCT repo_id),
+                   COUNT(*) FILTER (WHERE status = 'resolved')
+                     - COUNT(DISTINCT repo_id) FILTER (WHERE status = 'resolved')
+            FROM repo_aliases
+        """)
+        resolved, missing, repos, extra = cur.fetchone()
+    print(f"Registry: {repos} repos, {resolved} resolved aliases ({extra} extra names), {missing} not found")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve observed repo references to canonical GitHub repo ids")
+    parser.add_argument("--sources", nargs="+", choices=list(SOURCES), default=["projects", "projects_clean"])
+    parser.add_argument("--recheck-missing", action="store_true", help="look up aliases not found before again")
+    parser.add_argument("--apply", action="store_true", help="write github_repo_ids to projects / projects_clean")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DB_DSN)
+    with conn, conn.cursor() as cur:
+        cur.execute(DDL)
+        aliases = pending_aliases(cur, args.sources, args.recheck_missing)
+    print(f"Aliases to look up: {len(aliases)}")
+
+    if aliases:
+        tokens = ARCHIVE.tokens([t.strip() for t in os.getenv("TOKENS", "").split(",") if t.strip()])
+        if not tokens:
+            sys.exit("Set TOKENS=ghp_xxx,... in .env")
+        start_metrics("repo_registry")
+
+        async def run():
+            async with loop_monitor():
+                await resolve(conn, aliases, tokens)
+
+        asyncio.run(run())
+
+    if args.apply:
+        apply_ids(conn)
+    print_summary(conn)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
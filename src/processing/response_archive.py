@@ -0,0 +1,327 @@
+######## Goal:
+######## Local archive of raw GitHub API responses, so a collector can be rerun offline after a parser fix and
+######## the benchmarks get a fixed, realistic workload.
+########
+######## Every response the collectors receive (except throttling 403/429 and 5xx) is stored under a key made of
+######## method, path, query parameters and request body; the host and the token are not part of the key, so an
+######## archive recorded against api.github.com replays under any GITHUB_API and with any (or no) TOKENS.
+########
+######## responses   key -> status, headers (JSON, only those the collectors read), body and the canonical
+########             request (for inspection); the three are compressed with zstd when the zstandard package is installed, zlib otherwise
+########             (codec kept per row)
+########
+######## Configured in .env / environment:
+########   GITHUB_ARCHIVE=responses.sqlite   archive file (unset: collectors talk to GitHub as before)
+########   GITHUB_ARCHIVE_MODE=record        record: send requests and store the responses (default)
+########                                     replay: answer every request from the archive, nothing is sent;
+########                                     a request missing from the archive raises ArchiveMiss
+########
+######## Rate-limit probes (GET /rate_limit, GraphQL queries selecting only rateLimit) are never stored; on replay
+######## they, and the rate-limit headers / rateLimit objects of replayed responses, report a full budget, so no
+######## collector waits for a quota that was spent while recording.
+########
+######## Usage in a collector:
+########   from response_archive import ARCHIVE
+########   TOKENS = ARCHIVE.tokens(TOKENS)                              # placeholder token when replaying
+########   resp = ARCHIVE.request("GET", url, headers=..., params=...)  # instead of requests.get(url, ...)
+########   resp = await ARCHIVE.arequest("GET", url, ...)               # the same from a coroutine (worker thread)
+########   (TokenManager.request records / replays by itself)
+########
+########   python response_archive.py stats responses.sqlite
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from email.utils import formatdate
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+from dotenv import load_dotenv
+
+from collector_metrics import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
+DDL = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    codec TEXT NOT NULL,
+    request BLOB NOT NULL,
+    headers BLOB NOT NULL,
+    body BLOB NOT NULL,
+    raw_bytes INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+"""
+
+RATE_LIMIT_ONLY = re.compile(r"^\s*(query\s*)?\{\s*rateLimit\s*\{[^{}]*\}\s*\}\s*$")
+RATE_LIMIT_HEADERS = ("x-ratelimit-remaining", "x-ratelimit-reset", "x-ratelimit-used", "retry-after")
+KEPT_HEADERS = ("content-type", "link", "etag", "last-modified", "x-ratelimit-limit", "x-ratelimit-resource")
+FULL_BUDGET = 5000
+
+
+class ArchiveMiss(LookupError):
+    """Replay of a request that was never recorded"""
+
+
+# ────── Codecs ───────────────────────────────────────────────────────
+def compress(data):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 6)
+
+
+def decompress(codec, blob):
+    if codec == "zlib":
+        return zlib.decompress(blob)
+    if zstandard is None:
+        raise RuntimeError("archive rows are zstd-compressed: pip install zstandard")
+    return zstandard.ZstdDecompressor().decompress(blob)
+
+
+# ────── Request keys ─────────────────────────────────────────────────
+def request_key(method, url, params=None, json_body=None, data=None):
+    """(key, path, canonical request) of a request; host and headers are left out"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [(k, str(v)) for k, v in (params or {}).items()]
+    if json_body is not None:
+        body = json.dumps(json_body, sort_keys=True, separators=(",", ":"))
+    elif data is not None:
+        body = data.decode() if isinstance(data, bytes) else str(data)
+    else:
+        body = ""
+    canonical = json.dumps([method.upper(), parts.path, sorted(query), body], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest(), parts.path, canonical
+
+
+def is_rate_limit_probe(path, json_body):
+    if path.endswith("/rate_limit"):
+        return True
+    query = (json_body or {}).get("query") if isinstance(json_body, dict) else None
+    return bool(query and RATE_LIMIT_ONLY.match(query))
+
+
+# ────── Replayed responses ───────────────────────────────────────────
+class Headers(dict):
+    """Case-insensitive header mapping, enough of requests' / httpx' for the collectors"""
+    def __init__(self, items=()):
+        super().__init__((k.lower(), v) for k, v in dict(items).items())
+
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+class ArchivedResponse:
+    """Stands in for a requests / httpx response on replay"""
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = Headers(headers)
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    @property
+    def links(self):
+        """Parsed Link header, as requests' Response.links"""
+        links = {}
+        for part in self.headers.get("link", "").split(","):
+            m = re.match(r'\s*<([^>]*)>\s*;\s*rel="?([^";]+)"?', part)
+            if m:
+                links[m.group(2)] = {"url": m.group(1), "rel": m.group(2)}
+        return links
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code} (archived) for {self.url}")
+
+
+def full_budget_headers(headers):
+    out = {k: v for k, v in headers.items() if k.lower() not in RATE_LIMIT_HEADERS}
+    if any(k.lower() == "x-ratelimit-limit" for k in headers):
+        out["x-ratelimit-remaining"] = str(FULL_BUDGET)
+        out["x-ratelimit-reset"] = str(int(time.time()) + 3600)
+    return out
+
+
+def full_budget_body(content):
+    """Replace a GraphQL rateLimit object by a full budget, leaving the rest of the body as recorded"""
+    if b'"rateLimit"' not in content:
+        return content
+    body = json.loads(content)
+    rate_limit = (body.get("data") or {}).get("rateLimit")
+    if not rate_limit:
+        return content
+    reset_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600))
+    rate_limit.update({k: v for k, v in (("remaining", FULL_BUDGET), ("limit", FULL_BUDGET), ("resetAt", reset_at))
+                       if k in rate_limit})
+    return json.dumps(body).encode()
+
+
+def probe_response(path, url):
+    """Full-budget answer to a rate-limit probe on replay"""
+    reset = int(time.time()) + 3600
+    if path.endswith("/rate_limit"):
+        core = {"limit": FULL_BUDGET, "remaining": FULL_BUDGET, "reset": reset, "used": 0}
+        body = {"resources": {"core": core, "graphql": dict(core), "search": dict(core)}, "rate": core}
+    else:
+        reset_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(reset))
+        body = {"data": {"rateLimit": {"limit": FULL_BUDGET, "remaining": FULL_BUDGET, "cost": 1, "resetAt": reset_at}}}
+    return ArchivedResponse(200, {"content-type": "application/json", "date": formatdate(usegmt=True)},
+                            json.dumps(body).encode(), url)
+
+
+# ────── Archive ──────────────────────────────────────────────────────
+class ResponseArchive:
+    """SQLite response store shared by the threads / coroutines of one collector process"""
+    def __init__(self, path=None, mode="record"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"GITHUB_ARCHIVE_MODE must be record or replay, not {mode!r}")
+        self.path, self.mode = path, mode
+        self.conn = None
+        self.lock = threading.Lock()
+        if path:
+            if mode == "replay" and not Path(path).exists():
+                raise FileNotFoundError(f"GITHUB_ARCHIVE {path} does not exist")
+            self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(DDL)
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("GITHUB_ARCHIVE") or None, os.getenv("GITHUB_ARCHIVE_MODE", "record"))
+
+    @property
+    def recording(self):
+        return self.conn is not None and self.mode == "record"
+
+    @property
+    def replaying(self):
+        return self.conn is not None and self.mode == "replay"
+
+    def tokens(self, tokens):
+        """The configured tokens, or one placeholder when replaying without any"""
+        return tokens or (["replay"] if self.replaying else [])
+
+    # ── Replay ──
+    def replay(self, method, url, params=None, json_body=None, data=None):
+        key, path, canonical = request_key(method, url, params, json_body, data)
+        if is_rate_limit_probe(path, json_body):
+            metrics.inc("archive_requests_total", outcome="probe")
+            return probe_response(path, url)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, codec, headers, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            metrics.inc("archive_requests_total", outcome="miss")
+            raise ArchiveMiss(f"{method} {path} not in {self.path}: {canonical[:300]}")
+        status, codec, headers, body = row
+        metrics.inc("archive_requests_total", outcome="hit")
+        headers = full_budget_headers(json.loads(decompress(codec, headers)))
+        return ArchivedResponse(status, headers, full_budget_body(decompress(codec, body)), url)
+
+    # ── Record ──
+    def record(self, method, url, resp, params=None, json_body=None, data=None):
+        """Store a received response (requests or httpx); throttling and server errors are not stored"""
+        status = resp.status_code
+        if status in (403, 429) or status >= 500:
+            return
+        key, path, canonical = request_key(method, url, params, json_body, data)
+        if is_rate_limit_probe(path, json_body):
+            return
+        content = resp.content
+        codec, body = compress(content)
+        _, request = compress(canonical.encode())
+        kept = {k.lower(): v for k, v in resp.headers.items() if k.lower() in KEPT_HEADERS}
+        _, headers = compress(json.dumps(kept).encode())
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, method.upper(), path, status, codec, request, headers, body, len(content), time.time()))
+        metrics.inc("archive_requests_total", outcome="recorded")
+
+    # ── Synchronous requests ──
+    def request(self, method, url, **kwargs):
+        """requests.request() that replays from / records into the archive"""
+        if self.replaying:
+            return self.replay(method, url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"))
+        import requests
+        resp = requests.request(method, url, **kwargs)
+        if self.recording:
+            self.record(method, url, resp, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"))
+        return resp
+
+    async def arequest(self, method, url, **kwargs):
+        """request() on a worker thread, so a coroutine does not block the event loop"""
+        return await asyncio.to_thread(self.request, method, url, **kwargs)
+
+    def stats(self):
+        return self.conn.execute("""
+            SELECT method, path, status, codec, count(*), sum(raw_bytes), sum(length(body)),
+                   sum(length(body) + length(headers) + length(request))
+            FROM responses GROUP BY 1, 2, 3, 4 ORDER BY 5 DESC
+        """).fetchall()
+
+
+ARCHIVE = ResponseArchive.from_env()
+
+
+def print_stats(archive, top):
+    rows = archive.stats()
+    n = sum(r[4] for r in rows)
+    raw = sum(r[5] for r in rows)
+    bodies = sum(r[6] for r in rows)
+    stored = sum(r[7] for r in rows)
+    print(f"{archive.path}: {n} responses, bodies {raw / 1e6:.2f} MB raw -> {bodies / 1e6:.2f} MB compressed "
+          f"({raw / bodies if bodies else 0:.1f}x), {stored / 1e6:.2f} MB with requests and headers")
+    # endpoint shapes: repo / user names in REST paths collapse to {x}
+    by_shape = {}
+    for method, path, status, codec, count, raw_bytes, _, _ in rows:
+        shape = (method, re.sub(r"^/(repos|users)/[^/]+(/[^/]+)?", lambda m: f"/{m.group(1)}/{{x}}", path), status, codec)
+        c, b = by_shape.get(shape, (0, 0))
+        by_shape[shape] = (c + count, b + raw_bytes)
+    print(f"{'method':<6} {'path':<40} {'status':>6} {'codec':>5} {'count':>8} {'raw MB':>8}")
+    for (method, path, status, codec), (count, raw_bytes) in sorted(by_shape.items(), key=lambda x: -x[1][0])[:top]:
+        print(f"{method:<6} {path:<40} {status:>6} {codec:>5} {count:>8} {raw_bytes / 1e6:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a GitHub response archive")
+    parser.add_argument("command", choices=["stats"])
+    parser.add_argument("path")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    print_stats(ResponseArchive(args.path, "replay"), args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+######## Goal:
+######## Run the resumable batch updates of 06_3_fill_common_repos.sql (common_repos_* of the colab pair tables)
+######## and 08_2_update_pair_features.sql (avg_outside_repos_before of the 8 category tables) without hand-tuned
+######## batch sizes or work_mem
+########
+######## - keyset cursor: each batch is a primary-key range (user1_id, user2_id) > last key, found through the PK
+########   index, instead of "WHERE col IS NULL LIMIT n", which re-reads the processed rows on every iteration and
+########   never terminates for rows the UPDATE cannot fill. A rerun starts at the first key that is still NULL.
+######## - adaptive batch size: the next batch is scaled by target_seconds / measured seconds (x0.5 .. x2), capped by
+########   what fits in work_mem given the measured size of the repo lists; a batch that runs out of memory or over
+########   the statement timeout is rolled back and retried at half the size
+######## - work_mem: --work-mem auto derives it from the server's shared_buffers (~25% of RAM on a tuned server),
+########   so the same run fits a laptop and a large DB server
+######## - progress: rows done / to do, rows/s and ETA per batch, one summary line per job
+########
+######## Usage:
+########   python sql_batch_driver.py 06_3                      # all 10 common_repos_* updates
+########   python sql_batch_driver.py 06_3 --jobs single_before multi_before --target-seconds 5
+########   python sql_batch_driver.py 08_2 --work-mem 512MB
+########   python sql_batch_driver.py --list
+
+import argparse
+import os
+import re
+import time
+from pathlib import Path
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import errors, sql
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+DB_DSN = f"dbname={os.getenv('DB_NAME')} user={os.getenv('DB_USER')} " \
+         f"password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST','localhost')} " \
+         f"port={os.getenv('DB_PORT','5432')}"
+
+# 06_3: (column, window table, window_type, repo column, multi-project column)
+COMMON_REPOS = [
+    ("common_repos_before", "user_proj_repo", "before", "repos", "first_proj"),
+    ("common_repos_after_2y", "user_proj_repo", "after", "repos_outside", "last_proj"),
+    ("common_repos_after_2y_continuation_inc", "user_proj_repo", "after", "repos", "last_proj"),
+    ("common_repos_after_6m", "user_proj_repo_after_6mon", "after", "repos_outside", "last_proj"),
+    ("common_repos_after_6m_continuation_inc", "user_proj_repo_after_6mon", "after", "repos", "last_proj"),
+]
+CATEGORY_TABLES = ["triggered", "terminated", "sustained", "temporary"]
+HORIZON_WINDOWS = {"6m": "user_proj_repo_after_6mon", "2y": "user_proj_repo"}
+
+
+def job_name(table, column):
+    short = column.replace("common_repos_", "").replace("_continuation_inc", "_inc")
+    return f"{table.replace('colab_pairs_', '').replace('_proj', '')}_{short}"
+
+
+def build_jobs():
+    jobs = {"06_3": [], "08_2": []}
+    for table in ("colab_pairs_single_proj", "colab_pairs_multi_proj"):
+        for column, window, window_type, repo_column, multi_project in COMMON_REPOS:
+            jobs["06_3"].append({
+                "name": job_name(table, column), "kind": "common_repos", "table": table, "column": column,
+                "column_type": "text[]", "window": window, "window_type": window_type, "repo_column": repo_column,
+                "project_column": multi_project if table == "colab_pairs_multi_proj" else "project_id",
+            })
+    for horizon, window in HORIZON_WINDOWS.items():
+        for category in CATEGORY_TABLES:
+            table = f"{category}_{horizon}"
+            jobs["08_2"].append({
+                "name": table, "kind": "avg_outside", "table": table, "column": "avg_outside_repos_before",
+                "column_type": "NUMERIC(10,2)", "window": window, "window_type": "before",
+                "repo_column": "repos_outside", "project_column": "project_id",
+            })
+    return jobs
+
+
+JOBS = build_jobs()
+
+
+# ────── Statements ───────────────────────────────────────────────────
+def update_statement(job, key_condition, table=None):
+    """UPDATE of the rows in the key range whose target column is still NULL; returns (rows still NULL, rows updated)"""
+    ids = {name: sql.Identifier(job[name]) for name in ("column", "window", "repo_column", "project_column")}
+    ids["table"] = sql.Identifier(table or job["table"])
+    if job["kind"] == "common_repos":
+        value = sql.SQL("""array_intersect(
+                COALESCE(jsonb_array_to_text_array(w1.{repo_column}), ARRAY[]::text[]),
+                COALESCE(jsonb_array_to_text_array(w2.{repo_column}), ARRAY[]::text[]))""").format(**ids)
+        join = sql.SQL("LEFT JOIN")
+    else:
+        # inner join as in 08_2: pairs without a before window keep NULL
+        value = sql.SQL("(COALESCE(w1.repos_outside_num, 0) + COALESCE(w2.repos_outside_num, 0)) / 2.0")
+        join = sql.SQL("JOIN")
+    return sql.SQL("""
+        WITH batch AS (
+            SELECT user1_id, user2_id, {project_column} AS project_id
+            FROM {table}
+            WHERE {key_condition} AND {column} IS NULL
+            FOR UPDATE SKIP LOCKED
+        ),
+        updated AS (
+            UPDATE {table} t
+            SET {column} = {value}
+            FROM batch b
+            {join} {window} w1
+                ON w1.user_id = b.user1_id AND w1.project_id = b.project_id AND w1.window_type = {window_type}
+            {join} {window} w2
+                ON w2.user_id = b.user2_id AND w2.project_id = b.project_id AND w2.window_type = {window_type}
+            WHERE t.user1_id = b.user1_id AND t.user2_id = b.user2_id
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM batch), (SELECT COUNT(*) FROM updated)
+    """).format(value=value, join=join, window_type=sql.Literal(job["window_type"]), key_condition=key_condition, **ids)
+
+
+def boundary_statement(table, key_condition):
+    """The key `OFFSET %s` rows into the range: the inclusive upper end of the next batch"""
+    return sql.SQL("SELECT user1_id, user2_id FROM {} WHERE {} ORDER BY user1_id, user2_id OFFSET %s LIMIT 1").format(
+        sql.Identifier(table), key_condition)
+
+
+def key_range(lower, lower_inclusive, upper):
+    """Keyset condition (user1_id, user2_id) in (lower, upper] plus its parameters; None = unbounded"""
+    parts, params = [], []
+    if lower is not None:
+        parts.append(f"(user1_id, user2_id) {'>=' if lower_inclusive else '>'} (%s, %s)")
+        params.extend(lower)
+    if upper is not None:
+        parts.append("(user1_id, user2_id) <= (%s, %s)")
+        params.extend(upper)
+    return sql.SQL(" AND ".join(parts) or "TRUE"), params
+
+
+# ────── Memory ───────────────────────────────────────────────────────
+UNITS = {"kB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30, "TB": 1 << 40}
+
+
+def parse_size(value):
+    """'256MB' / '4GB' -> bytes"""
+    m = re.fullmatch(r"\s*(\d+)\s*(kB|MB|GB|TB)?\s*", value)
+    if not m:
+        raise ValueError(f"not a memory size: {value!r}")
+    return int(m.group(1)) * UNITS.get(m.group(2), 1)
+
+
+def format_size(n):
+    for unit in ("TB", "GB", "MB"):
+        if n >= UNITS[unit] and n % UNITS[unit] == 0:
+            return f"{n // UNITS[unit]}{unit}"
+    return f"{max(n // UNITS['kB'], 64)}kB"
+
+
+def auto_work_mem(cur, sessions=1):
+    """
+    work_mem for this session: shared_buffers is conventionally ~25% of RAM, and one batch UPDATE runs a few
+    hashes / sorts at once, so RAM / 32 shared by the concurrent sessions, kept between 64MB and 2GB
+    """
+    cur.execute("SELECT pg_size_bytes(current_setting('shared_buffers'))")
+    ram = cur.fetchone()[0] * 4
+    return min(max(ram // 32 // sessions, 64 << 20), 2 << 30)
+
+
+def configure_session(conn, work_mem, sessions=1):
+    with conn.cursor() as cur:
+        if work_mem == "auto":
+            cur.execute("SET work_mem = %s", (format_size(auto_work_mem(cur, sessions)),))
+        elif work_mem != "keep":
+            cur.execute("SET work_mem = %s", (work_mem,))
+        cur.execute("SHOW work_mem")
+        setting = cur.fetchone()[0]
+    conn.commit()
+    return parse_size(setting)
+
+
+def bytes_per_row(cur, job):
+    """Rough working-set size of one pair: both users' repo lists as jsonb and as text[], plus the row itself"""
+    if job["kind"] != "common_repos":
+        return 256
+    cur.execute(sql.SQL("SELECT AVG(pg_column_size({col})) FROM (SELECT {col} FROM {window} LIMIT 10000) s").format(
+        col=sql.Identifier(job["repo_column"]), window=sql.Identifier(job["window"])))
+    avg = cur.fetchone()[0] or 0
+    return int(2 * 3 * float(avg)) + 256
+
+
+# ────── Batch controller ─────────────────────────────────────────────
+class BatchController:
+    """Batch size that converges on target_seconds per batch, within [min_rows, max_rows]"""
+
+    def __init__(self, target_seconds, min_rows, max_rows, start_rows):
+        self.target = target_seconds
+        self.min_rows = min_rows
+        self.max_rows = max(max_rows, min_rows)
+        self.size = min(max(start_rows, min_rows), self.max_rows)
+
+    def observe(self, seconds):
+        factor = self.target / max(seconds, 1e-3)
+        self.size = int(min(max(self.size * min(max(factor, 0.5), 2.0), self.min_rows), self.max_rows))
+
+    def shrink(self):
+        """After an out-of-memory / timeout: half the size; False once the minimum already failed"""
+        if self.size <= self.min_rows:
+            return False
+        self.size = max(self.size // 2, self.min_rows)
+        return True
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m" if seconds >= 3600 else f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def ensure_column(conn, job):
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}").format(
+            sql.Identifier(job["table"]), sql.Identifier(job["column"]), sql.SQL(job["column_type"])))
+        if job["kind"] == "common_repos":
+            cur.execute("SELECT to_regproc('array_intersect') IS NOT NULL AND "
+                        "to_regproc('jsonb_array_to_text_array') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                raise SystemExit("helper functions missing: run the 'Helper Function' part of 06_3_fill_common_repos.sql")
+        else:
+            cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'repos_outside_num'",
+                        (job["window"],))
+            if cur.fetchone() is None:
+                raise SystemExit(f"{job['window']}.repos_outside_num missing: run 06_2_partition_window_and_pair_tables.sql")
+    conn.commit()
+
+
+class ConsoleProgress:
+    """Per-batch progress line and a summary line for one job"""
+
+    def __init__(self, label):
+        self.label = label
+        self.todo = self.done = self.updated = 0
+        self.rate = None
+        self.t_start = time.time()
+
+    def start(self, todo, batch_rows, memory_rows, target):
+        self.todo = todo
+        print(f"{self.label}: {todo} rows to fill in {target}, batch {batch_rows} (memory cap {memory_rows})")
+
+    def retry(self, error, batch_rows):
+        print(f"\n{self.label}: {type(error).__name__}, retrying with {batch_rows} rows")
+
+    def batch(self, pending, updated, seconds, next_rows):
+        self.done += pending
+        self.updated += updated
+        batch_rate = pending / max(seconds, 1e-3)
+        self.rate = batch_rate if self.rate is None else 0.7 * self.rate + 0.3 * batch_rate
+        eta = (self.todo - self.done) / self.rate if self.rate else None
+        print(f"  {self.label}: {self.done}/{self.todo} ({self.done / self.todo * 100:.1f}%), {seconds:.2f}s/batch, "
+              f"{self.rate:.0f} rows/s, ETA {format_eta(eta)}, next batch {next_rows}   ", end="\r")
+
+    def finish(self):
+        if not self.todo:
+            print(f"{self.label}: nothing to do")
+            return
+        left = self.todo - self.updated
+        print(f"\n{self.label}: {self.updated} rows updated in {format_eta(time.time() - self.t_start)}"
+              + (f", {left} left NULL (no matching window)" if left > 0 else ""))
+
+
+def run_job(conn, job, args, work_mem_bytes, table=None, progress=None, key_bounds=(None, None)):
+    """
+    Keyset batches over `table` (the job's table, or one of its partitions) until no key range is left;
+    key_bounds = (after, through) limits the run to the keys in (after, through], None = unbounded.
+    Returns the number of rows updated.
+    """
+    table = table or job["table"]
+    progress = progress or ConsoleProgress(job["name"])
+    ident, column = sql.Identifier(table), sql.Identifier(job["column"])
+    after, through = key_bounds
+    scope, scope_params = key_range(after, False, through)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE {} IS NULL AND {}").format(ident, column, scope),
+                    scope_params)
+        todo = cur.fetchone()[0]
+        cur.execute(sql.SQL("SELECT user1_id, user2_id FROM {} WHERE {} IS NULL AND {} ORDER BY 1, 2 LIMIT 1").format(
+            ident, column, scope), scope_params)
+        first = cur.fetchone()
+        memory_rows = max(work_mem_bytes // bytes_per_row(cur, job), args.min_batch)
+    conn.commit()
+    if not todo:
+        progress.finish()
+        return 0
+
+    controller = BatchController(args.target_seconds, args.min_batch, min(args.max_batch, memory_rows), args.start_batch)
+    progress.start(todo, controller.size, controller.max_rows, f"{table}.{job['column']}")
+
+    lower, inclusive = tuple(first), True
+    updated_total = 0
+    while lower is not None:
+        t0 = time.time()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL statement_timeout = %s", (int(args.target_seconds * 10 * 1000),))
+                cond, params = key_range(lower, inclusive, through)
+                cur.execute(boundary_statement(table, cond), params + [controller.size - 1])
+                upper = cur.fetchone()
+                cond, params = key_range(lower, inclusive, upper or through)
+                cur.execute(update_statement(job, cond, table), params)
+                pending, updated = cur.fetchone()
+            conn.commit()
+        except (errors.OutOfMemory, errors.QueryCanceled) as e:
+            conn.rollback()
+            if not controller.shrink():
+                raise
+            progress.retry(e, controller.size)
+            continue
+
+        seconds = time.time() - t0
+        controller.observe(seconds)
+        updated_total += updated
+        progress.batch(pending, updated, seconds, controller.size)
+        lower, inclusive = (tuple(upper), False) if upper else (None, False)
+
+    progress.finish()
+    return updated_total
+
+
+def add_batch_arguments(parser):
+    parser.add_argument("--target-seconds", type=float, default=2.0, help="wall time to aim for per batch")
+    parser.add_argument("--start-batch", type=int, default=5000)
+    parser.add_argument("--min-batch", type=int, default=200)
+    parser.add_argument("--max-batch", type=int, default=500000)
+    parser.add_argument("--work-mem", default="auto", help="'auto', 'keep' (server default) or a size like 512MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keyset / self-tuning driver for the 06_3 and 08_2 batch updates")
+    parser.add_argument("script", nargs="?", choices=list(JOBS))
+    parser.add_argument("--jobs", nargs="+", default=None, help="subset of the script's jobs (see --list)")
+    parser.add_argument("--list", action="store_true")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+
+    if args.list or not args.script:
+        for script, jobs in JOBS.items():
+            print(f"{script}: {' '.join(job['name'] for job in jobs)}")
+        return
+
+    jobs = JOBS[args.script]
+    if args.jobs:
+        unknown = set(args.jobs) - {job["name"] for job in jobs}
+        if unknown:
+            parser.error(f"unknown jobs for {args.script}: {', '.join(sorted(unknown))}")
+        jobs = [job for job in jobs if job["name"] in args.jobs]
+
+    conn = psycopg2.connect(DB_DSN)
+    work_mem_bytes = configure_session(conn, args.work_mem)
+    print(f"work_mem {format_size(work_mem_bytes)}, target {args.target_seconds}s per batch")
+    try:
+        for job in jobs:
+            ensure_column(conn, job)
+            run_job(conn, job, args, work_mem_bytes)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
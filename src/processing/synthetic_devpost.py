@@ -0,0 +1,399 @@
+######## Goal:
+######## Synthetic Devpost dataset at a configurable scale, so stages 06_1 - 09 can be run and timed at 10x / 100x
+######## of the real data without collecting it (bench_pipeline.py)
+########
+######## Writes the tables in the state 06_1 expects them, i.e. after 05_5, 05_6 and the 08_1 feature columns:
+########   hackathons                 dates, location, hackathon_contributors, hackathon_participants_size
+########   users                      user_id, hash
+########   projects                   one hackathon each, dates = hackathon dates, repo_links / github_repos,
+########                              team sizes and the 08_1 features (h_duration, is_offline_event, hackathon_*)
+########   projects_clean             by 05_6_user_projects_remove_outliers.sql itself (team_contributor_size <= 20)
+########   user_projects              team members of the projects_clean projects
+########   user_proj_repo             2-year before / after window per user_project, repos and repos_outside
+########   user_proj_repo_after_6mon  the same before rows and a 183-day after window (05_3)
+########
+######## Distributions (scale 1 is the size of the current export, ~64k users):
+########   projects per hackathon   lognormal: most hackathons get a few dozen submissions, a few get thousands
+########   team size                1-4 for most teams; ~3% of projects reach more than 20 contributors over their
+########                            lifetime (large upstream repos) and are dropped by the 05_6 cutoff
+########   projects per user        preferential attachment: most users do one hackathon, a long tail does many;
+########                            some teams re-form at a later hackathon within two years (multi-project pairs)
+########   repos per window         lognormal activity per user drawn from a persistent personal pool, plus widely
+########                            shared upstream repos (Zipf), the hackathon repo itself and follow-up repos of
+########                            teams that keep working together; the 6-month window sees the repos first
+########                            touched within 183 days of the event
+########
+######## A run is deterministic for a given --scale and --seed. Memory grows with the scale (the teams and repo
+######## events are held until the windows are written), roughly 1 GB per 10x.
+######## Only a database without these tables, or one created by this script (marker table synthetic_dataset),
+######## is written to; --replace drops such a database's public schema and generates it again.
+########
+######## Usage:
+########   python synthetic_devpost.py --scale 1
+########   python synthetic_devpost.py --scale 10 --seed 7 --replace
+
+import argparse
+import hashlib
+import importlib
+import json
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import psycopg2
+
+# COPY encoder / streaming of the 05_1 loader
+loader = importlib.import_module("05_1_load_user_project")
+DB_DSN = loader.DB_DSN
+
+HERE = Path(__file__).resolve().parent
+OUTLIER_SQL = HERE / "05_6_user_projects_remove_outliers.sql"
+
+BASE_PROJECTS = 40_000
+BASE_HACKATHONS = 1_600
+BASE_POPULAR_REPOS = 5_000
+FIRST_EVENT = datetime(2014, 1, 1, tzinfo=timezone.utc)
+EVENT_SPAN_DAYS = 3_800
+
+WINDOW_2Y = timedelta(days=730)
+WINDOW_6M = timedelta(days=183)
+TEAM_CUTOFF = 20
+
+# team_contributor_size_during of a submission; the tail stops at the 05_6 cutoff
+TEAM_SIZES = list(range(1, TEAM_CUTOFF + 1))
+TEAM_WEIGHTS = [30, 24, 20, 15, 6, 2.5, 1, 0.6] + [0.5 * 0.75 ** k for k in range(TEAM_CUTOFF - 8)]
+LARGE_PROJECT_SHARE = 0.03
+NEW_USER_SHARE = 0.62
+RETURNING_TEAM_SHARE = 0.10
+RETURNING_MEMBER_SHARE = 0.7
+HACK_REPO_AFTER_SHARE = 0.35
+FOLLOWUP_SHARE = 0.20
+FOLLOWUP_MEMBER_SHARE = 0.6
+INACTIVE_USER_SHARE = 0.3
+POPULAR_PER_WINDOW = 0.4
+POPULAR_ZIPF = 1.6
+SIX_MONTH_SHARE = 0.45
+
+DURATION_DAYS = [1, 2, 3, 7, 14, 30, 45, 60]
+DURATION_WEIGHTS = [25, 30, 10, 8, 7, 12, 5, 3]
+ONLINE_SHARE = 0.55
+CITIES = ["San Francisco", "New York", "London", "Toronto", "Berlin", "Bangalore", "Singapore", "Boston"]
+HACK_TYPES = ["online", "in-person", "hybrid"]
+
+TABLES = ["user_proj_repo_after_6mon", "user_proj_repo", "user_projects", "projects_clean", "projects",
+          "users", "hackathons"]
+
+DDL = """
+CREATE TABLE synthetic_dataset (
+    scale NUMERIC NOT NULL,
+    seed INT NOT NULL,
+    row_counts JSONB,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE hackathons (
+    id SERIAL PRIMARY KEY,
+    url TEXT,
+    hack_type TEXT,
+    start_date_format DATE,
+    end_date_format DATE,
+    prizes TEXT,
+    prize_money TEXT,
+    location TEXT,
+    hackathon_contributors INT DEFAULT 0,
+    hackathon_participants_size INTEGER DEFAULT 0
+);
+CREATE TABLE users (
+    user_id TEXT PRIMARY KEY,
+    hash TEXT
+);
+CREATE TABLE projects (
+    project_id SERIAL PRIMARY KEY,
+    project_url TEXT UNIQUE,
+    repo_links TEXT[],
+    start_date TIMESTAMPTZ,
+    end_date TIMESTAMPTZ,
+    github_repos TEXT[],
+    hackathon_url TEXT,
+    contributor_github_username TEXT,
+    team_contributor_size_during INTEGER,
+    h_duration INTEGER,
+    is_offline_event INTEGER,
+    hackathon_contributor_size INTEGER,
+    team_contributor_size INTEGER,
+    hackathon_id INTEGER REFERENCES hackathons(id),
+    hackathon_participants_size INTEGER,
+    hackathon_size INTEGER
+);
+CREATE TABLE user_projects (
+    user_project_id SERIAL PRIMARY KEY,
+    user_id TEXT REFERENCES users(user_id),
+    project_id INT REFERENCES projects(project_id)
+);
+CREATE TABLE user_proj_repo (
+    user_id TEXT REFERENCES users(user_id),
+    project_id INT REFERENCES projects(project_id),
+    window_type TEXT CHECK (window_type IN ('before','after')),
+    window_start_time TIMESTAMPTZ NOT NULL,
+    window_end_time TIMESTAMPTZ NOT NULL,
+    repos JSONB,
+    repos_outside JSONB,
+    PRIMARY KEY (user_id, project_id, window_type)
+);
+CREATE TABLE user_proj_repo_after_6mon (LIKE user_proj_repo INCLUDING ALL);
+"""
+
+INDEXES = """
+CREATE INDEX user_projects_user_project_idx ON user_projects (user_id, project_id);
+SELECT setval(pg_get_serial_sequence('hackathons', 'id'), (SELECT MAX(id) FROM hackathons));
+SELECT setval(pg_get_serial_sequence('projects', 'project_id'), (SELECT MAX(project_id) FROM projects));
+SELECT setval(pg_get_serial_sequence('user_projects', 'user_project_id'), (SELECT MAX(user_project_id) FROM user_projects));
+"""
+
+
+# ────── Model ────────────────────────────────────────────────────────
+class Dataset:
+    """Hackathons, projects, teams and the dated repo events of every user"""
+
+    def __init__(self, scale, seed):
+        self.rng = np.random.default_rng(seed)
+        self.n_hackathons = max(1, round(BASE_HACKATHONS * scale))
+        self.n_projects = max(1, round(BASE_PROJECTS * scale))
+        self.n_popular = max(10, round(BASE_POPULAR_REPOS * scale))
+        self.hackathons = []      # (id, start, end, online)
+        self.projects = []        # (project_id, hackathon_id, members, total_contributors, participants, repos)
+        self.users = []           # login by index
+        self.activity = []        # expected personal repos per 2-year window, by user index
+        self.events = defaultdict(list)   # user index -> [(time, repo)]
+
+    def login(self, u):
+        return self.users[u]
+
+    def new_user(self):
+        u = len(self.users)
+        self.users.append(f"dev-{u + 1:08d}")
+        level = self.rng.lognormal(1.0, 1.1)
+        self.activity.append(level * 0.1 if self.rng.random() < INACTIVE_USER_SHARE else level)
+        return u
+
+    def build(self):
+        rng = self.rng
+        starts = np.sort(rng.integers(0, EVENT_SPAN_DAYS, self.n_hackathons))
+        durations = rng.choice(DURATION_DAYS, self.n_hackathons, p=np.array(DURATION_WEIGHTS) / sum(DURATION_WEIGHTS))
+        for i, (day, length) in enumerate(zip(starts, durations), 1):
+            start = FIRST_EVENT + timedelta(days=int(day))
+            self.hackathons.append((i, start, start + timedelta(days=int(length)), rng.random() < ONLINE_SHARE))
+
+        weights = rng.lognormal(0.0, 1.3, self.n_hackathons)
+        assigned = np.sort(rng.choice(self.n_hackathons, self.n_projects, p=weights / weights.sum()))
+        team_sizes = rng.choice(TEAM_SIZES, self.n_projects, p=np.array(TEAM_WEIGHTS) / sum(TEAM_WEIGHTS))
+
+        seats = []                # one entry per (user, project): preferential attachment
+        teams, team_starts = [], []
+        for pid, (h, size) in enumerate(zip(assigned, team_sizes), 1):
+            _, start, end, _ = self.hackathons[h]
+            size = int(size)
+            participants = size + int(rng.poisson(0.6))
+            if rng.random() < LARGE_PROJECT_SHARE:
+                total = TEAM_CUTOFF + 1 + int(rng.lognormal(3.5, 1.2))
+                owner = f"upstream-{pid}"
+                repos = [f"{owner}/{owner}"]
+                self.projects.append((pid, h + 1, None, total, participants, repos))
+                continue
+
+            members = []
+            recent = bisect_left(team_starts, start - WINDOW_2Y)
+            if size > 1 and recent < len(teams) and rng.random() < RETURNING_TEAM_SHARE:
+                previous = teams[rng.integers(recent, len(teams))]
+                members = [u for u in previous if rng.random() < RETURNING_MEMBER_SHARE][:size]
+            while len(members) < size:
+                u = self.new_user() if not seats or rng.random() < NEW_USER_SHARE else seats[rng.integers(len(seats))]
+                if u not in members:
+                    members.append(u)
+            seats.extend(members)
+            teams.append(members)
+            team_starts.append(start)
+
+            owner = self.login(members[0])
+            repos = [f"{owner}/hack-{pid}"] + ([f"{owner}/hack-{pid}-api"] if rng.random() < 0.15 else [])
+            total = min(TEAM_CUTOFF, size + int(rng.geometric(0.6)) - 1)
+            self.projects.append((pid, h + 1, members, total, participants, repos))
+
+            followup = f"{owner}/{pid}-next" if size > 1 and rng.random() < FOLLOWUP_SHARE else None
+            for u in members:
+                self.events[u].append((start, repos[0]))
+                if rng.random() < HACK_REPO_AFTER_SHARE:
+                    self.events[u].append((end + timedelta(days=float(rng.exponential(60))), repos[0]))
+                if followup and rng.random() < FOLLOWUP_MEMBER_SHARE:
+                    self.events[u].append((end + timedelta(days=float(rng.uniform(0, 730))), followup))
+        return self
+
+    # ────── Windows ──────────────────────────────────────────────────
+    def personal(self, u, level):
+        pool = max(1, int(np.ceil(self.activity[u] * 1.5)))
+        return {f"{self.users[u]}/repo-{k}" for k in self.rng.integers(0, pool, self.rng.poisson(level))}
+
+    def popular(self):
+        ranks = self.rng.zipf(POPULAR_ZIPF, self.rng.poisson(POPULAR_PER_WINDOW))
+        return {f"oss-{r}/core" for r in ranks if r <= self.n_popular}
+
+    def dated(self, u, lo, hi):
+        return {repo for t, repo in self.events[u] if lo <= t < hi}
+
+    def window_rows(self):
+        """(2y rows, 6m after row) per user_project: (user_id, project_id, window_type, start, end, repos, outside)"""
+        for pid, h, members, _, _, repos in self.projects:
+            if members is None:
+                continue
+            _, start, end, _ = self.hackathons[h - 1]
+            own = set(repos)
+            for u in members:
+                level = self.activity[u]
+                before = self.personal(u, level) | self.popular() | self.dated(u, start - WINDOW_2Y, start)
+                after = self.personal(u, level) | self.popular()
+                after_6m = {r for r in after if self.rng.random() < SIX_MONTH_SHARE}
+                after |= self.dated(u, end, end + WINDOW_2Y)
+                after_6m |= self.dated(u, end, end + WINDOW_6M)
+                login = self.users[u]
+                yield (
+                    (login, pid, "before", start - WINDOW_2Y, start, *encode(before, own)),
+                    (login, pid, "after", end, end + WINDOW_2Y, *encode(after, own)),
+                ), (login, pid, "after", end, end + WINDOW_6M, *encode(after_6m, own))
+
+
+def encode(repos, own):
+    """repos and repos_outside (05_5: without the project's own github_repos) as JSON arrays"""
+    repos = sorted(repos)
+    return json.dumps(repos), json.dumps([r for r in repos if r not in own])
+
+
+# ────── Rows ─────────────────────────────────────────────────────────
+def hackathon_rows(data, contributors, participants):
+    for i, start, end, online in data.hackathons:
+        yield (i, f"https://synthetic-{i}.devpost.com/", HACK_TYPES[0] if online else HACK_TYPES[1 + i % 2],
+               start.date(), end.date(), "[]", f"${(i * 7919) % 50 * 1000}",
+               "Online" if online else CITIES[i % len(CITIES)], contributors[i], participants[i])
+
+
+def project_rows(data, contributors, participants):
+    for pid, h, members, total, _, repos in data.projects:
+        _, start, end, online = data.hackathons[h - 1]
+        size = len(members) if members else None
+        yield (pid, f"https://devpost.com/software/synthetic-{pid}", [f"https://github.com/{r}" for r in repos],
+               start, end, repos, f"https://synthetic-{h}.devpost.com/",
+               ",".join(data.login(u) for u in members) if members else None, size,
+               (end - start).days, 0 if online else 1, contributors[h], total, h, participants[h],
+               max(participants[h], contributors[h]))
+
+
+def copy(cur, table, columns, types, rows):
+    return loader.copy_rows(cur, table, columns, types, rows, "text", 10_000, None)
+
+
+# ────── Database ─────────────────────────────────────────────────────
+def prepare_database(cur, replace):
+    cur.execute("SELECT to_regclass('synthetic_dataset') IS NOT NULL")
+    generated = cur.fetchone()[0]
+    cur.execute("SELECT array_remove(ARRAY[" + ", ".join(f"to_regclass('{t}')::text" for t in TABLES) + "], NULL)")
+    existing = cur.fetchone()[0]
+    if generated and replace:
+        cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    elif generated:
+        raise SystemExit("database already holds a synthetic dataset; use --replace to generate it again")
+    elif existing:
+        raise SystemExit(f"database holds tables not created by this script ({', '.join(existing)}); "
+                         "point DB_NAME at a scratch database")
+    cur.execute(DDL)
+
+
+def generate(scale, seed, replace=False):
+    t0 = time.time()
+    data = Dataset(scale, seed).build()
+    print(f"Model: {len(data.hackathons)} hackathons, {len(data.projects)} projects, {len(data.users)} users "
+          f"({time.time() - t0:.1f}s)")
+
+    contributors, participants = Counter(), Counter()
+    for _, h, members, _, n_participants, _ in data.projects:
+        participants[h] += n_participants
+        if members:
+            contributors[h] += len(members)
+
+    conn = psycopg2.connect(DB_DSN)
+    counts = {}
+    try:
+        with conn, conn.cursor() as cur:
+            prepare_database(cur, replace)
+            counts["hackathons"] = copy(cur, "hackathons", (
+                "id", "url", "hack_type", "start_date_format", "end_date_format", "prizes", "prize_money",
+                "location", "hackathon_contributors", "hackathon_participants_size"),
+                ("int4", "text", "text", "date", "date", "text", "text", "text", "int4", "int4"),
+                hackathon_rows(data, contributors, participants))
+            counts["users"] = copy(cur, "users", ("user_id", "hash"), ("text", "text"),
+                                   ((login, hashlib.sha256(login.encode()).hexdigest()) for login in data.users))
+            counts["projects"] = copy(cur, "projects", (
+                "project_id", "project_url", "repo_links", "start_date", "end_date", "github_repos", "hackathon_url",
+                "contributor_github_username", "team_contributor_size_during", "h_duration", "is_offline_event",
+                "hackathon_contributor_size", "team_contributor_size", "hackathon_id", "hackathon_participants_size",
+                "hackathon_size"),
+                ("int4", "text", "text[]", "timestamptz", "timestamptz", "text[]", "text", "text", "int4", "int4",
+                 "int4", "int4", "int4", "int4", "int4", "int4"),
+                project_rows(data, contributors, participants))
+            counts["user_projects"] = copy(cur, "user_projects", ("user_id", "project_id"), ("text", "int4"), (
+                (data.login(u), pid) for pid, _, members, _, _, _ in data.projects if members for u in members))
+            print(f"Loaded hackathons, users, projects, user_projects ({time.time() - t0:.1f}s)")
+
+            columns = ("user_id", "project_id", "window_type", "window_start_time", "window_end_time", "repos",
+                       "repos_outside")
+            types = ("text", "int4", "text", "timestamptz", "timestamptz", "jsonb", "jsonb")
+            after_6m = []
+            def two_year_rows():
+                for pair, after in data.window_rows():
+                    after_6m.append(after)
+                    yield from pair
+            counts["user_proj_repo"] = copy(cur, "user_proj_repo", columns, types, two_year_rows())
+            # before rows are shared with the 2-year table, as 05_3's copy_before_rows does
+            cur.execute(f"""
+                INSERT INTO user_proj_repo_after_6mon ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM user_proj_repo WHERE window_type = 'before'
+            """)
+            counts["user_proj_repo_after_6mon"] = cur.rowcount + copy(
+                cur, "user_proj_repo_after_6mon", columns, types, after_6m)
+            print(f"Loaded window tables ({time.time() - t0:.1f}s)")
+
+            cur.execute(INDEXES)
+            cur.execute(OUTLIER_SQL.read_text(encoding="utf-8"))
+            cur.execute("SELECT COUNT(*) FROM projects_clean")
+            counts["projects_clean"] = cur.fetchone()[0]
+            cur.execute("INSERT INTO synthetic_dataset (scale, seed, row_counts) VALUES (%s, %s, %s)",
+                        (scale, seed, json.dumps(counts)))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    per_user = Counter()
+    for _, _, members, _, _, _ in data.projects:
+        for u in members or ():
+            per_user[u] += 1
+    shares = Counter(min(n, 6) for n in per_user.values())
+    print("Rows: " + ", ".join(f"{t} {n}" for t, n in counts.items()))
+    print("Projects per user: " + ", ".join(
+        f"{'6+' if k == 6 else k} {shares[k] / max(1, len(per_user)):.1%}" for k in sorted(shares)))
+    print(f"Done in {time.time() - t0:.1f}s")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Devpost dataset for the 06-09 stages")
+    parser.add_argument("--scale", type=float, default=1.0, help="size relative to the current export")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--replace", action="store_true", help="drop a previously generated dataset first")
+    args = parser.parse_args()
+    generate(args.scale, args.seed, args.replace)
+
+
+if __name__ == "__main__":
+    main()